@@ -1,4 +1,5 @@
 from aiogram import Router, F
+from aiogram.dispatcher.event.bases import SkipHandler
 from aiogram.types import Message
 
 import asyncio
@@ -8,15 +9,21 @@ import io
 from db import (
     clear_card_listings,
     insert_card_listing,
-    start_csv_photo_session,
-    get_csv_photo_session,
     get_next_unposted_card,
     mark_card_posted,
     count_unposted_cards,
-    clear_session,
+    buffer_photo,
+    take_photo_buffer,
+    advisory_lock,
 )
+from admin_sessions import start_csv_photo_session, get_csv_photo_session
+from claim_events import reset_projections
+from session_store import clear_session
 
 from config import ADMIN_ID, CHANNEL_ID
+from checkout import pregenerate_invoice_drafts
+from claims import claim_keyboard
+from allocation_windows import ALLOC_LIVE, ALLOCATION_MODES, open_window
 
 router = Router()
 
@@ -58,22 +65,37 @@ async def handle_csv_upload(message: Message):
             )
             return
 
+        # Optional `mode` column: live (default), fcfs or lottery
+        bad_modes = {
+            (row.get("mode") or "").strip().lower()
+            for row in rows
+        } - {"", *ALLOCATION_MODES}
+        if bad_modes:
+            await message.answer(
+                "❌ Unknown mode: " + ", ".join(sorted(bad_modes)) +
+                "\nUse one of: " + ", ".join(ALLOCATION_MODES)
+            )
+            return
+
         # ✅ Start Supabase admin photo session
         await start_csv_photo_session(ADMIN_ID)
 
-        # ✅ Clear previous listings
+        # ✅ Clear previous listings (and the old sale's projections)
         await clear_card_listings()
+        await reset_projections()
 
         # ✅ Insert CSV rows into Supabase
         for row in rows:
             name = row["name"].strip()
             price = row["price"].strip()
             qty = int(row["availability"])
+            mode = (row.get("mode") or "").strip().lower() or ALLOC_LIVE
 
             await insert_card_listing(
                 card_name=name,
                 price=price,
                 qty=qty,
+                allocation_mode=mode,
             )
 
         await message.answer(
@@ -93,7 +115,8 @@ async def handle_csv_upload(message: Message):
 # PHOTO UPLOAD SYSTEM AFTER CSV
 # ==========================================================
 
-photo_buffer = {}
+PHOTO_QUIET_SECONDS = 4
+PHOTO_KIND = "card_upload"
 
 
 @router.message(F.chat.type == "private", F.from_user.id == ADMIN_ID, F.photo)
@@ -101,45 +124,48 @@ async def collect_card_photos(message: Message):
 
     sess = await get_csv_photo_session(ADMIN_ID)
     if not sess:
-        return
+        raise SkipHandler()  # let shipping label photos through
 
 
     uid = message.from_user.id
 
-    if uid not in photo_buffer:
-        photo_buffer[uid] = []
-        asyncio.create_task(process_after_delay(uid))
-
-    photo_buffer[uid].append(message)
-
-
-async def process_after_delay(uid):
-
-    await asyncio.sleep(4)
-
-    messages = photo_buffer.get(uid, [])
+    # Shared buffer: album photos may land on different bot instances
+    await buffer_photo(
+        uid,
+        PHOTO_KIND,
+        file_id=message.photo[-1].file_id,
+        file_unique_id=message.photo[-1].file_unique_id,
+        message_id=message.message_id,
+    )
+    asyncio.create_task(process_after_delay(message.bot, uid))
 
-    if not messages:
-        return
 
-    del photo_buffer[uid]
+async def process_after_delay(bot, uid):
 
-    await process_card_upload(messages)
+    # +1s so the quiet check (DB clock) passes for the last photo
+    await asyncio.sleep(PHOTO_QUIET_SECONDS + 1)
 
+    photos = await take_photo_buffer(uid, PHOTO_KIND, PHOTO_QUIET_SECONDS)
 
-async def process_card_upload(messages):
+    if not photos:
+        return  # more photos still coming, or another instance took them
 
-    sess = get_admin_session(ADMIN_ID)
+    await process_card_upload(bot, uid, [p["file_id"] for p in photos])
 
-    if not sess or sess.get("session_type") != "awaiting_card_photos":
-        return
 
-async def process_card_upload(messages):
+async def process_card_upload(bot, uid, file_ids):
 
     sess = await get_csv_photo_session(ADMIN_ID)
     if not sess:
         return
 
+    # One card at a time across instances (next-unposted → post → mark)
+    async with advisory_lock("card_upload"):
+        await _post_next_card(bot, uid, file_ids)
+
+
+async def _post_next_card(bot, uid, file_ids):
+
     card = await get_next_unposted_card()
     if not card:
         await clear_session(ADMIN_ID)
@@ -153,22 +179,22 @@ async def process_card_upload(messages):
     caption = f"{name}\nPrice: {price}\nAvailable: {qty}"
 
     try:
-        if len(messages) == 1:
-            sent = await messages[0].bot.send_photo(
+        if len(file_ids) == 1:
+            sent = await bot.send_photo(
                 chat_id=CHANNEL_ID,
-                photo=messages[0].photo[-1].file_id,
+                photo=file_ids[0],
                 caption=caption
             )
         else:
             from aiogram.types import InputMediaPhoto
 
             media = [
-                InputMediaPhoto(media=m.photo[-1].file_id)
-                for m in messages
+                InputMediaPhoto(media=file_id)
+                for file_id in file_ids
             ]
             media[0].caption = caption
 
-            sent_msgs = await messages[0].bot.send_media_group(
+            sent_msgs = await bot.send_media_group(
                 chat_id=CHANNEL_ID,
                 media=media
             )
@@ -178,22 +204,48 @@ async def process_card_upload(messages):
         print("CHANNEL POST ERROR:", e)
         return
 
+    # Claim / cancel buttons: on the photo itself, or (albums can't
+    # carry a keyboard) on a small message replying to the album
+    claim_buttons = len(file_ids) == 1
+    try:
+        if claim_buttons:
+            await bot.edit_message_reply_markup(
+                chat_id=CHANNEL_ID,
+                message_id=sent.message_id,
+                reply_markup=claim_keyboard(CHANNEL_ID, sent.message_id),
+            )
+        else:
+            await bot.send_message(
+                chat_id=CHANNEL_ID,
+                text=f"👆 {name}",
+                reply_to_message_id=sent.message_id,
+                reply_markup=claim_keyboard(CHANNEL_ID, sent.message_id),
+            )
+    except Exception as e:
+        print("Claim buttons failed:", e)
+        claim_buttons = False
+
     # ✅ Update Supabase with channel message info
     await mark_card_posted(
         card_id=card_id,
         channel_chat_id=CHANNEL_ID,
         channel_message_id=sent.message_id,
+        claim_buttons=claim_buttons,
     )
 
+    if card["allocation_mode"] != ALLOC_LIVE:
+        open_window(bot, (CHANNEL_ID, sent.message_id), card["allocation_mode"])
+
     remaining = await count_unposted_cards()
 
     if remaining > 0:
-        await messages[0].answer(
+        await bot.send_message(
+            uid,
             f"✅ Posted: {name}\n\n"
             f"📸 Upload photo for NEXT card ({remaining} remaining)."
         )
     else:
-        await messages[0].answer("🎉 All cards posted to channel successfully!")
+        await bot.send_message(uid, "🎉 All cards posted to channel successfully!")
         await clear_session(ADMIN_ID)
 
         post_sale_message = (
@@ -208,10 +260,13 @@ async def process_card_upload(messages):
         )
 
         try:
-            await messages[0].bot.send_message(
+            await bot.send_message(
                 chat_id=CHANNEL_ID,
                 text=post_sale_message,
                 parse_mode="HTML"
             )
         except Exception as e:
             print("Failed to send post-sale message:", e)
+
+        # Sale closed → render draft invoices before the /start rush
+        asyncio.create_task(pregenerate_invoice_drafts())
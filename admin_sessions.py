@@ -2,21 +2,72 @@
 
 from typing import Dict, Optional
 
-# In-memory admin session store
-# Keyed by admin_id
-_ADMIN_SESSIONS: Dict[int, Dict[str, Optional[str]]] = {}
+from session_store import (
+    NS_ADMIN,
+    peek_value,
+    set_value,
+    delete_value,
+    set_session,
+    get_session,
+)
+
+# Admin wizard sessions, keyed by admin_id.
+# Stored in the session store's NS_ADMIN namespace, which main.main
+# preloads, so these stay synchronous memory reads.
 
 
 def set_admin_session(admin_id: int, session_type: str, invoice_no: Optional[str]):
-    _ADMIN_SESSIONS[admin_id] = {
+    set_value(NS_ADMIN, admin_id, {
         "session_type": session_type,
         "invoice_no": invoice_no,
-    }
+    })
 
 
 def get_admin_session(admin_id: int) -> Optional[Dict[str, Optional[str]]]:
-    return _ADMIN_SESSIONS.get(admin_id)
+    return peek_value(NS_ADMIN, admin_id)
 
 
 def clear_admin_session(admin_id: int):
-    _ADMIN_SESSIONS.pop(admin_id, None)
+    delete_value(NS_ADMIN, admin_id)
+
+
+# ===========================
+# ADMIN BATCH STATE
+# ===========================
+# Working data of a multi-step admin flow (e.g. batch shipping labels
+# and matches), kept next to the session so any instance can continue.
+
+def set_admin_batch(admin_id: int, data: Dict):
+    set_value(NS_ADMIN, f"{admin_id}:batch", data)
+
+
+def get_admin_batch(admin_id: int) -> Optional[Dict]:
+    return peek_value(NS_ADMIN, f"{admin_id}:batch")
+
+
+def clear_admin_batch(admin_id: int):
+    delete_value(NS_ADMIN, f"{admin_id}:batch")
+
+
+# ===========================
+# ADMIN CSV SESSIONS
+# ===========================
+
+async def start_csv_photo_session(admin_id: int):
+    await set_session(
+        user_id=admin_id,
+        role="admin",
+        session_type="awaiting_card_photos",
+        data={},
+    )
+
+
+async def get_csv_photo_session(admin_id: int):
+    sess = await get_session(admin_id)
+    if not sess:
+        return None
+    if sess["role"] != "admin":
+        return None
+    if sess["session_type"] != "awaiting_card_photos":
+        return None
+    return sess
@@ -0,0 +1,284 @@
+# allocation_windows.py
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot
+
+from claims_repo import allocate_claim_batch
+from cluster import INSTANCE_ID, multi_instance, notify, on_notify
+from db import get_post_thread, json_dumps, json_loads
+from waitlist import note_joined
+
+# Batch allocation for hot cards. A listing with allocation_mode
+# "fcfs" or "lottery" (CSV column `mode`) doesn't take live claims for
+# the first ALLOCATION_WINDOW_SECONDS after posting: claim/cancel
+# replies are only collected in memory. When the window closes the
+# whole batch is allocated in one transaction (arrival order, or a
+# random draw) and announced with one thread reply + one caption edit.
+#
+# The instance that posted the card owns the window. With several
+# instances, the others learn about it over NOTIFY and forward the
+# claims they receive to the owner.
+# Results go to the discussion thread (from a reply claim, else the
+# post's remembered thread); if neither is known, each participant
+# gets a DM. Buyers left without stock join the post's waitlist.
+# A failed allocation is retried, then announced; requests are never
+# dropped silently.
+
+ALLOC_LIVE = "live"
+ALLOC_FCFS = "fcfs"
+ALLOC_LOTTERY = "lottery"
+ALLOCATION_MODES = (ALLOC_LIVE, ALLOC_FCFS, ALLOC_LOTTERY)
+
+ALLOCATION_WINDOW_SECONDS = float(os.getenv("ALLOCATION_WINDOW_SECONDS", "5"))
+ALLOCATION_ATTEMPTS = 3
+ALLOCATION_RETRY_SECONDS = 1.0
+
+WINDOWS_CHANNEL = "bot_alloc_windows"
+REQUESTS_CHANNEL = "bot_alloc_requests"
+
+Post = Tuple[int, int]  # (channel_chat_id, channel_message_id)
+
+# Windows owned here: post → {"mode", "closes_at", "thread", "requests"}
+# requests: user_id → {"user_id", "username", "qty"}, in arrival order
+_windows: Dict[Post, Dict[str, Any]] = {}
+
+# Windows owned by other instances: post → closes_at (unix time)
+_remote: Dict[Post, float] = {}
+
+
+def window_open(post: Post) -> bool:
+    now = time.time()
+    if post in _windows:
+        return True
+    closes_at = _remote.get(post)
+    if closes_at is None:
+        return False
+    if now >= closes_at:
+        del _remote[post]
+        return False
+    return True
+
+
+def _collect(post: Post, req: Dict[str, Any], thread: Optional[Tuple[int, int]]):
+    window = _windows.get(post)
+    if window is None:
+        return
+    if window["thread"] is None and thread:
+        window["thread"] = tuple(thread)
+
+    user_id = req["user_id"]
+    if req["qty"] == 0:  # cancel: withdraw
+        window["requests"].pop(user_id, None)
+    else:
+        window["requests"].setdefault(user_id, req)  # first claim counts
+
+
+async def submit_to_window(
+    post: Post,
+    *,
+    user_id: int,
+    username: Optional[str],
+    qty: Optional[int],
+    thread: Optional[Tuple[int, int]],
+):
+    """
+    qty=None is "claim all", qty=0 withdraws (cancel).
+    thread = (discussion chat id, forwarded post message id), or None
+    for button claims.
+    """
+    req = {"user_id": user_id, "username": username, "qty": qty}
+    if post in _windows:
+        _collect(post, req, thread)
+        return
+
+    await notify(REQUESTS_CHANNEL, json_dumps({
+        "post": list(post),
+        "req": req,
+        "thread": list(thread) if thread else None,
+    }))
+
+
+def open_window(bot: Bot, post: Post, mode: str):
+    """
+    Called right after the card is posted to the channel.
+    """
+    closes_at = time.time() + ALLOCATION_WINDOW_SECONDS
+    _windows[post] = {
+        "mode": mode,
+        "closes_at": closes_at,
+        "thread": None,
+        "requests": {},
+    }
+    if multi_instance():
+        asyncio.create_task(notify(WINDOWS_CHANNEL, json_dumps({
+            "post": list(post),
+            "closes_at": closes_at,
+            "owner": INSTANCE_ID,
+        })))
+    asyncio.create_task(_close_after(bot, post))
+
+
+async def _close_after(bot: Bot, post: Post):
+    await asyncio.sleep(ALLOCATION_WINDOW_SECONDS + 0.5)  # let forwards land
+    window = _windows.pop(post, None)
+    if window is None:
+        return
+
+    requests = list(window["requests"].values())
+    if not requests:
+        return
+
+    res = None
+    for attempt in range(1, ALLOCATION_ATTEMPTS + 1):
+        try:
+            res = await allocate_claim_batch(
+                channel_chat_id=post[0],
+                channel_message_id=post[1],
+                requests=requests,
+                draw=window["mode"] == ALLOC_LOTTERY,
+            )
+            break
+        except Exception as e:
+            print(f"Batch allocation failed (attempt {attempt}):", post, e)
+            if attempt < ALLOCATION_ATTEMPTS:
+                await asyncio.sleep(ALLOCATION_RETRY_SECONDS * attempt)
+
+    if res is None or res["status"] != "ok":
+        await _announce_failure(bot, post, window, requests)
+        return
+
+    await _announce(bot, post, window, res)
+
+
+def _buyer(r: Dict[str, Any]) -> str:
+    return f"@{r['username']}" if r["username"] else f"user {r['user_id']}"
+
+
+async def _results_thread(post: Post, window: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    if window["thread"]:
+        return window["thread"]
+    try:
+        row = await get_post_thread(*post)
+    except Exception as e:
+        print("Thread lookup failed:", post, e)
+        return None
+    if row and row["thread_chat_id"]:
+        return row["thread_chat_id"], row["thread_message_id"]
+    return None
+
+
+async def _send_results(bot: Bot, thread, text: str, dms: Dict[int, str]):
+    """
+    One reply in the thread, or (no thread known) one DM per buyer.
+    """
+    if thread:
+        chat_id, thread_mid = thread
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, reply_to_message_id=thread_mid)
+        except Exception as e:
+            print("Allocation announcement failed:", e)
+        return
+
+    for user_id, dm in dms.items():
+        try:
+            await bot.send_message(user_id, dm)
+        except Exception as e:
+            print("Allocation DM failed:", user_id, e)
+
+
+async def _announce_failure(bot: Bot, post: Post, window: Dict[str, Any], requests):
+    text = "⚠️ This card's claim window couldn't be processed. Nothing was allocated — please claim again."
+    await _send_results(
+        bot,
+        await _results_thread(post, window),
+        text,
+        {r["user_id"]: text for r in requests},
+    )
+
+
+async def _announce(bot: Bot, post: Post, window: Dict[str, Any], res: Dict[str, Any]):
+    # Local imports: claims imports this module
+    from claims import update_card_caption
+    from claims_board import schedule_board_update
+
+    for r in res["waitlisted"]:
+        await note_joined(post, r["user_id"])
+
+    waiting = {r["user_id"]: r["position"] for r in res["waitlisted"]}
+    not_allocated = [r for r in res["losers"] if r["user_id"] not in waiting]
+
+    title = "🎲 Draw results" if window["mode"] == ALLOC_LOTTERY else "⚡ Claim results"
+    lines = [f"{title} — {res['card_name']}", ""]
+    for w in res["winners"]:
+        lines.append(f"✅ {_buyer(w)} x{w['qty']}")
+    if res["waitlisted"]:
+        lines.append("")
+        lines.append("⏳ Waitlist: " + ", ".join(
+            f"{_buyer(r)} (#{r['position']})" for r in res["waitlisted"]
+        ))
+    if not_allocated:
+        lines.append("")
+        lines.append(f"❌ Not allocated: {', '.join(_buyer(r) for r in not_allocated)}")
+    lines.append("")
+    lines.append(f"Remaining: {res['remaining']}")
+
+    dms = {}
+    for w in res["winners"]:
+        dms[w["user_id"]] = f"✅ {res['card_name']}: you got x{w['qty']}."
+    for user_id, position in waiting.items():
+        dms[user_id] = (
+            f"⏳ {res['card_name']}: sold out in the claim window. "
+            f"You're #{position} on the waitlist; freed stock is assigned automatically."
+        )
+    for r in not_allocated:
+        dms[r["user_id"]] = f"❌ {res['card_name']}: not allocated."
+
+    thread = await _results_thread(post, window)
+    await _send_results(bot, thread, "\n".join(lines), dms)
+
+    if res["winners"]:
+        schedule_board_update(
+            bot,
+            post,
+            card_name=res["card_name"],
+            remaining=res["remaining"],
+            thread=thread,
+        )
+        await update_card_caption(
+            bot,
+            post[0],
+            post[1],
+            res["card_name"],
+            res["price"],
+            res["remaining"],
+            res["claim_buttons"],
+        )
+
+
+# ===========================
+# CROSS-INSTANCE
+# ===========================
+
+def _on_remote_window(payload: str):
+    msg = json_loads(payload)
+    if msg["owner"] == INSTANCE_ID:
+        return
+    _remote[tuple(msg["post"])] = msg["closes_at"]
+
+
+def _on_remote_request(payload: str):
+    msg = json_loads(payload)
+    _collect(tuple(msg["post"]), msg["req"], msg["thread"])
+
+
+def init_allocation_windows():
+    """
+    Called once from main.main before start_cluster.
+    """
+    if multi_instance():
+        on_notify(WINDOWS_CHANNEL, _on_remote_window)
+        on_notify(REQUESTS_CHANNEL, _on_remote_request)
@@ -0,0 +1,87 @@
+# bench_checkout_state.py
+"""
+Resident memory of per-buyer checkout state: the old free-form dict
+vs the slotted CheckoutState, measured with tracemalloc.
+
+Usage:
+    python bench_checkout_state.py [buyers]
+"""
+import sys
+import tracemalloc
+
+from checkout_state import CheckoutState, CheckoutStage, ShippingAddress
+
+BUYERS = 100_000
+
+
+def make_dict(i: int, with_address: bool):
+    total = 10.0 + i % 90
+    state = {
+        "stage": "confirm_address" if with_address else "awaiting_payment",
+        "cards_total": total,
+        "delivery_fee": 3.5,
+        "total": total + 3.5,
+        "invoice_no": f"INV-{1_700_000_000 + i}",
+        "delivery_method": "tracked",
+        "temp_address": None,
+    }
+    if with_address:
+        state["temp_address"] = {
+            "name": f"Buyer {i}",
+            "street": f"{i % 900} Woodlands St 81",
+            "unit": f"#{i % 20:02d}-{i % 300:03d}",
+            "postal": f"{730000 + i % 9999}",
+            "phone": f"9{i:07d}",
+        }
+    return state
+
+
+def make_state(i: int, with_address: bool):
+    total = 10.0 + i % 90
+    address = None
+    if with_address:
+        address = ShippingAddress(
+            name=f"Buyer {i}",
+            street=f"{i % 900} Woodlands St 81",
+            unit=f"#{i % 20:02d}-{i % 300:03d}",
+            postal=f"{730000 + i % 9999}",
+            phone=f"9{i:07d}",
+        )
+    return CheckoutState(
+        stage=CheckoutStage.CONFIRM_ADDRESS if with_address else CheckoutStage.AWAITING_PAYMENT,
+        cards_total=total,
+        delivery_fee=3.5,
+        invoice_no=f"INV-{1_700_000_000 + i}",
+        delivery_method="tracked",
+        temp_address=address,
+    )
+
+
+def measure(factory, buyers: int, with_address: bool) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    states = {user_id: factory(user_id, with_address) for user_id in range(buyers)}
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del states
+    return after - before
+
+
+def main():
+    buyers = int(sys.argv[1]) if len(sys.argv) > 1 else BUYERS
+
+    print(f"{buyers} buyers (includes the user_id → state dict)")
+    print(f"{'state':<16} | {'layout':<13} | {'total MB':>9} | {'bytes/buyer':>11}")
+    print("-" * 60)
+
+    for with_address in (False, True):
+        label = "with address" if with_address else "no address"
+        for layout, factory in (("dict", make_dict), ("CheckoutState", make_state)):
+            used = measure(factory, buyers, with_address)
+            print(
+                f"{label:<16} | {layout:<13} | {used / 1e6:>9.1f} | {used / buyers:>11.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
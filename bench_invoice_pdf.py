@@ -0,0 +1,74 @@
+# bench_invoice_pdf.py
+"""
+Times the invoice renderer as the render workers run it
+(invoice_drafts.init_render_process): the first render (logo/QR
+prepared) and steady-state renders after that.
+
+Usage:
+    python bench_invoice_pdf.py [repeats]
+"""
+import sys
+import time
+
+from invoice_drafts import init_render_process
+from invoice_pdf import build_invoice_pdf
+
+ITEM_COUNTS = [1, 10, 100, 500]
+
+
+def make_items(n: int):
+    return [
+        {"name": f"Test Card #{i:03d}/195", "qty": 1 + i % 3, "price": f"${2 + i % 40}"}
+        for i in range(n)
+    ]
+
+
+def render(items):
+    cards_total = sum(float(it["price"].strip("$")) * it["qty"] for it in items)
+    return build_invoice_pdf(
+        invoice_no="INV-000001",
+        delivery_method="tracked",
+        cards_total_sgd=cards_total,
+        delivery_fee_sgd=3.50,
+        total_sgd=cards_total + 3.50,
+        paynow_number="93385994",
+        paynow_name="Naufal",
+        buyer_username="bench_user",
+        buyer_address="Name: Ash\nStreet Name: Pallet Town Rd\nPostal Code: 123456",
+        items=items,
+    )
+
+
+def time_render(items, repeats: int):
+    best = float("inf")
+    total = 0.0
+    size = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pdf = render(items)
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+        size = len(pdf)
+    return total / repeats, best, size
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    init_render_process()
+
+    start = time.perf_counter()
+    render(make_items(1))
+    print(f"first render (prepares images): {(time.perf_counter() - start) * 1000:.2f} ms")
+    print()
+
+    print(f"{'items':>6} | {'mean ms':>9} | {'best ms':>9} | {'bytes':>9}")
+    print("-" * 43)
+
+    for n in ITEM_COUNTS:
+        mean, best, size = time_render(make_items(n), repeats)
+        print(f"{n:>6} | {mean * 1000:>9.2f} | {best * 1000:>9.2f} | {size:>9}")
+
+
+if __name__ == "__main__":
+    main()
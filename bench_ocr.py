@@ -0,0 +1,105 @@
+# bench_ocr.py
+"""
+Label OCR benchmark: legacy fixed-threshold vs NumPy ROI pipeline.
+
+Usage:
+    OCR_ENABLED=1 python bench_ocr.py <folder>
+
+Expected tracking numbers come from <folder>/expected.csv
+(columns: filename,tracking) or, failing that, from a tracking
+number embedded in each file name (e.g. RR123456789SG.jpg).
+"""
+import csv
+import os
+import re
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from ocr_utils import (
+    ocr_available,
+    ocr_image_bytes,
+    extract_tracking_number,
+    pytesseract,
+)
+from ocr_preprocess import legacy_threshold, numpy_available
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+NAME_TRACKING = re.compile(r"[A-Z]{2}\d{9}SG")  # expected number in a file name
+
+
+def load_expected(folder: str):
+    expected = {}
+    path = os.path.join(folder, "expected.csv")
+    if os.path.exists(path):
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                expected[row["filename"]] = row["tracking"].strip().upper()
+
+    for name in os.listdir(folder):
+        if os.path.splitext(name)[1].lower() not in IMAGE_EXTS:
+            continue
+        if name not in expected:
+            m = NAME_TRACKING.search(name.upper())
+            expected[name] = m.group(0) if m else None
+    return expected
+
+
+def legacy_pipeline(data: bytes) -> str:
+    image = Image.open(BytesIO(data))
+    return pytesseract.image_to_string(legacy_threshold(image))
+
+
+def run(label: str, fn, samples):
+    total = 0.0
+    correct = 0
+    scored = 0
+
+    for name, data, want in samples:
+        start = time.perf_counter()
+        text = fn(data)
+        total += time.perf_counter() - start
+
+        got = extract_tracking_number(text)
+        if want:
+            scored += 1
+            correct += int(got == want)
+
+    n = len(samples)
+    acc = f"{correct}/{scored} ({correct / scored:.0%})" if scored else "n/a"
+    print(f"{label:<8} | {total / n * 1000:>10.1f} ms/image | accuracy {acc}")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    if not ocr_available():
+        print("OCR unavailable: set OCR_ENABLED=1 and install pytesseract.")
+        sys.exit(1)
+
+    folder = sys.argv[1]
+    expected = load_expected(folder)
+
+    samples = []
+    for name in sorted(expected):
+        with open(os.path.join(folder, name), "rb") as f:
+            samples.append((name, f.read(), expected[name]))
+
+    if not samples:
+        print("No label images found.")
+        sys.exit(1)
+
+    print(f"{len(samples)} images from {folder}")
+    run("legacy", legacy_pipeline, samples)
+    if numpy_available():
+        run("numpy", ocr_image_bytes, samples)
+    else:
+        print("numpy not installed — skipping ROI pipeline")
+
+
+if __name__ == "__main__":
+    main()
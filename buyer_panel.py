@@ -4,15 +4,13 @@ from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, BufferedInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from invoice_pdf import build_invoice_pdf
+from invoice_drafts import render_invoice
+from session_store import set_session, get_session, clear_session
 
 from db import (
     get_orders_by_user,
     get_latest_order_by_user,
     get_active_claims_by_user,
-    set_session,
-    get_session,
-    clear_session,
     get_pool,
     STATUS_AWAITING_PAYMENT,
     STATUS_VERIFYING,
@@ -186,7 +184,7 @@ async def resend_invoice(message: Message):
     await message.answer("🕯️ Summoning your invoice scroll…")
 
     try:
-        pdf = build_invoice_pdf(
+        pdf = await render_invoice(
             invoice_no=order["invoice_no"],
             delivery_method=order["delivery_method"],
             cards_total_sgd=float(order["cards_total"] or 0),
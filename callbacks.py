@@ -35,4 +35,13 @@ class PackingActionCB(CallbackData, prefix="pack"):
     action: str   # packed
     invoice: str
 
+class BatchShipCB(CallbackData, prefix="shipbatch"):
+    action: str   # confirm / cancel
 
+
+# ===== CHANNEL POSTS =====
+
+class ClaimButtonCB(CallbackData, prefix="cl"):
+    action: str   # claim / cancel
+    chat: int     # channel post key
+    mid: int
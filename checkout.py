@@ -1,6 +1,7 @@
 # checkout.py
+import asyncio
 import re
-from datetime import datetime, timezone
+from itertools import groupby
 
 from aiogram import Router, F
 from aiogram.filters import Command
@@ -17,13 +18,28 @@ from db import (
     get_stale_claims_for_user,
     cancel_all_claims_for_user,
     get_user_claims_summary,
+    get_all_claims_summaries,
+    create_order_from_claims,
+    mark_order_payment_received,
+    PRICE_PATTERN,
     set_payment_proof,
     get_checkout_by_invoice,
 )
 
+from checkout_state import CheckoutStage, ShippingAddress
 from checkout_store import get_checkout, upsert_checkout
 
-from invoice_pdf import build_invoice_pdf
+from invoice_drafts import (
+    claims_fingerprint,
+    render_invoice,
+    store_draft,
+    take_draft,
+    peek_draft_invoice_no,
+    clear_drafts,
+    draft_count,
+)
+from invoice_numbers import next_invoice_no
+from waitlist import notify_promoted
 from callbacks import PaymentReviewCB
 
 router = Router()
@@ -35,6 +51,7 @@ PAYNOW_NUMBER = "93385994"
 PAYNOW_NAME = "Naufal"
 
 TRACKED_FEE_SGD = 3.50
+DRAFT_DELIVERY_METHOD = "tracked"  # method assumed for sale-close drafts
 SELF_PICKUP_TEXT = "806 Woodlands St 81, in front of Rainbow Mart"
 
 # =========================
@@ -69,13 +86,13 @@ def parse_address_block(text: str):
     if any(not data.get(f) for f in ADDRESS_FIELDS):
         return None
 
-    return {
-        "name": data["Name"].strip(),
-        "street": data["Street Name"].strip(),
-        "unit": data["Unit Number"].strip(),
-        "postal": re.sub(r"\s+", "", data["Postal Code"]),
-        "phone": re.sub(r"\s+", "", data["Phone Number"]),
-    }
+    return ShippingAddress(
+        name=data["Name"].strip(),
+        street=data["Street Name"].strip(),
+        unit=data["Unit Number"].strip(),
+        postal=re.sub(r"\s+", "", data["Postal Code"]),
+        phone=re.sub(r"\s+", "", data["Phone Number"]),
+    )
 
 def address_template():
     return (
@@ -125,18 +142,15 @@ def kb_continue():
 def parse_price_to_float(price_str: str) -> float:
     """
     Converts price strings like:
-    "$12", "SGD 12", "12.50" → 12.0 / 12.5
+    "$12", "SGD 12", "12.50", "$1,200" → 12.0 / 12.5 / 1200.0
+    Same rule as the order's SQL (db.PRICE_PATTERN): commas dropped,
+    then the first number wins.
     """
     if price_str is None:
         return 0.0
 
-    s = str(price_str).upper().strip()
-    s = s.replace("SGD", "").replace("$", "").strip()
-
-    try:
-        return float(s)
-    except ValueError:
-        return 0.0
+    m = re.search(PRICE_PATTERN, str(price_str).replace(",", ""))
+    return float(m.group(0)) if m else 0.0
 
 
 # =========================
@@ -160,6 +174,88 @@ def format_claim_summary(items):
     lines.append(f"\n<b>Total: ${total:.2f} SGD</b>")
     return "\n".join(lines), total
 
+# =========================
+# INVOICE RENDERING
+# =========================
+def invoice_render_kwargs(
+    *,
+    invoice_no: str,
+    items,
+    delivery_method: str,
+    cards_total: float,
+    delivery_fee: float,
+    username: str,
+):
+    return dict(
+        invoice_no=invoice_no,
+        delivery_method=delivery_method,
+        cards_total_sgd=cards_total,
+        delivery_fee_sgd=delivery_fee,
+        total_sgd=cards_total + delivery_fee,
+        paynow_number=PAYNOW_NUMBER,
+        paynow_name=PAYNOW_NAME,
+        buyer_username=username,
+        buyer_address="Address to be provided after payment",
+        items=[
+            {
+                "name": it["card_name"],
+                "qty": it["qty"],
+                "price": parse_price_to_float(it["price"]),
+            }
+            for it in items
+        ],
+    )
+
+
+async def pregenerate_invoice_drafts():
+    """
+    Sale-close job: renders a draft invoice for every claimant in
+    worker processes, so the post-sale /start rush mostly serves
+    cached PDFs. checkout_continue re-renders only when claims,
+    delivery method or username differ from the draft.
+    """
+    clear_drafts()
+
+    rows = await get_all_claims_summaries()
+    fee = TRACKED_FEE_SGD if DRAFT_DELIVERY_METHOD == "tracked" else 0.0
+
+    async def render_one(user_id: int, items):
+        username = items[0]["username"] or ""
+        _, cards_total = format_claim_summary(items)
+        invoice_no = await next_invoice_no()
+
+        try:
+            pdf = await render_invoice(
+                **invoice_render_kwargs(
+                    invoice_no=invoice_no,
+                    items=items,
+                    delivery_method=DRAFT_DELIVERY_METHOD,
+                    cards_total=cards_total,
+                    delivery_fee=fee,
+                    username=username,
+                )
+            )
+        except Exception as e:
+            print("Invoice draft failed:", user_id, e)
+            return
+
+        store_draft(
+            user_id,
+            fingerprint=claims_fingerprint(items),
+            delivery_method=DRAFT_DELIVERY_METHOD,
+            username=username,
+            invoice_no=invoice_no,
+            total=cards_total + fee,
+            pdf=pdf,
+        )
+
+    await asyncio.gather(*(
+        render_one(user_id, list(group))
+        for user_id, group in groupby(rows, key=lambda r: r["user_id"])
+    ))
+
+    print(f"Invoice drafts ready: {draft_count()}")
+
 # =========================
 # /start — BUYER HOME
 # =========================
@@ -167,10 +263,11 @@ def format_claim_summary(items):
 async def dm_start(message: Message):
     user_id = message.from_user.id
 
-    # Auto-cancel stale claims (24h)
+    # Auto-cancel stale claims (24h); claims already on an order are kept
     stale = await get_stale_claims_for_user(user_id=user_id, hours=24)
     if stale:
-        await cancel_all_claims_for_user(user_id)
+        promoted = await cancel_all_claims_for_user(user_id)
+        await notify_promoted(message.bot, promoted)
         await message.answer(
             "⏰ <b>Your claims expired</b>\n\n"
             "Claims are held for <b>24 hours</b>.\n"
@@ -181,7 +278,7 @@ async def dm_start(message: Message):
 
     items = await get_user_claims_summary(user_id)
     if not items:
-        await upsert_checkout(user_id, stage="idle")
+        await upsert_checkout(user_id, stage=CheckoutStage.IDLE)
         await message.answer(
             "🎴 <b>NightShade Poké Claims</b>\n\n"
             "Reply <b>claim</b> under a card post to reserve it.\n"
@@ -195,10 +292,9 @@ async def dm_start(message: Message):
 
     await upsert_checkout(
         user_id,
-        stage="choose_delivery",
+        stage=CheckoutStage.CHOOSE_DELIVERY,
         cards_total=total,
-        delivery_fee=0,
-        total=total,
+        delivery_fee=0.0,
         invoice_no=None,
         delivery_method=None,
     )
@@ -226,9 +322,9 @@ async def buyer_go_delivery(cb: CallbackQuery):
 @router.callback_query(F.data.startswith("checkout:delivery:"))
 async def delivery_pick(cb: CallbackQuery):
     user_id = cb.from_user.id
-    ck = await get_checkout(user_id) or {}
+    ck = await get_checkout(user_id)
 
-    if ck.get("stage") != "choose_delivery":
+    if not ck or ck.stage is not CheckoutStage.CHOOSE_DELIVERY:
         await cb.answer()
         return
 
@@ -244,15 +340,11 @@ async def delivery_pick(cb: CallbackQuery):
         await cb.answer()
         return
 
-    cards_total = float(ck.get("cards_total") or 0)
-    total = cards_total + fee
-
     await upsert_checkout(
         user_id,
-        stage="awaiting_confirm",
+        stage=CheckoutStage.AWAITING_CONFIRM,
         delivery_method=method,
         delivery_fee=fee,
-        total=total,
     )
 
     await cb.message.answer("Ready to generate invoice?", reply_markup=kb_continue())
@@ -266,44 +358,60 @@ async def checkout_continue(cb: CallbackQuery):
     await cb.answer("Generating invoice…")
 
     user_id = cb.from_user.id
-    ck = await get_checkout(user_id) or {}
+    ck = await get_checkout(user_id)
 
-    if ck.get("stage") != "awaiting_confirm":
+    if not ck or ck.stage is not CheckoutStage.AWAITING_CONFIRM:
         return
 
-    items = await get_user_claims_summary(user_id)
+    delivery_fee = ck.delivery_fee
+    delivery_method = ck.delivery_method
+    username = cb.from_user.username or ""
+
+    # Order + order_items are written from the claims in one round trip;
+    # the returned lines are what the invoice shows
+    invoice_no = peek_draft_invoice_no(user_id) or await next_invoice_no()
+    items = await create_order_from_claims(
+        user_id=user_id,
+        username=username,
+        invoice_no=invoice_no,
+        delivery_method=delivery_method,
+        delivery_fee=delivery_fee,
+    )
     if not items:
         await cb.message.answer("⚠️ No active claims.")
         return
 
-    summary, cards_total = format_claim_summary(items)
-    delivery_fee = float(ck.get("delivery_fee") or 0)
-    total = cards_total + delivery_fee
+    cards_total = float(items[0]["cards_total"])
+    total = float(items[0]["total"])
 
-    invoice_no = f"INV-{int(datetime.now(timezone.utc).timestamp())}"
-
-    await upsert_checkout(
+    # Reuse the sale-close draft when nothing changed since
+    draft = take_draft(
         user_id,
-        stage="awaiting_payment",
-        invoice_no=invoice_no
+        fingerprint=claims_fingerprint(items),
+        delivery_method=delivery_method,
+        username=username,
+        total=total,
     )
 
-    invoice_items = [
-        {"name": it["card_name"], "qty": it["qty"], "price": it["price"]}
-        for it in items
-    ]
+    if draft:
+        pdf = draft["pdf"]
+    else:
+        pdf = await render_invoice(
+            **invoice_render_kwargs(
+                invoice_no=invoice_no,
+                items=items,
+                delivery_method=delivery_method,
+                cards_total=cards_total,
+                delivery_fee=delivery_fee,
+                username=username,
+            )
+        )
 
-    pdf = build_invoice_pdf(
-        invoice_no=invoice_no,
-        delivery_method=ck["delivery_method"],
-        cards_total_sgd=cards_total,
-        delivery_fee_sgd=delivery_fee,
-        total_sgd=total,
-        paynow_number=PAYNOW_NUMBER,
-        paynow_name=PAYNOW_NAME,
-        buyer_username=cb.from_user.username or "",
-        buyer_address="Address to be provided after payment",
-        items=invoice_items,
+    await upsert_checkout(
+        user_id,
+        stage=CheckoutStage.AWAITING_PAYMENT,
+        cards_total=cards_total,
+        invoice_no=invoice_no
     )
 
     await cb.message.answer_document(
@@ -321,20 +429,22 @@ async def checkout_continue(cb: CallbackQuery):
 # =========================
 @router.message(F.chat.type == "private", (F.photo | F.document))
 async def payment_proof_received(message: Message):
-    ck = await get_checkout(message.from_user.id) or {}
-    if ck.get("stage") != "awaiting_payment":
+    ck = await get_checkout(message.from_user.id)
+    if not ck or ck.stage is not CheckoutStage.AWAITING_PAYMENT:
         return
 
-    invoice_no = ck.get("invoice_no")
+    invoice_no = ck.invoice_no
     if not invoice_no:
         return
 
+    await mark_order_payment_received(invoice_no, message.from_user.id)
+
     if message.photo:
         set_payment_proof(invoice_no, message.photo[-1].file_id, "photo")
     elif message.document:
         set_payment_proof(invoice_no, message.document.file_id, "document")
 
-    await upsert_checkout(message.from_user.id, stage="payment_submitted")
+    await upsert_checkout(message.from_user.id, stage=CheckoutStage.PAYMENT_SUBMITTED)
 
     await message.answer(
         "✅ Payment proof received.\nPlease wait for admin approval."
@@ -358,9 +468,9 @@ async def payment_proof_received(message: Message):
 @router.message(F.chat.type == "private")
 async def capture_address(message: Message):
     user_id = message.from_user.id
-    ck = await get_checkout(user_id) or {}
+    ck = await get_checkout(user_id)
 
-    if ck.get("stage") != "awaiting_address":
+    if not ck or ck.stage is not CheckoutStage.AWAITING_ADDRESS:
         return  # ignore unrelated messages
 
     parsed = parse_address_block(message.text)
@@ -376,17 +486,17 @@ async def capture_address(message: Message):
     # Temporarily store address in checkout session
     await upsert_checkout(
         user_id,
-        stage="confirm_address",
-        temp_address=parsed  # stored as JSON / dict
+        stage=CheckoutStage.CONFIRM_ADDRESS,
+        temp_address=parsed
     )
 
     preview = (
         "📦 <b>Please confirm your shipping address</b>\n\n"
-        f"<b>Name:</b> {parsed['name']}\n"
-        f"<b>Street:</b> {parsed['street']}\n"
-        f"<b>Unit:</b> {parsed['unit']}\n"
-        f"<b>Postal:</b> {parsed['postal']}\n"
-        f"<b>Phone:</b> {parsed['phone']}\n\n"
+        f"<b>Name:</b> {parsed.name}\n"
+        f"<b>Street:</b> {parsed.street}\n"
+        f"<b>Unit:</b> {parsed.unit}\n"
+        f"<b>Postal:</b> {parsed.postal}\n"
+        f"<b>Phone:</b> {parsed.phone}\n\n"
         "Is this correct?"
     )
 
@@ -399,14 +509,14 @@ async def capture_address(message: Message):
 @router.callback_query(F.data == "checkout:address:confirm")
 async def address_confirm(cb: CallbackQuery):
     user_id = cb.from_user.id
-    ck = await get_checkout(user_id) or {}
+    ck = await get_checkout(user_id)
 
-    if ck.get("stage") != "confirm_address":
+    if not ck or ck.stage is not CheckoutStage.CONFIRM_ADDRESS:
         await cb.answer()
         return
 
-    addr = ck.get("temp_address")
-    invoice_no = ck.get("invoice_no")
+    addr = ck.temp_address
+    invoice_no = ck.invoice_no
 
     if not addr or not invoice_no:
         await cb.message.answer("❌ Address session expired. Please try again.")
@@ -417,7 +527,7 @@ async def address_confirm(cb: CallbackQuery):
     # Persist address to DB
     await save_shipping_address(
         invoice_no=invoice_no,
-        **addr
+        **addr._asdict()
     )
 
      # Move order status to packing (Supabase)
@@ -436,7 +546,7 @@ async def address_confirm(cb: CallbackQuery):
     # Move order forward
     await upsert_checkout(
         user_id,
-        stage="packing",
+        stage=CheckoutStage.PACKING,
         temp_address=None
     )
 
@@ -469,7 +579,7 @@ async def address_reenter(cb: CallbackQuery):
 
     await upsert_checkout(
         user_id,
-        stage="awaiting_address",
+        stage=CheckoutStage.AWAITING_ADDRESS,
         temp_address=None
     )
 
@@ -0,0 +1,103 @@
+# checkout_state.py
+
+import sys
+from enum import Enum
+from typing import Any, Dict, NamedTuple, Optional
+
+# Typed per-buyer checkout state. Kept resident for the whole sale
+# (see checkout_store), so it is slotted: no per-instance __dict__,
+# an enum stage instead of free strings, and a tuple-sized address.
+# Stored (backend / journal) as the same plain dict as before.
+
+
+class CheckoutStage(str, Enum):
+    IDLE = "idle"
+    CHOOSE_DELIVERY = "choose_delivery"
+    AWAITING_CONFIRM = "awaiting_confirm"
+    AWAITING_PAYMENT = "awaiting_payment"
+    PAYMENT_SUBMITTED = "payment_submitted"
+    AWAITING_ADDRESS = "awaiting_address"
+    CONFIRM_ADDRESS = "confirm_address"
+    PACKING = "packing"
+
+
+class ShippingAddress(NamedTuple):
+    name: str
+    street: str
+    unit: str
+    postal: str
+    phone: str
+
+
+class CheckoutState:
+    __slots__ = (
+        "stage",
+        "cards_total",
+        "delivery_fee",
+        "invoice_no",
+        "delivery_method",
+        "temp_address",
+    )
+
+    def __init__(
+        self,
+        stage: CheckoutStage = CheckoutStage.IDLE,
+        cards_total: float = 0.0,
+        delivery_fee: float = 0.0,
+        invoice_no: Optional[str] = None,
+        delivery_method: Optional[str] = None,
+        temp_address: Optional[ShippingAddress] = None,
+    ):
+        self.stage = stage
+        self.cards_total = cards_total
+        self.delivery_fee = delivery_fee
+        self.invoice_no = invoice_no
+        self.delivery_method = delivery_method
+        self.temp_address = temp_address
+
+    @property
+    def total(self) -> float:
+        return self.cards_total + self.delivery_fee
+
+    def __repr__(self):
+        return (
+            f"CheckoutState(stage={self.stage.value!r}, total={self.total:.2f}, "
+            f"invoice_no={self.invoice_no!r}, delivery_method={self.delivery_method!r})"
+        )
+
+    # =========================
+    # STORAGE FORM
+    # =========================
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "stage": self.stage.value,
+            "cards_total": self.cards_total,
+            "delivery_fee": self.delivery_fee,
+            "total": self.total,
+        }
+        if self.invoice_no:
+            data["invoice_no"] = self.invoice_no
+        if self.delivery_method:
+            data["delivery_method"] = self.delivery_method
+        if self.temp_address:
+            data["temp_address"] = self.temp_address._asdict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CheckoutState":
+        try:
+            stage = CheckoutStage(data.get("stage") or CheckoutStage.IDLE)
+        except ValueError:
+            stage = CheckoutStage.IDLE
+
+        method = data.get("delivery_method")
+        addr = data.get("temp_address")
+
+        return cls(
+            stage=stage,
+            cards_total=float(data.get("cards_total") or 0),
+            delivery_fee=float(data.get("delivery_fee") or 0),
+            invoice_no=data.get("invoice_no"),
+            delivery_method=sys.intern(method) if method else None,
+            temp_address=ShippingAddress(**addr) if addr else None,
+        )
@@ -1,30 +1,43 @@
 # checkout_store.py
 
-from typing import Dict, Any
+from checkout_state import CheckoutState
+from session_store import (
+    NS_CHECKOUT,
+    get_value,
+    set_value,
+    delete_value,
+    register_codec,
+)
 
-# In-memory checkout state
-# Keyed by Telegram user_id
-_CHECKOUT_STORE: Dict[int, Dict[str, Any]] = {}
+# Checkout state, keyed by Telegram user_id.
+# Lives in the session store (LRU/TTL memory tier, write-back to the
+# configured backend), so it survives restarts and stays bounded.
+# Held in memory as CheckoutState; stored as a plain dict.
 
+register_codec(NS_CHECKOUT, CheckoutState.to_dict, CheckoutState.from_dict)
 
-async def get_checkout(user_id: int) -> Dict[str, Any] | None:
+
+async def get_checkout(user_id: int) -> CheckoutState | None:
     """
     Retrieve checkout state for a user.
     """
-    return _CHECKOUT_STORE.get(user_id)
+    return await get_value(NS_CHECKOUT, user_id)
 
 
-async def upsert_checkout(user_id: int, **data):
+async def upsert_checkout(user_id: int, **fields) -> CheckoutState:
     """
     Create or update checkout state for a user.
+    Fields are CheckoutState attributes (unknown names raise).
     """
-    current = _CHECKOUT_STORE.get(user_id, {})
-    current.update(data)
-    _CHECKOUT_STORE[user_id] = current
+    current = await get_value(NS_CHECKOUT, user_id) or CheckoutState()
+    for name, value in fields.items():
+        setattr(current, name, value)
+    set_value(NS_CHECKOUT, user_id, current)
+    return current
 
 
 async def clear_checkout(user_id: int):
     """
     Remove checkout state (after order completion or cancellation).
     """
-    _CHECKOUT_STORE.pop(user_id, None)
+    delete_value(NS_CHECKOUT, user_id)
@@ -0,0 +1,412 @@
+# claim_events.py
+
+import asyncio
+import html
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from cluster import multi_instance, notify, on_notify
+from db import get_pool
+
+# Append-only claim history. Every claim mutation writes one event per
+# (post, user) in the same transaction as the claims / card_listing
+# change, so the log and the rows can't disagree.
+#
+# Projections (remaining stock per post, each buyer's bag, claim order
+# per post) are derived by replaying the log: in memory, incrementally
+# (refresh_projections reads only events after the last one seen), and
+# in SQL for stock drift checks.
+#
+# Only the posts in card_listing (the current sale) are projected: a
+# rebuild replays just their events, and when the listings are cleared
+# every instance drops the old sale (reset_projections).
+
+EV_CLAIMED = "claimed"
+EV_CANCELLED = "cancelled"
+EV_EXPIRED = "expired"
+EV_ADMIN_CANCELLED = "admin_cancelled"
+
+RELEASE_EVENTS = (EV_CANCELLED, EV_EXPIRED, EV_ADMIN_CANCELLED)
+
+Post = Tuple[int, int]  # (channel_chat_id, channel_message_id)
+
+# A skipped id may be a transaction that hasn't committed yet; keep
+# asking for it this long before treating it as rolled back
+GAP_RETRY_SECONDS = 30
+MAX_GAP_TRACK = 64  # in-flight transactions are few; older holes are history
+
+PROJECTIONS_CHANNEL = "bot_claim_projections"
+
+
+# ===========================
+# WRITE (inside the caller's transaction)
+# ===========================
+
+async def record_claim_event(
+    conn,
+    event_type: str,
+    *,
+    channel_chat_id: int,
+    channel_message_id: int,
+    user_id: int,
+    username: Optional[str],
+    qty: int,
+    actor_id: Optional[int] = None,
+):
+    await conn.execute(
+        """
+        INSERT INTO claim_events
+            (event_type, channel_chat_id, channel_message_id, user_id, username, qty, actor_id)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        """,
+        event_type, channel_chat_id, channel_message_id, user_id, username, qty, actor_id
+    )
+
+
+# ===========================
+# IN-MEMORY PROJECTIONS
+# ===========================
+
+# (chat, mid) → initial_qty, from card_listing
+_initial: Dict[Post, int] = {}
+
+# (chat, mid) → {user_id: {"qty", "username", "at"}} in claim order
+_claims: Dict[Post, Dict[int, Dict[str, Any]]] = {}
+
+# user_id → {(chat, mid): same entry as in _claims}
+_bags: Dict[int, Dict[Post, Dict[str, Any]]] = {}
+
+_last_event_id = 0
+
+# Skipped ids below _last_event_id → monotonic time first seen missing
+_gaps: Dict[int, float] = {}
+
+
+def _apply(ev):
+    post = (ev["channel_chat_id"], ev["channel_message_id"])
+    if post not in _initial:
+        return  # an earlier sale's post
+    user_id = ev["user_id"]
+
+    if ev["event_type"] == EV_CLAIMED:
+        holders = _claims.setdefault(post, {})
+        entry = holders.get(user_id)
+        if entry is None:
+            entry = {"qty": 0, "username": ev["username"], "at": ev["created_at"]}
+            holders[user_id] = entry
+            _bags.setdefault(user_id, {})[post] = entry
+        entry["qty"] += ev["qty"]
+        entry["username"] = ev["username"] or entry["username"]
+    else:
+        # Every release cancels all of the user's claims on the post
+        _claims.get(post, {}).pop(user_id, None)
+        bag = _bags.get(user_id)
+        if bag is not None:
+            bag.pop(post, None)
+            if not bag:
+                del _bags[user_id]
+
+
+async def _load_initial_stock(conn):
+    rows = await conn.fetch(
+        """
+        SELECT channel_chat_id, channel_message_id, initial_qty
+        FROM card_listing
+        WHERE channel_message_id <> 0
+        """
+    )
+    _initial.clear()
+    for r in rows:
+        _initial[(r["channel_chat_id"], r["channel_message_id"])] = int(r["initial_qty"])
+
+
+def _drop_unlisted():
+    """
+    Forgets posts that left card_listing (a new sale replaced them).
+    """
+    for post in [p for p in _claims if p not in _initial]:
+        for user_id in _claims.pop(post):
+            bag = _bags.get(user_id)
+            if bag is not None:
+                bag.pop(post, None)
+                if not bag:
+                    del _bags[user_id]
+
+
+async def rebuild_projections():
+    """
+    Replays the events of the listed posts only, through the
+    (post, id) index, so earlier sales in the log cost nothing.
+    Everything is read in one snapshot and swapped in without an
+    await, so a concurrent refresh_projections can't double-apply.
+    """
+    global _last_event_id
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            await _load_initial_stock(conn)
+            rows = await conn.fetch(
+                """
+                SELECT e.id, e.event_type, e.channel_chat_id, e.channel_message_id,
+                       e.user_id, e.username, e.qty, e.created_at
+                FROM card_listing cl
+                JOIN claim_events e
+                  ON e.channel_chat_id = cl.channel_chat_id
+                 AND e.channel_message_id = cl.channel_message_id
+                WHERE cl.channel_message_id <> 0
+                ORDER BY e.id
+                """
+            )
+            log_end = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM claim_events")
+
+    _claims.clear()
+    _bags.clear()
+    _gaps.clear()
+    _last_event_id = log_end
+    for r in rows:
+        _apply(r)
+
+
+async def reset_projections():
+    """
+    Called after db.clear_card_listings: rebuilds here (the old sale
+    drops out) and tells the other instances to do the same.
+    """
+    await rebuild_projections()
+    if multi_instance():
+        await notify(PROJECTIONS_CHANNEL, "reset")
+
+
+def _on_remote_reset(payload: str):
+    asyncio.create_task(rebuild_projections())
+
+
+async def refresh_projections():
+    """
+    Applies events written since the last refresh (by any instance).
+    Events on the same post always commit in id order (card row lock),
+    so a late-committing gap can be applied out of order safely.
+    """
+    global _last_event_id
+
+    now = time.monotonic()
+    for gap_id, seen in list(_gaps.items()):
+        if now - seen > GAP_RETRY_SECONDS:
+            del _gaps[gap_id]
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT id, event_type, channel_chat_id, channel_message_id,
+                   user_id, username, qty, created_at
+            FROM claim_events
+            WHERE id > $1
+               OR id = ANY($2::bigint[])
+            ORDER BY id
+            """,
+            _last_event_id,
+            list(_gaps)
+        )
+        if any((r["channel_chat_id"], r["channel_message_id"]) not in _initial for r in rows):
+            await _load_initial_stock(conn)  # new posts since last load
+            _drop_unlisted()
+
+    for r in rows:
+        event_id = r["id"]
+        if event_id in _gaps:
+            del _gaps[event_id]
+        elif event_id > _last_event_id:
+            if _last_event_id:  # not on a full replay
+                for missing in range(max(_last_event_id + 1, event_id - MAX_GAP_TRACK), event_id):
+                    _gaps[missing] = now
+            _last_event_id = event_id
+        else:
+            continue
+        _apply(r)
+
+
+def projected_remaining(post: Post) -> Optional[int]:
+    initial = _initial.get(post)
+    if initial is None:
+        return None
+    return initial - sum(e["qty"] for e in _claims.get(post, {}).values())
+
+
+def projected_claim_order(post: Post) -> List[Dict[str, Any]]:
+    return [
+        {"user_id": uid, **entry}
+        for uid, entry in _claims.get(post, {}).items()
+    ]
+
+
+async def projected_claim_users(channel_id: int) -> List[Dict]:
+    """
+    Buyers with active claims in a channel, earliest first
+    (same shape as the old GROUP BY over claims).
+    """
+    await refresh_projections()
+
+    users = []
+    for user_id, bag in _bags.items():
+        entries = [e for (chat, _), e in bag.items() if chat == channel_id]
+        if not entries:
+            continue
+        users.append({
+            "user_id": user_id,
+            "username": next((e["username"] for e in entries if e["username"]), ""),
+            "qty": sum(e["qty"] for e in entries),
+            "earliest": min(e["at"] for e in entries),
+        })
+    users.sort(key=lambda u: u["earliest"])
+    return users
+
+
+# ===========================
+# STOCK DRIFT (SQL replay)
+# ===========================
+
+_DRIFT_SQL = """
+    SELECT
+        cl.id,
+        cl.channel_chat_id,
+        cl.channel_message_id,
+        cl.card_name,
+        cl.price,
+        cl.claim_buttons,
+        cl.remaining_qty,
+        cl.initial_qty - COALESCE(e.held, 0) AS replayed_qty
+    FROM card_listing cl
+    LEFT JOIN (
+        SELECT
+            channel_chat_id,
+            channel_message_id,
+            SUM(CASE WHEN event_type = 'claimed' THEN qty ELSE -qty END) AS held
+        FROM claim_events
+        GROUP BY channel_chat_id, channel_message_id
+    ) e
+      ON e.channel_chat_id = cl.channel_chat_id
+     AND e.channel_message_id = cl.channel_message_id
+    WHERE cl.channel_message_id <> 0
+      AND cl.remaining_qty <> cl.initial_qty - COALESCE(e.held, 0)
+"""
+
+
+async def check_stock_drift():
+    """
+    Posts whose remaining_qty disagrees with the event log. Report
+    only: the scheduler runs this; correcting is an admin decision
+    (fix_stock_drift), since either side may be the wrong one.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(_DRIFT_SQL)
+
+
+async def fix_stock_drift(admin_id: int):
+    """
+    Admin action: resets drifted remaining_qty to the replayed value
+    and writes one admin_logs row per post. Only the drifted card rows
+    are locked, and drift is re-checked under the lock so a claim that
+    landed in between isn't overwritten. Returns the corrected rows.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            ids = [r["id"] for r in await conn.fetch(_DRIFT_SQL)]
+            if not ids:
+                return []
+            await conn.execute(
+                """
+                SELECT 1
+                FROM card_listing
+                WHERE id = ANY($1::bigint[])
+                ORDER BY id
+                FOR UPDATE
+                """,
+                ids
+            )
+            return await conn.fetch(
+                f"""
+                WITH drift AS ({_DRIFT_SQL}),
+                fixed AS (
+                    UPDATE card_listing cl
+                    SET remaining_qty = drift.replayed_qty
+                    FROM drift
+                    WHERE cl.id = drift.id
+                      AND cl.id = ANY($1::bigint[])
+                    RETURNING cl.channel_chat_id, cl.channel_message_id, cl.card_name,
+                              cl.price, cl.claim_buttons,
+                              drift.remaining_qty AS was_qty, drift.replayed_qty
+                ),
+                logged AS (
+                    INSERT INTO admin_logs
+                    (action_type, admin_id, card_name, channel_message_id, quantity, reason)
+                    SELECT 'fix_stock_drift', $2, card_name, channel_message_id, replayed_qty,
+                           'remaining ' || was_qty || ' -> ' || replayed_qty
+                    FROM fixed
+                )
+                SELECT * FROM fixed
+                """,
+                ids, admin_id
+            )
+
+
+def format_stock_drift(rows) -> str:
+    if not rows:
+        return "📊 <b>Stock Drift</b>\n\nStock matches the claim log."
+    lines = [
+        "📊 <b>Stock Drift</b>",
+        "",
+        "remaining_qty disagrees with the claim log on these posts:",
+        "",
+    ]
+    for r in rows:
+        lines.append(
+            f"• {html.escape(r['card_name'])} — table <code>{r['remaining_qty']}</code>, "
+            f"log <code>{r['replayed_qty']}</code>"
+        )
+    lines.append("")
+    lines.append("Fix resets them to the log's value.")
+    return "\n".join(lines)
+
+
+# ===========================
+# STARTUP
+# ===========================
+
+async def backfill_claim_events():
+    """
+    One-time seed for a log introduced mid-sale: when claim_events is
+    empty, every active (post, user) claim group becomes one 'claimed'
+    event, in claim order.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("LOCK TABLE claim_events IN EXCLUSIVE MODE")
+            if await conn.fetchval("SELECT EXISTS (SELECT 1 FROM claim_events)"):
+                return
+            await conn.execute(
+                """
+                INSERT INTO claim_events
+                    (event_type, channel_chat_id, channel_message_id, user_id, username, qty, created_at)
+                SELECT 'claimed', channel_chat_id, channel_message_id, user_id,
+                       MAX(username), COUNT(*), MIN(claimed_at)
+                FROM claims
+                WHERE status = 'active'
+                GROUP BY channel_chat_id, channel_message_id, user_id
+                ORDER BY MIN(claim_order)
+                """
+            )
+
+
+async def init_claim_projections():
+    """
+    Called once from main.main after init_db, before start_cluster.
+    """
+    if multi_instance():
+        on_notify(PROJECTIONS_CHANNEL, _on_remote_reset)
+    await backfill_claim_events()
+    await rebuild_projections()
@@ -1,24 +1,21 @@
 from aiogram import Router, F
-from aiogram.types import Message
-from datetime import datetime, timedelta, timezone
-
-from db import (
-    get_card_by_post,
-    count_active_claims_for_card,
-    user_has_active_claim,
-    get_latest_cancelled_claim_id,
-    revive_cancelled_claim,
-    create_claim,
-    update_card_remaining,
-    get_active_claims_for_user,
-    cancel_claims_for_user,
-)
+from aiogram.types import Message, CallbackQuery
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from claims_repo import claim_card, cancel_card_claims
+from rate_limits import admit, should_notify_throttled
+from allocation_windows import window_open, submit_to_window
+from callbacks import ClaimButtonCB
+from claims_board import schedule_board_update, remember_thread
+from waitlist import waitlist_position, note_joined, note_left, notify_promoted
 
 from config import CHANNEL_ID, ADMIN_ID
 
 router = Router()
 CANCEL_WINDOW_MINUTES = 5
 
+SLOW_DOWN_TEXT = "🐢 Slow down — try again in a few seconds."
+
 
 def resolve_channel_post_keys(message: Message):
     r = message.reply_to_message
@@ -30,6 +27,119 @@ def resolve_channel_post_keys(message: Message):
 
     return r.chat.id, r.message_id
 
+def format_card_caption(card_name: str, price, remaining: int) -> str:
+    if remaining <= 0:
+        return (
+            f"{card_name}\n"
+            f"Price: {price}\n"
+            f"❌ SOLD OUT"
+        )
+    return (
+        f"{card_name}\n"
+        f"Price: {price}\n"
+        f"Available: {remaining}"
+    )
+
+def claim_keyboard(channel_chat_id: int, channel_message_id: int):
+    kb = InlineKeyboardBuilder()
+    kb.button(
+        text="✅ Claim",
+        callback_data=ClaimButtonCB(action="claim", chat=channel_chat_id, mid=channel_message_id).pack()
+    )
+    kb.button(
+        text="❌ Cancel",
+        callback_data=ClaimButtonCB(action="cancel", chat=channel_chat_id, mid=channel_message_id).pack()
+    )
+    kb.adjust(2)
+    return kb.as_markup()
+
+async def update_card_caption(
+    bot,
+    channel_chat_id: int,
+    channel_message_id: int,
+    card_name: str,
+    price,
+    remaining: int,
+    claim_buttons: bool = False,
+):
+    # Editing a caption drops the inline keyboard unless it's resent
+    try:
+        await bot.edit_message_caption(
+            chat_id=channel_chat_id,
+            message_id=channel_message_id,
+            caption=format_card_caption(card_name, price, remaining),
+            reply_markup=(
+                claim_keyboard(channel_chat_id, channel_message_id)
+                if claim_buttons else None
+            ),
+        )
+    except Exception as e:
+        print("Caption edit failed:", e)
+
+# =========================
+# STATUS → BUYER TEXT
+# =========================
+
+def claim_error_text(res) -> str | None:
+    status = res["status"]
+    if status == "not_tracked":
+        return "❌ This post is not a tracked card."
+    if status == "invalid_qty":
+        return "❌ Nothing available to claim."
+    if status == "insufficient":
+        return f"❌ Only {res['remaining']} remaining. You cannot claim {res['qty']}."
+    if status == "already_claimed":
+        return (
+            "❌ You already have active claim(s) on this card. "
+            "To edit claim, type cancel and claim again."
+        )
+    return None
+
+def waitlisted_text(position: int) -> str:
+    return (
+        f"⏳ Card is Fully Claimed — you're #{position} on the waitlist.\n"
+        "Freed stock is assigned automatically and you'll get a DM. "
+        "Cancel to leave."
+    )
+
+LEFT_WAITLIST_TEXT = "↩️ You've left the waitlist for this card."
+
+def cancel_error_text(res) -> str | None:
+    status = res["status"]
+    if status == "not_tracked":
+        return "❌ This post is not a tracked card."
+    if status == "no_claims":
+        return "❌ You don’t have any active claims on this card."
+    if status == "window_passed":
+        return (
+            f"❌ Cancellation window ({CANCEL_WINDOW_MINUTES} minutes) has passed.\n"
+            "Please contact @ILoveCatFoochie."
+        )
+    return None
+
+# =========================
+# DISCUSSION THREAD OF A CHANNEL POST
+# =========================
+# Telegram copies each channel post into the linked discussion group;
+# that copy is the thread claims are replied under. Remembered so
+# boards and announcements can find the thread for posts that only
+# ever get button claims.
+
+@router.message(F.is_automatic_forward)
+async def remember_post_thread(message: Message):
+    if not (message.forward_from_chat and message.forward_from_message_id):
+        return
+    if message.forward_from_chat.id != CHANNEL_ID:
+        return
+    await remember_thread(
+        (message.forward_from_chat.id, message.forward_from_message_id),
+        (message.chat.id, message.message_id),
+    )
+
+# =========================
+# REPLY "claim" / "cancel" IN THE DISCUSSION THREAD
+# =========================
+
 @router.message(F.reply_to_message, F.edit_date.is_(None))
 async def handle_claim_and_cancel(message: Message):
     raw = message.text.strip().lower() if message.text else ""
@@ -47,165 +157,205 @@ async def handle_claim_and_cancel(message: Message):
     if channel_chat_id != CHANNEL_ID:
         return
 
-    # 🔹 Fetch card info (Supabase)
-    card = await get_card_by_post(channel_chat_id, channel_message_id)
-    if not card:
-        await message.reply("❌ This post is not a tracked card.")
+    # Admission control (memory only, before any DB work). Posts in an
+    # allocation window only collect in memory, so they're not limited
+    user_id = message.from_user.id
+    if user_id != ADMIN_ID and not window_open(key) and not admit(user_id, key):
+        if should_notify_throttled(user_id):
+            await message.reply(SLOW_DOWN_TEXT)
         return
 
-    card_name = card["card_name"]
-    price = card["price"]
-    remaining = card["remaining_qty"]
+    qty = 1
+    if action == "claim" and len(parts) > 1:
+        if parts[1] == "all":
+            qty = None
+        elif parts[1].isdigit():
+            qty = int(parts[1])
+        else:
+            await message.reply("❌ Invalid format. Use: 'claim', 'claim 2', or 'claim all'")
+            return
+
+    # Hot card still in its allocation window: collect only, the
+    # batch result is announced when the window closes
+    if window_open(key):
+        if action == "claim" and qty == 0:
+            return
+        await submit_to_window(
+            key,
+            user_id=user_id,
+            username=message.from_user.username,
+            qty=qty if action == "claim" else 0,
+            thread=(message.chat.id, message.reply_to_message.message_id),
+        )
+        return
 
     # =========================
     # CLAIM
     # =========================
     if action == "claim":
-        qty = 1
-    
-        if len(parts) > 1 and parts[1] == "all":
-            qty = remaining
-        elif len(parts) > 1:
-            if parts[1].isdigit():
-                qty = int(parts[1])
-            else:
-                await message.reply("❌ Invalid format. Use: 'claim', 'claim 2', or 'claim all'")
-                return
-    
-        if qty <= 0:
-            await message.reply("❌ Nothing available to claim.")
-            return
-    
-        if remaining <= 0:
-            await message.reply("❌ Card is Fully Claimed")
+        # Already waiting: answered from memory, no DB round trip
+        position = waitlist_position(key, user_id)
+        if position:
+            await message.reply(waitlisted_text(position))
             return
-    
-        if qty > remaining:
-            await message.reply(f"❌ Only {remaining} remaining. You cannot claim {qty}.")
+
+        # One transaction, card row locked (safe across bot instances)
+        res = await claim_card(
+            channel_chat_id=channel_chat_id,
+            channel_message_id=channel_message_id,
+            user_id=message.from_user.id,
+            username=message.from_user.username,
+            qty=qty,
+        )
+        if res["status"] == "waitlisted":
+            await note_joined(key, user_id)
+            await message.reply(waitlisted_text(res["position"]))
             return
-    
-        # Prevent multiple separate claims
-        if await user_has_active_claim(channel_chat_id, channel_message_id, message.from_user.id):
-            await message.reply(
-                "❌ You already have active claim(s) on this card. "
-                "To edit claim, type cancel and claim again."
-            )
+        error = claim_error_text(res)
+        if error:
+            await message.reply(error)
             return
-    
-        # Create claims
-        for _ in range(qty):
-            claim_order = await count_active_claims_for_card(
-                channel_chat_id,
-                channel_message_id,
-            ) + 1
-    
-            cancelled_id = await get_latest_cancelled_claim_id(
-                channel_chat_id,
-                channel_message_id,
-                message.from_user.id,
-            )
-    
-            if cancelled_id:
-                await revive_cancelled_claim(
-                    claim_id=cancelled_id,
-                    username=message.from_user.username,
-                    claim_order=claim_order,
-                )
-            else:
-                await create_claim(
-                    channel_chat_id=channel_chat_id,
-                    channel_message_id=channel_message_id,
-                    user_id=message.from_user.id,
-                    username=message.from_user.username,
-                    claim_order=claim_order,
-                )
-    
-        # Reduce availability
-        await update_card_remaining(
-            channel_chat_id,
-            channel_message_id,
-            delta=-qty,
-        )
-    
-        new_remaining = remaining - qty
-    
-        await message.reply(
-            f"✅ Claim Approved @{message.from_user.username or 'user'}\n"
-            f"Quantity: {qty}\n"
-            f"Remaining: {new_remaining}"
-        )
-    
+
     else:
-        claims = await get_active_claims_for_user(
-            channel_chat_id,
-            channel_message_id,
-            message.from_user.id,
+        res = await cancel_card_claims(
+            channel_chat_id=channel_chat_id,
+            channel_message_id=channel_message_id,
+            user_id=message.from_user.id,
+            window_minutes=None if message.from_user.id == ADMIN_ID else CANCEL_WINDOW_MINUTES,
         )
-    
-        if not claims:
-            await message.reply("❌ You don’t have any active claims on this card.")
+        if res["status"] == "left_waitlist":
+            await note_left(key, user_id)
+            await message.reply(LEFT_WAITLIST_TEXT)
+            return
+        error = cancel_error_text(res)
+        if error:
+            await message.reply(error)
             return
-    
-        total_to_cancel = len(claims)
-    
-        earliest_claim = min(c["claimed_at"] for c in claims)
-        claimed_time = earliest_claim
-    
-        if message.from_user.id != ADMIN_ID:
-            now = datetime.now(timezone.utc)
-
-            if now - claimed_time > timedelta(minutes=CANCEL_WINDOW_MINUTES):
-
-                await message.reply(
-                    f"❌ Cancellation window ({CANCEL_WINDOW_MINUTES} minutes) has passed.\n"
-                    "Please contact @ILoveCatFoochie."
-                )
-                return
-    
-        # Cancel claims
-        await cancel_claims_for_user(
-            channel_chat_id,
-            channel_message_id,
-            message.from_user.id,
-        )
-    
-        # Restore availability
-        await update_card_remaining(
-            channel_chat_id,
-            channel_message_id,
-            delta=total_to_cancel,
-        )
-    
-        new_remaining = remaining + total_to_cancel
-    
-        await message.reply(
-            f"⚠️ All claims cancelled by @{message.from_user.username or 'user'}\n"
-            f"Restored: {total_to_cancel}\n"
-            f"Available: {new_remaining}"
-        )
 
+    # Confirmation: the post's claims board, edited in place (debounced)
+    schedule_board_update(
+        message.bot,
+        key,
+        card_name=res["card_name"],
+        remaining=res["remaining"],
+        thread=(message.chat.id, message.reply_to_message.message_id),
+    )
 
     # =========================
     # AUTO-EDIT CAPTION
     # =========================
-    if new_remaining <= 0:
-        caption = (
-            f"{card_name}\n"
-            f"Price: {price}\n"
-            f"❌ SOLD OUT"
+    await update_card_caption(
+        message.bot,
+        channel_chat_id,
+        channel_message_id,
+        res["card_name"],
+        res["price"],
+        res["remaining"],
+        res["claim_buttons"],
+    )
+
+    # Stock a cancel freed went straight to waiters; tell them
+    await notify_promoted(message.bot, res.get("promoted"), refresh_posts=False)
+
+# =========================
+# CLAIM / CANCEL BUTTONS ON THE CHANNEL POST
+# =========================
+# The post key travels in the callback data; the buyer only sees a
+# popup (cb.answer). Outbound: the caption edit, plus the (debounced,
+# shared) claims board edit if the post already has a board.
+
+@router.callback_query(ClaimButtonCB.filter())
+async def handle_claim_button(cb: CallbackQuery, callback_data: ClaimButtonCB):
+    key = (callback_data.chat, callback_data.mid)
+    if key[0] != CHANNEL_ID:
+        await cb.answer()
+        return
+
+    user_id = cb.from_user.id
+    if user_id != ADMIN_ID and not window_open(key) and not admit(user_id, key):
+        await cb.answer(SLOW_DOWN_TEXT)
+        return
+
+    action = callback_data.action
+
+    if window_open(key):
+        await submit_to_window(
+            key,
+            user_id=user_id,
+            username=cb.from_user.username,
+            qty=1 if action == "claim" else 0,
+            thread=None,
         )
-    else:
-        caption = (
-            f"{card_name}\n"
-            f"Price: {price}\n"
-            f"Available: {new_remaining}"
+        await cb.answer(
+            "📝 You're in! Results when the claim window closes."
+            if action == "claim" else
+            "↩️ Withdrawn from this card's claim window."
         )
-    
-    try:
-        await message.bot.edit_message_caption(
-            chat_id=channel_chat_id,
-            message_id=channel_message_id,
-            caption=caption
+        return
+
+    if action == "claim":
+        position = waitlist_position(key, user_id)
+        if position:
+            await cb.answer(waitlisted_text(position), show_alert=True)
+            return
+
+        res = await claim_card(
+            channel_chat_id=key[0],
+            channel_message_id=key[1],
+            user_id=user_id,
+            username=cb.from_user.username,
+            qty=1,
         )
-    except Exception as e:
-        print("Caption edit failed:", e)
+        if res["status"] == "waitlisted":
+            await note_joined(key, user_id)
+            await cb.answer(waitlisted_text(res["position"]), show_alert=True)
+            return
+        error = claim_error_text(res)
+        if error:
+            await cb.answer(error, show_alert=True)
+            return
+        await cb.answer(
+            f"✅ Claim Approved\nQuantity: {res['qty']}\nRemaining: {res['remaining']}",
+            show_alert=True,
+        )
+
+    elif action == "cancel":
+        res = await cancel_card_claims(
+            channel_chat_id=key[0],
+            channel_message_id=key[1],
+            user_id=user_id,
+            window_minutes=None if user_id == ADMIN_ID else CANCEL_WINDOW_MINUTES,
+        )
+        if res["status"] == "left_waitlist":
+            await note_left(key, user_id)
+            await cb.answer(LEFT_WAITLIST_TEXT, show_alert=True)
+            return
+        error = cancel_error_text(res)
+        if error:
+            await cb.answer(error, show_alert=True)
+            return
+        await cb.answer(
+            f"⚠️ All claims cancelled\nRestored: {res['qty']}\nAvailable: {res['remaining']}",
+            show_alert=True,
+        )
+
+    else:
+        await cb.answer()
+        return
+
+    schedule_board_update(
+        cb.bot,
+        key,
+        card_name=res["card_name"],
+        remaining=res["remaining"],
+    )
+    await update_card_caption(
+        cb.bot,
+        key[0],
+        key[1],
+        res["card_name"],
+        res["price"],
+        res["remaining"],
+        res["claim_buttons"],
+    )
+    await notify_promoted(cb.bot, res.get("promoted"), refresh_posts=False)
@@ -0,0 +1,156 @@
+# claims_board.py
+
+import asyncio
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot
+
+from claim_events import refresh_projections, projected_claim_order, projected_remaining
+from db import claim_board_creation, get_post_thread, save_board_message, save_post_thread
+
+# One bot-owned "claims board" reply per post in the discussion thread,
+# edited in place, instead of one confirmation reply per claim/cancel.
+# Changes are debounced per post: a burst of claims costs one edit.
+# Claimants come from the claim_events projection, in claim order.
+#
+# Each post's discussion thread and board message live in post_threads
+# (db.py), so they survive restarts and are shared by all instances.
+# The thread is learned from the channel's automatic forward into the
+# discussion group (remember_thread), so posts claimed only through
+# buttons get a board too. Before posting a board an instance claims
+# the post in one short statement (db.claim_board_creation), so two
+# instances can't both post one; the send itself holds no connection.
+
+BOARD_DEBOUNCE_SECONDS = float(os.getenv("CLAIMS_BOARD_DEBOUNCE_SECONDS", "2"))
+BOARD_MAX_LINES = 80  # keeps the text well under Telegram's 4096 chars
+# A creator that hasn't saved its board by then is presumed dead
+BOARD_CLAIM_SECONDS = 60
+
+Post = Tuple[int, int]  # (channel_chat_id, channel_message_id)
+
+# post → latest {"card_name", "remaining", "thread"} waiting to publish
+_pending: Dict[Post, Dict[str, Any]] = {}
+_tasks: Dict[Post, asyncio.Task] = {}
+
+
+async def remember_thread(post: Post, thread: Tuple[int, int]):
+    """
+    thread = (discussion chat id, forwarded post message id).
+    """
+    await save_post_thread(post[0], post[1], thread[0], thread[1])
+
+
+def render_board(card_name: str, remaining: int, claimants) -> str:
+    lines = [f"📋 Claims — {card_name}", ""]
+
+    if not claimants:
+        lines.append("No active claims.")
+    for i, c in enumerate(claimants[:BOARD_MAX_LINES], start=1):
+        who = f"@{c['username']}" if c["username"] else f"user {c['user_id']}"
+        lines.append(f"{i}. {who} x{c['qty']}")
+    if len(claimants) > BOARD_MAX_LINES:
+        lines.append(f"…and {len(claimants) - BOARD_MAX_LINES} more")
+
+    lines.append("")
+    lines.append("❌ SOLD OUT" if remaining <= 0 else f"Available: {remaining}")
+    return "\n".join(lines)
+
+
+def schedule_board_update(
+    bot: Bot,
+    post: Post,
+    *,
+    card_name: str,
+    remaining: int,
+    thread: Optional[Tuple[int, int]] = None,
+):
+    """
+    thread = (discussion chat id, forwarded post message id), needed
+    only to create the board; later updates edit it wherever it is.
+    """
+    prev = _pending.get(post)
+    _pending[post] = {
+        "card_name": card_name,
+        "remaining": remaining,
+        "thread": thread or (prev["thread"] if prev else None),
+    }
+
+    task = _tasks.get(post)
+    if task is None or task.done():
+        _tasks[post] = asyncio.create_task(_publish_after_delay(bot, post))
+
+
+async def _publish_after_delay(bot: Bot, post: Post):
+    await asyncio.sleep(BOARD_DEBOUNCE_SECONDS)
+    _tasks.pop(post, None)
+    state = _pending.pop(post, None)
+    if state is None:
+        return
+    try:
+        await _publish(bot, post, state)
+    except Exception as e:
+        print("Claims board update failed:", post, e)
+
+
+async def _edit_board(bot: Bot, chat_id: int, message_id: int, text: str) -> bool:
+    """
+    False if the board message is gone (deleted in the group).
+    """
+    try:
+        await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+    except Exception as e:
+        if "not modified" in str(e):
+            return True
+        if "not found" not in str(e):
+            raise
+        return False
+    return True
+
+
+async def _publish(bot: Bot, post: Post, state: Dict[str, Any]):
+    await refresh_projections()
+    remaining = projected_remaining(post)
+    if remaining is None:
+        remaining = state["remaining"]
+    text = render_board(state["card_name"], remaining, projected_claim_order(post))
+
+    # Common case: the board exists, edit it
+    row = await get_post_thread(*post)
+    seen_board_id = row["board_message_id"] if row else None
+    if seen_board_id:
+        if await _edit_board(bot, row["thread_chat_id"], seen_board_id, text):
+            return
+
+    # Create (or re-create) it
+    if row and row["thread_chat_id"]:
+        thread = (row["thread_chat_id"], row["thread_message_id"])
+    else:
+        thread = state["thread"]
+    if not thread:
+        return  # thread not known yet (auto-forward not seen)
+
+    claimed = await claim_board_creation(
+        *post,
+        thread=thread,
+        seen_board_id=seen_board_id,
+        stale_seconds=BOARD_CLAIM_SECONDS,
+    )
+    if not claimed:
+        # Another instance is posting it: edit once it's there
+        schedule_board_update(
+            bot, post, card_name=state["card_name"], remaining=remaining, thread=thread
+        )
+        return
+
+    chat_id, thread_mid = claimed["thread_chat_id"], claimed["thread_message_id"]
+    try:
+        sent = await bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            reply_to_message_id=thread_mid,
+        )
+    except Exception:
+        await save_board_message(*post, None)
+        raise
+    await save_board_message(*post, sent.message_id)
@@ -1,26 +1,19 @@
 # claims_repo.py
+import random
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional
-from db import get_pool
+from db import get_pool, join_waitlist, leave_waitlist, promote_waitlist
+from claim_events import (
+    EV_CLAIMED,
+    EV_CANCELLED,
+    EV_ADMIN_CANCELLED,
+    record_claim_event,
+    projected_claim_users,
+)
 
 async def fetch_active_claim_users(channel_id: int) -> List[Dict]:
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            SELECT
-                user_id,
-                COALESCE(username, '') AS username,
-                COUNT(*) AS qty,
-                MIN(claimed_at) AS earliest
-            FROM claims
-            WHERE channel_chat_id = $1
-              AND status = 'active'
-            GROUP BY user_id, username
-            ORDER BY earliest ASC
-            """,
-            channel_id
-        )
-    return [dict(r) for r in rows]
+    # Served from the claim_events projection (no GROUP BY over claims)
+    return await projected_claim_users(channel_id)
     
 async def fetch_user_claim_groups(
     channel_id: int,
@@ -51,180 +44,636 @@ async def fetch_user_claim_groups(
         )
     return [dict(r) for r in rows]
 
-async def admin_cancel_claim_group(
+async def admin_cancel_claim_groups(
     *,
     channel_id: int,
     admin_id: int,
     user_id: int,
-    post_mid: int,
+    post_mids: List[int],
     reason: str = "admin_cancel"
 ) -> Dict | None:
+    """
+    Cancels the buyer's claims on every selected post in one transaction:
+    stock, claim log, admin log, order_items and order totals are all
+    adjusted set-wise, so the statement count doesn't grow with N.
+    Returns {"groups": [{card_name, price, qty, post_mid, new_remaining}],
+    "invoice_no", "order_cancelled", "promoted"}, or None if nothing
+    was active.
+    """
     pool = await get_pool()
     async with pool.acquire() as conn:
         async with conn.transaction():
 
-            # 1️⃣ Count active claims
-            qty = await conn.fetchval(
+            # 1️⃣ Lock the cards (card before claims, like claim_card)
+            await conn.execute(
                 """
-                SELECT COUNT(*)
-                FROM claims
+                SELECT 1
+                FROM card_listing
                 WHERE channel_chat_id = $1
-                  AND channel_message_id = $2
-                  AND user_id = $3
-                  AND status = 'active'
+                  AND channel_message_id = ANY($2::bigint[])
+                ORDER BY id
+                FOR UPDATE
                 """,
-                channel_id, post_mid, user_id
+                channel_id, post_mids
             )
 
-            if not qty or qty <= 0:
+            # 2️⃣ Cancel claims, restore stock, claim log + admin log
+            groups = await conn.fetch(
+                """
+                WITH cancelled AS (
+                    UPDATE claims c
+                    SET status = 'cancelled'
+                    WHERE c.channel_chat_id = $1
+                      AND c.channel_message_id = ANY($2::bigint[])
+                      AND c.user_id = $3
+                      AND c.status = 'active'
+                      AND EXISTS (
+                          SELECT 1
+                          FROM card_listing cl
+                          WHERE cl.channel_chat_id = c.channel_chat_id
+                            AND cl.channel_message_id = c.channel_message_id
+                      )
+                    RETURNING c.channel_message_id
+                ),
+                per_post AS (
+                    SELECT channel_message_id, COUNT(*) AS qty
+                    FROM cancelled
+                    GROUP BY channel_message_id
+                ),
+                restored AS (
+                    UPDATE card_listing cl
+                    SET remaining_qty = cl.remaining_qty + p.qty
+                    FROM per_post p
+                    WHERE cl.channel_chat_id = $1
+                      AND cl.channel_message_id = p.channel_message_id
+                    RETURNING cl.channel_message_id AS post_mid, cl.card_name, cl.price,
+                              cl.claim_buttons, cl.remaining_qty AS new_remaining, p.qty
+                ),
+                logged AS (
+                    INSERT INTO claim_events
+                        (event_type, channel_chat_id, channel_message_id, user_id, username, qty, actor_id)
+                    SELECT $6, $1, post_mid, $3, NULL, qty, $4
+                    FROM restored
+                ),
+                admin_logged AS (
+                    INSERT INTO admin_logs
+                    (action_type, admin_id, target_user_id, card_name, channel_message_id, quantity, reason)
+                    SELECT 'cancel_claim', $4, $3, card_name, post_mid, qty, $5
+                    FROM restored
+                )
+                SELECT post_mid, card_name, price, claim_buttons, qty, new_remaining
+                FROM restored
+                ORDER BY array_position($2::bigint[], post_mid::bigint)
+                """,
+                channel_id, post_mids, user_id, admin_id, reason, EV_ADMIN_CANCELLED
+            )
+
+            if not groups:
                 return None
+            groups = [dict(g) for g in groups]
+
+            # 3️⃣ Freed stock goes to the waitlists first
+            promoted = await promote_waitlist(
+                conn,
+                [(channel_id, g["post_mid"]) for g in groups]
+            )
+            for p in promoted:
+                for g in groups:
+                    if g["post_mid"] == p["channel_message_id"]:
+                        g["new_remaining"] = p["remaining"]
 
-            # 2️⃣ Fetch card listing
+            # 4️⃣ Adjust latest non-shipped order
+            ord_row = await conn.fetchrow(
+                """
+                SELECT id, invoice_no
+                FROM orders
+                WHERE user_id = $1
+                  AND status IN ('pending_payment', 'payment_received', 'verifying', 'ready_to_ship')
+                ORDER BY created_at DESC
+                LIMIT 1
+                """,
+                user_id
+            )
+
+            order_cancelled = False
+            updated_invoice = None
+
+            if ord_row:
+                order_id = ord_row["id"]
+                updated_invoice = ord_row["invoice_no"]
+
+                touched = await conn.fetchval(
+                    """
+                    WITH removed AS (
+                        SELECT *
+                        FROM unnest($2::bigint[], $3::bigint[]) AS r(post_mid, qty)
+                    ),
+                    deleted AS (
+                        DELETE FROM order_items oi
+                        USING removed r
+                        WHERE oi.order_id = $1
+                          AND oi.post_message_id = r.post_mid
+                          AND oi.qty <= r.qty
+                        RETURNING oi.id
+                    ),
+                    reduced AS (
+                        UPDATE order_items oi
+                        SET qty = oi.qty - r.qty
+                        FROM removed r
+                        WHERE oi.order_id = $1
+                          AND oi.post_message_id = r.post_mid
+                          AND oi.qty > r.qty
+                        RETURNING oi.id
+                    )
+                    SELECT (SELECT COUNT(*) FROM deleted) + (SELECT COUNT(*) FROM reduced)
+                    """,
+                    order_id,
+                    [g["post_mid"] for g in groups],
+                    [g["qty"] for g in groups]
+                )
+
+                if touched:
+                    order_cancelled = await conn.fetchval(
+                        """
+                        UPDATE orders o
+                        SET cards_total = t.cards_total,
+                            total = CASE WHEN t.cards_total <= 0 THEN 0
+                                         ELSE t.cards_total + COALESCE(o.delivery_fee, 0) END,
+                            status = CASE WHEN t.cards_total <= 0 THEN 'cancelled'
+                                          ELSE o.status END
+                        FROM (
+                            SELECT COALESCE(SUM(price * qty), 0) AS cards_total
+                            FROM order_items
+                            WHERE order_id = $1
+                        ) t
+                        WHERE o.id = $1
+                        RETURNING o.status = 'cancelled'
+                        """,
+                        order_id
+                    )
+
+            return {
+                "groups": groups,
+                "invoice_no": updated_invoice,
+                "order_cancelled": bool(order_cancelled),
+                "promoted": promoted,
+            }
+
+
+async def admin_cancel_claim_group(
+    *,
+    channel_id: int,
+    admin_id: int,
+    user_id: int,
+    post_mid: int,
+    reason: str = "admin_cancel"
+) -> Dict | None:
+    res = await admin_cancel_claim_groups(
+        channel_id=channel_id,
+        admin_id=admin_id,
+        user_id=user_id,
+        post_mids=[post_mid],
+        reason=reason,
+    )
+    if not res:
+        return None
+
+    g = res["groups"][0]
+    return {
+        "card_name": g["card_name"],
+        "qty": g["qty"],
+        "post_mid": g["post_mid"],
+        "new_remaining": g["new_remaining"],
+        "invoice_no": res["invoice_no"],
+        "order_cancelled": res["order_cancelled"],
+        "promoted": res["promoted"],
+    }
+
+
+
+# ===========================
+# CLAIM / CANCEL (one transaction each)
+# ===========================
+# The card_listing row is locked FOR UPDATE first, so concurrent
+# claims on the same post serialize across all bot instances and
+# remaining_qty can't oversell.
+
+async def claim_card(
+    *,
+    channel_chat_id: int,
+    channel_message_id: int,
+    user_id: int,
+    username: Optional[str],
+    qty: Optional[int],
+) -> Dict:
+    """
+    qty=None claims everything remaining ("claim all").
+    Returns {"status": ..., "card_name", "price", "qty", "remaining"};
+    status is one of: ok, not_tracked, waitlisted, insufficient,
+    already_claimed, invalid_qty. A claim on a sold-out card joins
+    its waitlist ("claim all" waits for one); "waitlisted" adds
+    "position".
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
             card = await conn.fetchrow(
                 """
-                SELECT card_name, price, remaining_qty
+                SELECT id, card_name, price, remaining_qty, claim_buttons
                 FROM card_listing
                 WHERE channel_chat_id = $1
                   AND channel_message_id = $2
                 FOR UPDATE
                 """,
-                channel_id, post_mid
+                channel_chat_id, channel_message_id
             )
-
             if not card:
-                return None
+                return {"status": "not_tracked"}
 
-            card_name = card["card_name"]
-            price_str = card["price"]
             remaining = int(card["remaining_qty"])
+            result = {
+                "card_name": card["card_name"],
+                "price": card["price"],
+                "claim_buttons": card["claim_buttons"],
+                "qty": qty,
+                "remaining": remaining,
+            }
 
-            # 3️⃣ Cancel claims
-            await conn.execute(
+            if qty is None:
+                qty = remaining if remaining > 0 else 1
+                result["qty"] = qty
+            if qty <= 0:
+                return {**result, "status": "invalid_qty"}
+            if qty > remaining > 0:
+                return {**result, "status": "insufficient"}
+
+            # Prevent multiple separate claims
+            already = await conn.fetchval(
                 """
-                UPDATE claims
-                SET status = 'cancelled'
+                SELECT 1
+                FROM claims
                 WHERE channel_chat_id = $1
                   AND channel_message_id = $2
                   AND user_id = $3
                   AND status = 'active'
+                LIMIT 1
                 """,
-                channel_id, post_mid, user_id
+                channel_chat_id, channel_message_id, user_id
             )
+            if already:
+                return {**result, "status": "already_claimed"}
 
-            # 4️⃣ Restore stock
-            await conn.execute(
+            if remaining <= 0:
+                position = await join_waitlist(
+                    conn,
+                    channel_chat_id=channel_chat_id,
+                    channel_message_id=channel_message_id,
+                    user_id=user_id,
+                    username=username,
+                    qty=qty,
+                )
+                return {**result, "status": "waitlisted", "position": int(position)}
+
+            base_order = await conn.fetchval(
+                """
+                SELECT COUNT(*)
+                FROM claims
+                WHERE channel_chat_id = $1
+                  AND channel_message_id = $2
+                  AND status = 'active'
+                """,
+                channel_chat_id, channel_message_id
+            )
+
+            # Reuse the user's cancelled rows first, newest first
+            revived = await conn.fetch(
+                """
+                WITH r AS (
+                    SELECT id, row_number() OVER (ORDER BY id DESC) AS rn
+                    FROM claims
+                    WHERE channel_chat_id = $1
+                      AND channel_message_id = $2
+                      AND user_id = $3
+                      AND status = 'cancelled'
+                    ORDER BY id DESC
+                    LIMIT $5
+                )
+                UPDATE claims c
+                SET status = 'active',
+                    username = $4,
+                    claim_order = $6 + r.rn,
+                    claimed_at = NOW(),
+                    order_id = NULL
+                FROM r
+                WHERE c.id = r.id
+                RETURNING c.id
+                """,
+                channel_chat_id, channel_message_id, user_id, username,
+                qty, base_order
+            )
+
+            fresh = qty - len(revived)
+            if fresh > 0:
+                await conn.execute(
+                    """
+                    INSERT INTO claims (
+                        channel_chat_id,
+                        channel_message_id,
+                        user_id,
+                        username,
+                        claim_order
+                    )
+                    SELECT $1, $2, $3, $4, $5 + g
+                    FROM generate_series(1, $6) AS g
+                    """,
+                    channel_chat_id, channel_message_id, user_id, username,
+                    base_order + len(revived), fresh
+                )
+
+            new_remaining = await conn.fetchval(
                 """
                 UPDATE card_listing
-                SET remaining_qty = remaining_qty + $1
-                WHERE channel_chat_id = $2
-                  AND channel_message_id = $3
+                SET remaining_qty = remaining_qty - $1
+                WHERE id = $2
+                RETURNING remaining_qty
                 """,
-                qty, channel_id, post_mid
+                qty, card["id"]
             )
 
-            new_remaining = remaining + qty
+            await record_claim_event(
+                conn,
+                EV_CLAIMED,
+                channel_chat_id=channel_chat_id,
+                channel_message_id=channel_message_id,
+                user_id=user_id,
+                username=username,
+                qty=qty,
+            )
 
-            # 5️⃣ Admin log
-            await conn.execute(
+            # Claimed live after waiting (stock came back unassigned)
+            await leave_waitlist(
+                conn,
+                channel_chat_id=channel_chat_id,
+                channel_message_id=channel_message_id,
+                user_id=user_id,
+            )
+
+            return {**result, "status": "ok", "remaining": int(new_remaining)}
+
+
+def split_allocation(requests: List[Dict], left: int, holders) -> Dict[str, List[Dict]]:
+    """
+    Walks requests in order; each buyer gets min(asked, left) while
+    stock lasts (qty=None asks for everything left). Returns
+    {"winners": [... with granted qty], "waitlisted": [...], "losers": [...]}.
+    Buyers who only missed out because stock ran out are "waitlisted"
+    (for 1 unit on "claim all"); holders and qty <= 0 are plain losers.
+    """
+    winners, waitlisted, losers = [], [], []
+    for r in requests:
+        if r["user_id"] in holders or (r["qty"] is not None and r["qty"] <= 0):
+            losers.append(r)
+            continue
+        if left <= 0:
+            waitlisted.append({**r, "qty": r["qty"] or 1})
+            losers.append(r)
+            continue
+        asked = left if r["qty"] is None else r["qty"]
+        got = min(asked, left)
+        left -= got
+        winners.append({**r, "qty": got})
+    return {"winners": winners, "waitlisted": waitlisted, "losers": losers}
+
+
+async def allocate_claim_batch(
+    *,
+    channel_chat_id: int,
+    channel_message_id: int,
+    requests: List[Dict],
+    draw: bool,
+) -> Dict:
+    """
+    Allocates a window's worth of claims in one transaction (see
+    allocation_windows.py). requests = [{"user_id", "username", "qty"}]
+    in arrival order (qty=None is "claim all"); draw=True shuffles them
+    first (lottery). Each buyer gets min(asked, left) while stock lasts
+    (split_allocation); buyers left without stock join the post's
+    waitlist in that same order.
+    Returns {"status": ok|not_tracked, "card_name", "price",
+    "remaining", "winners": [...], "losers": [...],
+    "waitlisted": [... with "position"]}.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            card = await conn.fetchrow(
                 """
-                INSERT INTO admin_logs
-                (action_type, admin_id, target_user_id, card_name, channel_message_id, quantity, reason)
-                VALUES
-                ('cancel_claim', $1, $2, $3, $4, $5, $6)
+                SELECT id, card_name, price, remaining_qty, claim_buttons
+                FROM card_listing
+                WHERE channel_chat_id = $1
+                  AND channel_message_id = $2
+                FOR UPDATE
                 """,
-                admin_id, user_id, card_name, post_mid, qty, reason
+                channel_chat_id, channel_message_id
             )
+            if not card:
+                return {"status": "not_tracked"}
 
-            # 6️⃣ Adjust latest non-shipped order
-            ord_row = await conn.fetchrow(
+            state = await conn.fetchrow(
                 """
-                SELECT id, invoice_no, delivery_fee
-                FROM orders
-                WHERE user_id = $1
-                  AND status IN ('pending_payment', 'payment_received', 'verifying', 'ready_to_ship')
-                ORDER BY created_at DESC
-                LIMIT 1
+                SELECT COUNT(*) AS base_order,
+                       COALESCE(array_agg(DISTINCT user_id), '{}') AS holders
+                FROM claims
+                WHERE channel_chat_id = $1
+                  AND channel_message_id = $2
+                  AND status = 'active'
                 """,
-                user_id
+                channel_chat_id, channel_message_id
             )
+            holders = set(state["holders"])
 
-            order_cancelled = False
-            updated_invoice = None
+            order = list(requests)
+            if draw:
+                random.shuffle(order)
 
-            if ord_row:
-                order_id = ord_row["id"]
-                updated_invoice = ord_row["invoice_no"]
+            split = split_allocation(order, int(card["remaining_qty"]), holders)
+            winners = split["winners"]
 
-                oi = await conn.fetchrow(
-                    """
-                    SELECT id, qty, price
-                    FROM order_items
-                    WHERE order_id = $1
-                      AND post_message_id = $2
-                    """,
-                    order_id, post_mid
+            waitlisted = []
+            for r in split["waitlisted"]:
+                position = await join_waitlist(
+                    conn,
+                    channel_chat_id=channel_chat_id,
+                    channel_message_id=channel_message_id,
+                    user_id=r["user_id"],
+                    username=r["username"],
+                    qty=r["qty"],
                 )
+                waitlisted.append({**r, "position": int(position)})
 
-                if oi:
-                    remove_qty = min(qty, int(oi["qty"]))
-                    new_qty = int(oi["qty"]) - remove_qty
-
-                    if new_qty <= 0:
-                        await conn.execute(
-                            "DELETE FROM order_items WHERE id = $1",
-                            oi["id"]
-                        )
-                    else:
-                        await conn.execute(
-                            """
-                            UPDATE order_items
-                            SET qty = $1
-                            WHERE id = $2
-                            """,
-                            new_qty, oi["id"]
-                        )
-
-                    cards_total = await conn.fetchval(
-                        """
-                        SELECT COALESCE(SUM(price * qty), 0)
-                        FROM order_items
-                        WHERE order_id = $1
-                        """,
-                        order_id
-                    ) or 0
-
-                    delivery_fee = float(ord_row["delivery_fee"] or 0)
-                    total = float(cards_total) + delivery_fee
-
-                    if cards_total <= 0:
-                        await conn.execute(
-                            """
-                            UPDATE orders
-                            SET status = 'cancelled',
-                                cards_total = 0,
-                                total = 0
-                            WHERE id = $1
-                            """,
-                            order_id
-                        )
-                        order_cancelled = True
-                    else:
-                        await conn.execute(
-                            """
-                            UPDATE orders
-                            SET cards_total = $1,
-                                total = $2
-                            WHERE id = $3
-                            """,
-                            cards_total, total, order_id
-                        )
+            result = {
+                "status": "ok",
+                "card_name": card["card_name"],
+                "price": card["price"],
+                "claim_buttons": card["claim_buttons"],
+                "remaining": int(card["remaining_qty"]),
+                "winners": winners,
+                "losers": split["losers"],
+                "waitlisted": waitlisted,
+            }
+            if not winners:
+                return result
 
-            return {
-                "card_name": card_name,
-                "qty": qty,
-                "post_mid": post_mid,
-                "new_remaining": new_remaining,
-                "invoice_no": updated_invoice,
-                "order_cancelled": order_cancelled,
+            # Claims, stock and claim log in one statement
+            offsets = []
+            offset = int(state["base_order"])
+            for w in winners:
+                offsets.append(offset)
+                offset += w["qty"]
+
+            result["remaining"] = int(await conn.fetchval(
+                """
+                WITH w AS (
+                    SELECT *
+                    FROM unnest($3::bigint[], $4::text[], $5::int[], $6::int[])
+                         AS w(user_id, username, qty, start_order)
+                ),
+                inserted AS (
+                    INSERT INTO claims (
+                        channel_chat_id,
+                        channel_message_id,
+                        user_id,
+                        username,
+                        claim_order
+                    )
+                    SELECT $1, $2, w.user_id, w.username, w.start_order + g
+                    FROM w
+                    CROSS JOIN LATERAL generate_series(1, w.qty) AS g
+                ),
+                logged AS (
+                    INSERT INTO claim_events
+                        (event_type, channel_chat_id, channel_message_id, user_id, username, qty)
+                    SELECT $8, $1, $2, w.user_id, w.username, w.qty
+                    FROM w
+                )
+                UPDATE card_listing
+                SET remaining_qty = remaining_qty - (SELECT SUM(qty) FROM w)
+                WHERE id = $7
+                RETURNING remaining_qty
+                """,
+                channel_chat_id, channel_message_id,
+                [w["user_id"] for w in winners],
+                [w["username"] for w in winners],
+                [w["qty"] for w in winners],
+                offsets,
+                card["id"],
+                EV_CLAIMED,
+            ))
+            return result
+
+
+async def cancel_card_claims(
+    *,
+    channel_chat_id: int,
+    channel_message_id: int,
+    user_id: int,
+    window_minutes: Optional[int],
+) -> Dict:
+    """
+    Cancels all of a user's active claims on one post and restores
+    stock. window_minutes=None skips the cancellation window (admin).
+    Returns {"status": ..., "card_name", "price", "qty", "remaining",
+    "promoted"}; status is one of: ok, not_tracked, no_claims,
+    window_passed, left_waitlist. Restored stock goes to the post's
+    waitlist first ("promoted", see db.promote_waitlist).
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            card = await conn.fetchrow(
+                """
+                SELECT id, card_name, price, remaining_qty, claim_buttons
+                FROM card_listing
+                WHERE channel_chat_id = $1
+                  AND channel_message_id = $2
+                FOR UPDATE
+                """,
+                channel_chat_id, channel_message_id
+            )
+            if not card:
+                return {"status": "not_tracked"}
+
+            result = {
+                "card_name": card["card_name"],
+                "price": card["price"],
+                "claim_buttons": card["claim_buttons"],
+                "qty": 0,
+                "remaining": int(card["remaining_qty"]),
+                "promoted": [],
             }
 
+            claims = await conn.fetch(
+                """
+                SELECT id, claimed_at
+                FROM claims
+                WHERE channel_chat_id = $1
+                  AND channel_message_id = $2
+                  AND user_id = $3
+                  AND status = 'active'
+                """,
+                channel_chat_id, channel_message_id, user_id
+            )
+            if not claims:
+                left = await leave_waitlist(
+                    conn,
+                    channel_chat_id=channel_chat_id,
+                    channel_message_id=channel_message_id,
+                    user_id=user_id,
+                )
+                return {**result, "status": "left_waitlist" if left else "no_claims"}
+
+            if window_minutes is not None:
+                earliest = min(c["claimed_at"] for c in claims)
+                if datetime.now(timezone.utc) - earliest > timedelta(minutes=window_minutes):
+                    return {**result, "status": "window_passed"}
+
+            await conn.execute(
+                """
+                UPDATE claims
+                SET status = 'cancelled'
+                WHERE id = ANY($1::bigint[])
+                """,
+                [c["id"] for c in claims]
+            )
+
+            new_remaining = await conn.fetchval(
+                """
+                UPDATE card_listing
+                SET remaining_qty = remaining_qty + $1
+                WHERE id = $2
+                RETURNING remaining_qty
+                """,
+                len(claims), card["id"]
+            )
+
+            await record_claim_event(
+                conn,
+                EV_CANCELLED,
+                channel_chat_id=channel_chat_id,
+                channel_message_id=channel_message_id,
+                user_id=user_id,
+                username=None,
+                qty=len(claims),
+            )
+
+            promoted = await promote_waitlist(conn, [(channel_chat_id, channel_message_id)])
+            if promoted:
+                new_remaining = promoted[-1]["remaining"]
+
+            return {
+                **result,
+                "status": "ok",
+                "qty": len(claims),
+                "remaining": int(new_remaining),
+                "promoted": promoted,
+            }
@@ -0,0 +1,168 @@
+# cluster.py
+
+import asyncio
+import os
+import socket
+from typing import Callable, Dict, Optional
+
+import asyncpg
+
+from db import DATABASE_URL, get_pool
+
+# Multi-instance coordination (BOT_INSTANCES > 1, webhook mode):
+#   • leader election — a session-level advisory lock held on a
+#     dedicated connection; scheduler.py runs leader_only jobs only
+#     while is_leader(), so they move if the leader dies
+#   • LISTEN/NOTIFY channels, e.g. session store invalidation
+#
+# Both need a session-mode connection: LISTEN and session advisory
+# locks don't survive pgbouncer transaction pooling, so point
+# DATABASE_DIRECT_URL at the direct / session-pooler Supabase URL.
+# With a single instance this module is a no-op and we're the leader.
+
+BOT_INSTANCES = int(os.getenv("BOT_INSTANCES", "1"))
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+DATABASE_DIRECT_URL = os.getenv("DATABASE_DIRECT_URL") or DATABASE_URL
+LEADER_CHECK_SECONDS = float(os.getenv("LEADER_CHECK_SECONDS", "5"))
+
+LEADER_LOCK_KEY = 0x4E535043  # "NSPC"
+
+_conn: Optional[asyncpg.Connection] = None
+_task: Optional[asyncio.Task] = None
+_leader = False
+
+# channel → callback(payload: str)
+_listeners: Dict[str, Callable[[str], None]] = {}
+
+
+def multi_instance() -> bool:
+    return BOT_INSTANCES > 1
+
+
+def is_leader() -> bool:
+    return _leader
+
+
+# ===========================
+# LEADERSHIP
+# ===========================
+
+def _become_leader():
+    global _leader
+    _leader = True
+    print(f"Cluster: {INSTANCE_ID} is leader")
+
+
+def _lose_leadership():
+    global _leader
+    if _leader:
+        print(f"Cluster: {INSTANCE_ID} lost leadership")
+    _leader = False
+
+
+# ===========================
+# NOTIFY
+# ===========================
+
+def on_notify(channel: str, callback: Callable[[str], None]):
+    """
+    callback(payload) runs on the event loop for every NOTIFY on
+    channel (from any instance, including this one).
+    """
+    _listeners[channel] = callback
+
+
+async def notify(channel: str, payload: str):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT pg_notify($1, $2)", channel, payload)
+
+
+def _dispatch(connection, pid, channel, payload):
+    callback = _listeners.get(channel)
+    if callback is None:
+        return
+    try:
+        callback(payload)
+    except Exception as e:
+        print("Cluster notify handler failed:", channel, e)
+
+
+# ===========================
+# LIFECYCLE
+# ===========================
+
+async def _connect():
+    global _conn
+
+    _conn = await asyncpg.connect(
+        DATABASE_DIRECT_URL,
+        ssl="require",
+        timeout=30,
+        statement_cache_size=0,
+    )
+    for channel in _listeners:
+        await _conn.add_listener(channel, _dispatch)
+
+
+async def _drop_connection():
+    global _conn
+
+    _lose_leadership()
+    if _conn is not None:
+        try:
+            await _conn.close(timeout=5)
+        except Exception:
+            _conn.terminate()
+        _conn = None
+
+
+async def _tick():
+    if _conn is None or _conn.is_closed():
+        await _drop_connection()
+        await _connect()
+
+    if _leader:
+        # Keep-alive: the lock lives exactly as long as this connection
+        await _conn.fetchval("SELECT 1")
+    elif await _conn.fetchval("SELECT pg_try_advisory_lock($1)", LEADER_LOCK_KEY):
+        _become_leader()
+
+
+async def _cluster_loop():
+    while True:
+        await asyncio.sleep(LEADER_CHECK_SECONDS)
+        try:
+            await _tick()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Cluster connection lost:", e)
+            await _drop_connection()
+
+
+async def start_cluster():
+    """
+    Called from main.main after init_db and after every module has
+    registered its listeners.
+    """
+    global _task
+
+    if not multi_instance():
+        _become_leader()
+        return
+
+    await _tick()  # first election attempt before serving
+    if _task is None:
+        _task = asyncio.create_task(_cluster_loop())
+
+
+async def stop_cluster():
+    global _task
+
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+
+    await _drop_connection()  # releases the leader lock immediately
@@ -26,3 +26,11 @@ CHANNEL_ID = _require_env_int("CHANNEL_ID")
 
 # Optional (only for display / channel links, etc.)
 CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME")
+
+# Webhook mode (required when running several instances)
+# e.g. WEBHOOK_BASE_URL=https://nspc-bot.onrender.com
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("PORT", "8080"))
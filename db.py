@@ -2,6 +2,11 @@ import asyncpg
 import os
 import json
 
+try:
+    import orjson  # faster JSON; stdlib json is the fallback
+except ImportError:
+    orjson = None
+
 
 from datetime import timedelta
 from contextlib import asynccontextmanager
@@ -39,6 +44,41 @@ VALID_STATUSES = {
     STATUS_SHIPPED,
 }
 
+# ===========================
+# JSON CODECS
+# ===========================
+# json/jsonb columns are encoded and decoded on the connection, so
+# callers pass and receive Python objects (no json.dumps / ::text).
+
+if orjson is not None:
+    def json_dumps(value) -> str:
+        # int dict keys are stringified, same as json.dumps
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    json_loads = orjson.loads
+else:
+    def json_dumps(value) -> str:
+        return json.dumps(value, separators=(",", ":"))
+
+    json_loads = json.loads
+
+
+async def _init_connection(conn):
+    """
+    Runs once per new pool connection: registers the JSON codecs up
+    front, so type introspection isn't repeated per query (no
+    statement cache behind pgbouncer).
+    """
+    for typename in ("jsonb", "json"):
+        await conn.set_type_codec(
+            typename,
+            schema="pg_catalog",
+            encoder=json_dumps,
+            decoder=json_loads,
+            format="text",
+        )
+
+
 async def init_db():
     """
     Connects the bot to Supabase.
@@ -57,7 +97,9 @@ async def init_db():
             ssl="require",
             timeout=30,
             statement_cache_size=0,  # 🔑 REQUIRED for Supabase + pgbouncer
+            init=_init_connection,
         )
+       await ensure_schema()
 
 
 async def get_pool():
@@ -68,6 +110,361 @@ async def get_pool():
         raise RuntimeError("Database not initialized. Call init_db() first.")
     return _pool
 
+# ===========================
+# BOT-OWNED TABLES
+# ===========================
+# Tables the bot creates itself (idempotent, run by init_db).
+
+# Invoice numbers are handed out in blocks (see invoice_numbers.py):
+# one nextval reserves a block as long as the sequence's increment.
+# INVOICE_BLOCK_SIZE only sets the increment when the sequence is
+# created; blocks are always sized from the sequence itself, so they
+# can't overlap if the constant changes later.
+INVOICE_BLOCK_SIZE = 50
+
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS ocr_results (
+        file_unique_id TEXT NOT NULL,
+        params_key TEXT NOT NULL,
+        text TEXT NOT NULL,
+        tracking TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (file_unique_id, params_key)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        data JSONB NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (namespace, key)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS photo_buffer (
+        owner_id BIGINT NOT NULL,
+        kind TEXT NOT NULL,
+        file_unique_id TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        message_id BIGINT NOT NULL,
+        pending BOOLEAN NOT NULL DEFAULT false,
+        text TEXT,
+        tracking TEXT,
+        received_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (owner_id, kind, file_unique_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS claim_events (
+        id BIGSERIAL PRIMARY KEY,
+        event_type TEXT NOT NULL
+            CHECK (event_type IN ('claimed', 'cancelled', 'expired', 'admin_cancelled')),
+        channel_chat_id BIGINT NOT NULL,
+        channel_message_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        username TEXT,
+        qty INTEGER NOT NULL CHECK (qty > 0),
+        actor_id BIGINT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS claim_events_post_idx
+        ON claim_events (channel_chat_id, channel_message_id, id)
+    """,
+    f"""
+    CREATE SEQUENCE IF NOT EXISTS invoice_no_seq INCREMENT BY {INVOICE_BLOCK_SIZE}
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS claim_waitlist (
+        channel_chat_id BIGINT NOT NULL,
+        channel_message_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        username TEXT,
+        qty INTEGER NOT NULL CHECK (qty > 0),
+        joined_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (channel_chat_id, channel_message_id, user_id)
+    )
+    """,
+    # Discussion thread of each channel post and its claims board
+    # reply (see claims_board.py)
+    """
+    CREATE TABLE IF NOT EXISTS post_threads (
+        channel_chat_id BIGINT NOT NULL,
+        channel_message_id BIGINT NOT NULL,
+        thread_chat_id BIGINT,
+        thread_message_id BIGINT,
+        board_message_id BIGINT,
+        board_claimed_at TIMESTAMPTZ,
+        PRIMARY KEY (channel_chat_id, channel_message_id)
+    )
+    """,
+    # Order a claim was checked out into (see OPEN_CLAIM)
+    """
+    ALTER TABLE claims
+        ADD COLUMN IF NOT EXISTS order_id BIGINT
+    """,
+    # Per-listing claim allocation (see allocation_windows.py)
+    """
+    ALTER TABLE card_listing
+        ADD COLUMN IF NOT EXISTS allocation_mode TEXT NOT NULL DEFAULT 'live'
+    """,
+    # true when the claim/cancel buttons sit on the post itself (single
+    # photo), so caption edits must resend them
+    """
+    ALTER TABLE card_listing
+        ADD COLUMN IF NOT EXISTS claim_buttons BOOLEAN NOT NULL DEFAULT false
+    """,
+]
+
+
+async def ensure_schema():
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        for stmt in SCHEMA_STATEMENTS:
+            await conn.execute(stmt)
+
+# ===========================
+# WAITLIST (see waitlist.py)
+# ===========================
+# Buyers who claimed a sold-out card. Whenever stock is released
+# (cancel, admin cancel, expiry) the caller runs promote_waitlist in
+# the same transaction, with the card rows already locked, so freed
+# units go straight to the next waiters instead of back on sale.
+
+async def join_waitlist(conn, *, channel_chat_id: int, channel_message_id: int,
+                        user_id: int, username, qty: int):
+    """
+    Returns the buyer's 1-based position (existing entry kept).
+    joined_at is clock_timestamp(), so several joins in one
+    transaction (a batch allocation) keep their order.
+    """
+    await conn.execute(
+        """
+        INSERT INTO claim_waitlist
+            (channel_chat_id, channel_message_id, user_id, username, qty, joined_at)
+        VALUES ($1, $2, $3, $4, $5, clock_timestamp())
+        ON CONFLICT DO NOTHING
+        """,
+        channel_chat_id, channel_message_id, user_id, username, qty
+    )
+    return await conn.fetchval(
+        """
+        SELECT COUNT(*)
+        FROM claim_waitlist w
+        JOIN claim_waitlist me
+          ON me.channel_chat_id = w.channel_chat_id
+         AND me.channel_message_id = w.channel_message_id
+         AND me.user_id = $3
+        WHERE w.channel_chat_id = $1
+          AND w.channel_message_id = $2
+          AND (w.joined_at, w.user_id) <= (me.joined_at, me.user_id)
+        """,
+        channel_chat_id, channel_message_id, user_id
+    )
+
+
+async def leave_waitlist(conn, *, channel_chat_id: int, channel_message_id: int,
+                         user_id: int) -> bool:
+    status = await conn.execute(
+        """
+        DELETE FROM claim_waitlist
+        WHERE channel_chat_id = $1
+          AND channel_message_id = $2
+          AND user_id = $3
+        """,
+        channel_chat_id, channel_message_id, user_id
+    )
+    return status.split()[-1] != "0"
+
+
+def plan_promotions(waiters):
+    """
+    waiters = rows ordered by post, then join order, each with the
+    post's remaining_qty and base_order (active claim count). Each
+    waiter gets min(asked, left) while the post's stock lasts; a
+    partly served waiter still leaves the waitlist. Returns the grants
+    (with start_order for claim_order, and remaining = the post's
+    remaining_qty after all its grants).
+    """
+    left = {}
+    next_order = {}
+    grants = []
+    for w in waiters:
+        post = (w["channel_chat_id"], w["channel_message_id"])
+        left.setdefault(post, int(w["remaining_qty"]))
+        next_order.setdefault(post, int(w["base_order"]))
+        if left[post] <= 0:
+            continue
+        got = min(int(w["qty"]), left[post])
+        grants.append({
+            "channel_chat_id": post[0],
+            "channel_message_id": post[1],
+            "user_id": w["user_id"],
+            "username": w["username"],
+            "qty": got,
+            "start_order": next_order[post],
+            "card_name": w["card_name"],
+            "price": w["price"],
+            "claim_buttons": w["claim_buttons"],
+        })
+        left[post] -= got
+        next_order[post] += got
+
+    for g in grants:
+        g["remaining"] = left[(g["channel_chat_id"], g["channel_message_id"])]
+    return grants
+
+
+async def promote_waitlist(conn, posts):
+    """
+    posts = [(channel_chat_id, channel_message_id), ...], card rows
+    locked by the caller. Waiters get min(asked, left) in join order
+    while stock lasts. Returns one dict per promoted buyer
+    (post, user_id, username, qty, card_name, price, claim_buttons,
+    remaining = the post's remaining_qty after all promotions).
+    """
+    if not posts:
+        return []
+
+    waiters = await conn.fetch(
+        """
+        SELECT
+            w.channel_chat_id,
+            w.channel_message_id,
+            w.user_id,
+            w.username,
+            w.qty,
+            cl.card_name,
+            cl.price,
+            cl.claim_buttons,
+            cl.remaining_qty,
+            (SELECT COUNT(*)
+             FROM claims c
+             WHERE c.channel_chat_id = w.channel_chat_id
+               AND c.channel_message_id = w.channel_message_id
+               AND c.status = 'active') AS base_order
+        FROM claim_waitlist w
+        JOIN card_listing cl
+          ON cl.channel_chat_id = w.channel_chat_id
+         AND cl.channel_message_id = w.channel_message_id
+        WHERE (w.channel_chat_id, w.channel_message_id) IN (
+                SELECT * FROM unnest($1::bigint[], $2::bigint[])
+              )
+          AND cl.remaining_qty > 0
+          AND NOT EXISTS (
+              SELECT 1
+              FROM claims c
+              WHERE c.channel_chat_id = w.channel_chat_id
+                AND c.channel_message_id = w.channel_message_id
+                AND c.user_id = w.user_id
+                AND c.status = 'active'
+          )
+        ORDER BY w.channel_chat_id, w.channel_message_id, w.joined_at, w.user_id
+        """,
+        [p[0] for p in posts],
+        [p[1] for p in posts]
+    )
+    grants = plan_promotions(waiters)
+    if not grants:
+        return []
+
+    # Waitlist rows, claims, stock and claim log in one statement
+    await conn.execute(
+        """
+        WITH g AS (
+            SELECT *
+            FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::text[], $5::int[], $6::int[])
+                 AS g(channel_chat_id, channel_message_id, user_id, username, qty, start_order)
+        ),
+        removed AS (
+            DELETE FROM claim_waitlist w
+            USING g
+            WHERE w.channel_chat_id = g.channel_chat_id
+              AND w.channel_message_id = g.channel_message_id
+              AND w.user_id = g.user_id
+        ),
+        inserted AS (
+            INSERT INTO claims (
+                channel_chat_id,
+                channel_message_id,
+                user_id,
+                username,
+                claim_order
+            )
+            SELECT g.channel_chat_id, g.channel_message_id, g.user_id, g.username,
+                   g.start_order + n
+            FROM g
+            CROSS JOIN LATERAL generate_series(1, g.qty) AS n
+        ),
+        logged AS (
+            INSERT INTO claim_events
+                (event_type, channel_chat_id, channel_message_id, user_id, username, qty)
+            SELECT 'claimed', channel_chat_id, channel_message_id, user_id, username, qty
+            FROM g
+        )
+        UPDATE card_listing cl
+        SET remaining_qty = cl.remaining_qty - t.qty
+        FROM (
+            SELECT channel_chat_id, channel_message_id, SUM(qty) AS qty
+            FROM g
+            GROUP BY channel_chat_id, channel_message_id
+        ) t
+        WHERE cl.channel_chat_id = t.channel_chat_id
+          AND cl.channel_message_id = t.channel_message_id
+        """,
+        [g["channel_chat_id"] for g in grants],
+        [g["channel_message_id"] for g in grants],
+        [g["user_id"] for g in grants],
+        [g["username"] for g in grants],
+        [g["qty"] for g in grants],
+        [g["start_order"] for g in grants]
+    )
+
+    return grants
+
+
+async def load_waitlists():
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(
+            """
+            SELECT channel_chat_id, channel_message_id, user_id
+            FROM claim_waitlist
+            ORDER BY channel_chat_id, channel_message_id, joined_at, user_id
+            """
+        )
+
+# ===========================
+# CLAIM ↔ ORDER LINK
+# ===========================
+# Checkout stamps the buyer's claims with the new order's id
+# (claims.order_id); they stay 'active' (stock and claim log are
+# unchanged). SQL fragments over `claims c`:
+#
+# OPEN_CLAIM: not on a live order. Only these expire or are
+#   released by the buyer; an order's claims are the order's.
+# BAG_CLAIM: what the buyer still has to check out. Also takes the
+#   claims of an unpaid order, since the next checkout supersedes it.
+
+OPEN_CLAIM = """
+    NOT EXISTS (
+        SELECT 1 FROM orders o
+        WHERE o.id = c.order_id
+          AND o.status <> 'cancelled'
+    )
+"""
+
+BAG_CLAIM = """
+    NOT EXISTS (
+        SELECT 1 FROM orders o
+        WHERE o.id = c.order_id
+          AND o.status NOT IN ('cancelled', 'pending_payment')
+    )
+"""
+
 # ===========================
 # STALE CLAIMS MGMT
 # ===========================
@@ -76,12 +473,13 @@ async def get_stale_claims_for_user(user_id: int, hours: int):
     pool = await get_pool()
     async with pool.acquire() as conn:
         return await conn.fetch(
-            """
+            f"""
             SELECT *
-            FROM claims
-            WHERE user_id = $1
-              AND status = 'active'
-              AND claimed_at < (now() - make_interval(hours => $2))
+            FROM claims c
+            WHERE c.user_id = $1
+              AND c.status = 'active'
+              AND c.claimed_at < (now() - make_interval(hours => $2))
+              AND {OPEN_CLAIM}
             """,
             user_id,
             hours
@@ -89,68 +487,719 @@ async def get_stale_claims_for_user(user_id: int, hours: int):
 
 
 
-async def cancel_all_claims_for_user(user_id: int):
+async def cancel_all_claims_for_user(user_id: int, event_type: str = "expired"):
     pool = await get_pool()
     async with pool.acquire() as conn:
         async with conn.transaction():
-            # Restore stock
-            rows = await conn.fetch(
-                """
-                SELECT channel_chat_id, channel_message_id, COUNT(*) AS qty
-                FROM claims
-                WHERE user_id = $1 AND status = 'active'
-                GROUP BY channel_chat_id, channel_message_id
+            # Lock the user's cards first (card before claims, like the
+            # claim paths) so this can't deadlock with a concurrent claim
+            await conn.execute(
+                f"""
+                SELECT 1
+                FROM card_listing cl
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM claims c
+                    WHERE c.channel_chat_id = cl.channel_chat_id
+                      AND c.channel_message_id = cl.channel_message_id
+                      AND c.user_id = $1
+                      AND c.status = 'active'
+                      AND {OPEN_CLAIM}
+                )
+                ORDER BY cl.id
+                FOR UPDATE
                 """,
                 user_id
             )
 
-            for r in rows:
+            # Cancel claims, log them (see claim_events.py), restore stock.
+            # Claims on a live order are left to the order
+            restored = await conn.fetch(
+                f"""
+                WITH cancelled AS (
+                    UPDATE claims c
+                    SET status = 'cancelled'
+                    WHERE c.user_id = $1
+                      AND c.status = 'active'
+                      AND {OPEN_CLAIM}
+                    RETURNING c.channel_chat_id, c.channel_message_id, c.username
+                ),
+                per_post AS (
+                    SELECT channel_chat_id, channel_message_id,
+                           MAX(username) AS username, COUNT(*) AS qty
+                    FROM cancelled
+                    GROUP BY channel_chat_id, channel_message_id
+                ),
+                logged AS (
+                    INSERT INTO claim_events
+                        (event_type, channel_chat_id, channel_message_id, user_id, username, qty)
+                    SELECT $2, channel_chat_id, channel_message_id, $1, username, qty
+                    FROM per_post
+                )
+                UPDATE card_listing cl
+                SET remaining_qty = cl.remaining_qty + p.qty
+                FROM per_post p
+                WHERE cl.channel_chat_id = p.channel_chat_id
+                  AND cl.channel_message_id = p.channel_message_id
+                RETURNING cl.channel_chat_id, cl.channel_message_id
+                """,
+                user_id,
+                event_type
+            )
+
+            # Freed stock goes to the waitlists first
+            return await promote_waitlist(
+                conn,
+                [(r["channel_chat_id"], r["channel_message_id"]) for r in restored]
+            )
+
+
+async def expire_stale_claims(hours: int):
+    """
+    Bulk expiry for the scheduler: every open claim (OPEN_CLAIM: not on
+    a live order) older than `hours` is cancelled, logged as 'expired'
+    and its stock restored, in one statement. Card rows are locked first (same order as the
+    claim paths: card, then claims) to avoid deadlocks.
+    Freed stock is offered to the posts' waitlists in the same
+    transaction. Returns (posts with their new remaining_qty,
+    waitlist promotions).
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                f"""
+                SELECT 1
+                FROM card_listing cl
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM claims c
+                    WHERE c.channel_chat_id = cl.channel_chat_id
+                      AND c.channel_message_id = cl.channel_message_id
+                      AND c.status = 'active'
+                      AND c.claimed_at < (now() - make_interval(hours => $1))
+                      AND {OPEN_CLAIM}
+                )
+                ORDER BY cl.id
+                FOR UPDATE
+                """,
+                hours
+            )
+            rows = await conn.fetch(
+                f"""
+                WITH expired AS (
+                    UPDATE claims c
+                    SET status = 'cancelled'
+                    WHERE c.status = 'active'
+                      AND c.claimed_at < (now() - make_interval(hours => $1))
+                      AND {OPEN_CLAIM}
+                    RETURNING c.channel_chat_id, c.channel_message_id, c.user_id, c.username
+                ),
+                per_user AS (
+                    SELECT channel_chat_id, channel_message_id, user_id,
+                           MAX(username) AS username, COUNT(*) AS qty
+                    FROM expired
+                    GROUP BY channel_chat_id, channel_message_id, user_id
+                ),
+                logged AS (
+                    INSERT INTO claim_events
+                        (event_type, channel_chat_id, channel_message_id, user_id, username, qty)
+                    SELECT 'expired', channel_chat_id, channel_message_id, user_id, username, qty
+                    FROM per_user
+                ),
+                per_post AS (
+                    SELECT channel_chat_id, channel_message_id, SUM(qty) AS qty
+                    FROM per_user
+                    GROUP BY channel_chat_id, channel_message_id
+                )
+                UPDATE card_listing cl
+                SET remaining_qty = cl.remaining_qty + p.qty
+                FROM per_post p
+                WHERE cl.channel_chat_id = p.channel_chat_id
+                  AND cl.channel_message_id = p.channel_message_id
+                RETURNING cl.channel_chat_id, cl.channel_message_id, cl.card_name,
+                          cl.price, cl.claim_buttons, cl.remaining_qty, p.qty AS restored
+                """,
+                hours
+            )
+            posts = [dict(r) for r in rows]
+
+            promoted = await promote_waitlist(
+                conn,
+                [(p["channel_chat_id"], p["channel_message_id"]) for p in posts]
+            )
+            for g in promoted:
+                for p in posts:
+                    if (p["channel_chat_id"], p["channel_message_id"]) == (
+                        g["channel_chat_id"], g["channel_message_id"]
+                    ):
+                        p["remaining_qty"] = g["remaining"]
+            return posts, promoted
+
+
+async def get_user_claims_summary(user_id: int):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(
+            f"""
+            SELECT
+                cl.card_name,
+                cl.price,
+                COUNT(*) AS qty
+            FROM claims c
+            JOIN card_listing cl
+              ON c.channel_chat_id = cl.channel_chat_id
+             AND c.channel_message_id = cl.channel_message_id
+            WHERE c.user_id = $1
+              AND c.status = 'active'
+              AND {BAG_CLAIM}
+            GROUP BY cl.card_name, cl.price
+            ORDER BY cl.card_name
+            """,
+            user_id
+        )
+
+
+async def get_all_claims_summaries():
+    """
+    get_user_claims_summary for every buyer with active claims,
+    in one round trip (ordered by user, then card name).
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(
+            f"""
+            SELECT
+                c.user_id,
+                MAX(c.username) AS username,
+                cl.card_name,
+                cl.price,
+                COUNT(*) AS qty
+            FROM claims c
+            JOIN card_listing cl
+              ON c.channel_chat_id = cl.channel_chat_id
+             AND c.channel_message_id = cl.channel_message_id
+            WHERE c.status = 'active'
+              AND {BAG_CLAIM}
+            GROUP BY c.user_id, cl.card_name, cl.price
+            ORDER BY c.user_id, cl.card_name
+            """
+        )
+
+
+
+
+
+# ===========================
+# SESSION STORE (postgres backend, see session_store.py)
+# ===========================
+
+async def load_session_value(namespace: str, key: str):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            """
+            SELECT data
+            FROM sessions
+            WHERE namespace = $1
+              AND key = $2
+            """,
+            namespace,
+            key
+        )
+
+
+async def load_session_namespace(namespace: str):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(
+            """
+            SELECT key, data
+            FROM sessions
+            WHERE namespace = $1
+            """,
+            namespace
+        )
+
+
+async def save_session_values(items: list[tuple[str, str, object]]):
+    """
+    Batched upsert/delete: [(namespace, key, value | None), ...].
+    Two statements per flush regardless of batch size.
+    """
+    upserts = [i for i in items if i[2] is not None]
+    deletes = [i for i in items if i[2] is None]
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if deletes:
+                await conn.execute(
+                    """
+                    DELETE FROM sessions s
+                    USING unnest($1::text[], $2::text[]) AS d(namespace, key)
+                    WHERE s.namespace = d.namespace
+                      AND s.key = d.key
+                    """,
+                    [d[0] for d in deletes],
+                    [d[1] for d in deletes]
+                )
+            if upserts:
                 await conn.execute(
                     """
-                    UPDATE card_listing
-                    SET remaining_qty = remaining_qty + $1
-                    WHERE channel_chat_id = $2
-                      AND channel_message_id = $3
+                    INSERT INTO sessions (namespace, key, data, updated_at)
+                    SELECT namespace, key, data, now()
+                    FROM unnest($1::text[], $2::text[], $3::jsonb[])
+                         AS u(namespace, key, data)
+                    ON CONFLICT (namespace, key)
+                    DO UPDATE SET
+                        data = EXCLUDED.data,
+                        updated_at = now()
                     """,
-                    r["qty"],
-                    r["channel_chat_id"],
-                    r["channel_message_id"]
+                    [u[0] for u in upserts],
+                    [u[1] for u in upserts],
+                    [u[2] for u in upserts]
                 )
 
-            # Cancel claims
-            await conn.execute(
-                """
-                UPDATE claims
+# ===========================
+# PHOTO BUFFER
+# ===========================
+# Album photos (card uploads, batch shipping labels) arrive as separate
+# updates, possibly on different bot instances. Each one is buffered
+# here; whichever instance sees the album go quiet takes it whole.
+
+async def buffer_photo(
+    owner_id: int,
+    kind: str,
+    *,
+    file_id: str,
+    file_unique_id: str,
+    message_id: int,
+    pending: bool = False,
+) -> bool:
+    """
+    False if this photo was already buffered.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        status = await conn.execute(
+            """
+            INSERT INTO photo_buffer (owner_id, kind, file_unique_id, file_id, message_id, pending)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT DO NOTHING
+            """,
+            owner_id,
+            kind,
+            file_unique_id,
+            file_id,
+            message_id,
+            pending
+        )
+        return status == "INSERT 0 1"
+
+
+async def set_buffered_photo_result(
+    owner_id: int,
+    kind: str,
+    file_unique_id: str,
+    text: str,
+    tracking: str | None,
+):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            UPDATE photo_buffer
+            SET pending = false,
+                text = $4,
+                tracking = $5
+            WHERE owner_id = $1
+              AND kind = $2
+              AND file_unique_id = $3
+            """,
+            owner_id,
+            kind,
+            file_unique_id,
+            text,
+            tracking
+        )
+
+
+async def take_photo_buffer(
+    owner_id: int,
+    kind: str,
+    quiet_seconds: float,
+    pending_seconds: float | None = None,
+):
+    """
+    Atomically removes and returns the buffered photos (in message
+    order), but only once nothing arrived for quiet_seconds and no
+    photo is still pending. A pending photo stops holding the group
+    once the group's last photo is pending_seconds old (its result
+    was lost); it is returned without text. Concurrent callers: one
+    gets the rows, the rest get [].
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            WITH grp AS (
+                SELECT MAX(received_at) AS last_at, bool_or(pending) AS pending
+                FROM photo_buffer
+                WHERE owner_id = $1
+                  AND kind = $2
+            )
+            DELETE FROM photo_buffer b
+            USING grp
+            WHERE b.owner_id = $1
+              AND b.kind = $2
+              AND grp.last_at <= now() - make_interval(secs => $3)
+              AND (NOT grp.pending
+                   OR grp.last_at <= now() - make_interval(secs => $4))
+            RETURNING b.file_id, b.file_unique_id, b.message_id, b.text, b.tracking
+            """,
+            owner_id,
+            kind,
+            float(quiet_seconds),
+            None if pending_seconds is None else float(pending_seconds)
+        )
+    return sorted(rows, key=lambda r: r["message_id"])
+
+
+async def clear_photo_buffer(owner_id: int, kind: str):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "DELETE FROM photo_buffer WHERE owner_id = $1 AND kind = $2",
+            owner_id,
+            kind
+        )
+
+async def prune_photo_buffer(max_age_minutes: int) -> int:
+    """
+    Drops photos nobody took (flow cancelled, instance died).
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        status = await conn.execute(
+            """
+            DELETE FROM photo_buffer
+            WHERE received_at < now() - make_interval(mins => $1)
+            """,
+            max_age_minutes
+        )
+        return int(status.split()[-1])
+
+# ===========================
+# POST THREADS + CLAIMS BOARDS (see claims_board.py)
+# ===========================
+
+async def save_post_thread(
+    channel_chat_id: int,
+    channel_message_id: int,
+    thread_chat_id: int,
+    thread_message_id: int,
+):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO post_threads
+                (channel_chat_id, channel_message_id, thread_chat_id, thread_message_id)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (channel_chat_id, channel_message_id)
+            DO UPDATE SET
+                thread_chat_id = EXCLUDED.thread_chat_id,
+                thread_message_id = EXCLUDED.thread_message_id
+            """,
+            channel_chat_id, channel_message_id, thread_chat_id, thread_message_id
+        )
+
+
+async def get_post_thread(channel_chat_id: int, channel_message_id: int):
+    """
+    (thread_chat_id, thread_message_id, board_message_id) row or None.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchrow(
+            """
+            SELECT thread_chat_id, thread_message_id, board_message_id
+            FROM post_threads
+            WHERE channel_chat_id = $1
+              AND channel_message_id = $2
+            """,
+            channel_chat_id, channel_message_id
+        )
+
+
+async def claim_board_creation(
+    channel_chat_id: int,
+    channel_message_id: int,
+    *,
+    thread,
+    seen_board_id,
+    stale_seconds: int,
+):
+    """
+    Makes this instance the one that posts the post's claims board.
+    Wins only if board_message_id is still what the caller saw
+    (None, or a board found deleted) and nobody else claimed it in
+    the last stale_seconds. thread = (chat id, message id), used when
+    post_threads doesn't know the thread yet. Returns the thread row
+    to post into, or None if another instance has it.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchrow(
+            """
+            INSERT INTO post_threads AS pt
+                (channel_chat_id, channel_message_id, thread_chat_id, thread_message_id,
+                 board_claimed_at)
+            VALUES ($1, $2, $3, $4, now())
+            ON CONFLICT (channel_chat_id, channel_message_id)
+            DO UPDATE SET
+                thread_chat_id = COALESCE(pt.thread_chat_id, EXCLUDED.thread_chat_id),
+                thread_message_id = COALESCE(pt.thread_message_id, EXCLUDED.thread_message_id),
+                board_claimed_at = now()
+            WHERE pt.board_message_id IS NOT DISTINCT FROM $5::bigint
+              AND (pt.board_claimed_at IS NULL
+                   OR pt.board_claimed_at < now() - make_interval(secs => $6))
+            RETURNING thread_chat_id, thread_message_id
+            """,
+            channel_chat_id, channel_message_id, thread[0], thread[1],
+            seen_board_id, stale_seconds
+        )
+
+
+async def save_board_message(
+    channel_chat_id: int,
+    channel_message_id: int,
+    board_message_id,
+):
+    """
+    Records the board posted after claim_board_creation and releases
+    the claim (board_message_id=None only releases it).
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            UPDATE post_threads
+            SET board_message_id = COALESCE($3, board_message_id),
+                board_claimed_at = NULL
+            WHERE channel_chat_id = $1
+              AND channel_message_id = $2
+            """,
+            channel_chat_id, channel_message_id, board_message_id
+        )
+
+# ===========================
+# CROSS-INSTANCE LOCKS
+# ===========================
+
+@asynccontextmanager
+async def advisory_lock(name: str):
+    """
+    Transaction-scoped advisory lock (works through pgbouncer).
+    Serializes a critical section across all bot instances; the
+    connection is yielded so the section can use the same transaction.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", name)
+            yield conn
+
+# ===========================
+# OCR RESULT CACHE
+# ===========================
+
+async def get_ocr_result(file_unique_id: str, params_key: str):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchrow(
+            """
+            SELECT text, tracking
+            FROM ocr_results
+            WHERE file_unique_id = $1
+              AND params_key = $2
+            """,
+            file_unique_id,
+            params_key
+        )
+
+
+async def save_ocr_result(
+    file_unique_id: str,
+    params_key: str,
+    text: str,
+    tracking: str | None,
+):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO ocr_results (file_unique_id, params_key, text, tracking)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (file_unique_id, params_key)
+            DO UPDATE SET
+                text = EXCLUDED.text,
+                tracking = EXCLUDED.tracking,
+                created_at = now()
+            """,
+            file_unique_id,
+            params_key,
+            text,
+            tracking
+        )
+
+async def prune_ocr_results(max_age_days: int) -> int:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        status = await conn.execute(
+            """
+            DELETE FROM ocr_results
+            WHERE created_at < now() - make_interval(days => $1)
+            """,
+            max_age_days
+        )
+        return int(status.split()[-1])
+
+# ===========================
+# ORDER CREATION
+# ===========================
+
+# Unit price inside a card_listing.price string ("$12", "SGD 12.50",
+# "$1,200"). Thousands separators are stripped first, then the first
+# number wins. Orders parse it in SQL with this pattern;
+# checkout.parse_price_to_float uses the same rule, so draft invoices
+# and orders can't disagree.
+PRICE_PATTERN = r"[0-9]+(?:\.[0-9]+)?"
+
+async def reserve_invoice_block() -> tuple[int, int]:
+    """
+    (first number, size) of a fresh block of invoice numbers; size is
+    invoice_no_seq's increment, i.e. the distance to the next block.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            SELECT nextval('invoice_no_seq') AS start, seqincrement AS size
+            FROM pg_sequence
+            WHERE seqrelid = 'invoice_no_seq'::regclass
+            """
+        )
+        return row["start"], row["size"]
+
+
+async def create_order_from_claims(
+    *,
+    user_id: int,
+    username: str,
+    invoice_no: str,
+    delivery_method: str,
+    delivery_fee: float,
+):
+    """
+    Checkout: turns the buyer's bag (BAG_CLAIM) into an order plus one
+    order_item per post, in one statement, and links the claims to the
+    order. An earlier unpaid order of the same buyer is superseded
+    (cancelled); claims on a paid order are never billed again.
+    Serialized per buyer, so a double tap can't bill the bag twice.
+    Returns the invoice lines grouped like get_user_claims_summary
+    (card_name, price, qty), each row also carrying order_id,
+    cards_total and total; empty if the bag is empty.
+    """
+    async with advisory_lock(f"checkout:{user_id}") as conn:
+        return await conn.fetch(
+            f"""
+            WITH bag AS (
+                SELECT c.id, c.channel_message_id, cl.card_name, cl.price
+                FROM claims c
+                JOIN card_listing cl
+                  ON c.channel_chat_id = cl.channel_chat_id
+                 AND c.channel_message_id = cl.channel_message_id
+                WHERE c.user_id = $1
+                  AND c.status = 'active'
+                  AND {BAG_CLAIM}
+            ),
+            items AS (
+                SELECT
+                    card_name,
+                    price AS price_str,
+                    COALESCE(substring(replace(price, ',', '') FROM $6)::numeric, 0) AS price,
+                    channel_message_id AS post_mid,
+                    COUNT(*) AS qty
+                FROM bag
+                GROUP BY card_name, price, channel_message_id
+            ),
+            superseded AS (
+                UPDATE orders
                 SET status = 'cancelled'
-                WHERE user_id = $1 AND status = 'active'
-                """,
-                user_id
+                WHERE user_id = $1
+                  AND status = 'pending_payment'
+                  AND EXISTS (SELECT 1 FROM items)
+            ),
+            ord AS (
+                INSERT INTO orders
+                    (invoice_no, user_id, username, delivery_method,
+                     cards_total, delivery_fee, total, status)
+                SELECT $2, $1, $3, $4, SUM(price * qty), $5, SUM(price * qty) + $5,
+                       'pending_payment'
+                FROM items
+                HAVING COUNT(*) > 0
+                RETURNING id, cards_total, total
+            ),
+            order_lines AS (
+                INSERT INTO order_items (order_id, card_name, price, post_message_id, qty)
+                SELECT ord.id, i.card_name, i.price, i.post_mid, i.qty
+                FROM ord
+                CROSS JOIN items i
+            ),
+            linked AS (
+                UPDATE claims c
+                SET order_id = ord.id
+                FROM ord
+                WHERE c.id IN (SELECT id FROM bag)
             )
-async def get_user_claims_summary(user_id: int):
+            SELECT
+                ord.id AS order_id,
+                ord.cards_total,
+                ord.total,
+                i.card_name,
+                i.price_str AS price,
+                SUM(i.qty)::int AS qty
+            FROM ord
+            CROSS JOIN items i
+            GROUP BY ord.id, ord.cards_total, ord.total, i.card_name, i.price_str
+            ORDER BY i.card_name
+            """,
+            user_id,
+            invoice_no,
+            username,
+            delivery_method,
+            delivery_fee,
+            PRICE_PATTERN
+        )
+
+
+async def mark_order_payment_received(invoice_no: str, user_id: int):
     pool = await get_pool()
     async with pool.acquire() as conn:
-        return await conn.fetch(
+        await conn.execute(
             """
-            SELECT
-                cl.card_name,
-                cl.price,
-                COUNT(*) AS qty
-            FROM claims c
-            JOIN card_listing cl
-              ON c.channel_chat_id = cl.channel_chat_id
-             AND c.channel_message_id = cl.channel_message_id
-            WHERE c.user_id = $1
-              AND c.status = 'active'
-            GROUP BY cl.card_name, cl.price
-            ORDER BY cl.card_name
+            UPDATE orders
+            SET status = 'payment_received'
+            WHERE invoice_no = $1
+              AND user_id = $2
+              AND status = 'pending_payment'
             """,
+            invoice_no,
             user_id
         )
 
-
-
-
-
 # ===========================
 # ORDER QUERY HELPERS
 # ===========================
@@ -212,6 +1261,77 @@ async def mark_order_shipped(
             order_id
         )
 
+async def mark_orders_shipped_bulk(shipments: list[tuple[int, str, str | None]]):
+    """
+    Batch version of mark_order_shipped: one transaction, one statement.
+    shipments = [(order_id, tracking, file_id), ...]
+    Only orders still 'packed' are updated; returns the updated rows.
+    """
+    if not shipments:
+        return []
+
+    order_ids, trackings, file_ids = (list(col) for col in zip(*shipments))
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            return await conn.fetch(
+                """
+                UPDATE orders o
+                SET status = $1,
+                    tracking_number = s.tracking,
+                    shipping_proof_file_id = s.file_id
+                FROM unnest($2::bigint[], $3::text[], $4::text[])
+                     AS s(order_id, tracking, file_id)
+                WHERE o.id = s.order_id
+                  AND o.status = $5
+                RETURNING o.id, o.user_id, o.invoice_no,
+                          o.tracking_number, o.shipping_proof_file_id
+                """,
+                STATUS_SHIPPED,
+                order_ids,
+                trackings,
+                file_ids,
+                STATUS_PACKED,
+            )
+
+
+async def get_issued_tracking_numbers():
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(
+            """
+            SELECT tracking_number, invoice_no
+            FROM orders
+            WHERE tracking_number IS NOT NULL
+            """
+        )
+
+
+async def get_packed_orders_with_address():
+    """
+    Packed orders plus recipient name/postal code (for label matching).
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(
+            """
+            SELECT
+                o.id,
+                o.invoice_no,
+                o.user_id,
+                o.username,
+                sa.name,
+                sa.postal_code
+            FROM orders o
+            LEFT JOIN shipping_address sa
+              ON sa.order_id = o.id
+            WHERE o.status = $1
+            ORDER BY o.created_at ASC
+            """,
+            STATUS_PACKED
+        )
+
 # ===========================
 # ORDER STATE SHORTCUTS
 # ===========================
@@ -324,7 +1444,10 @@ async def complete_shipping_session(order_id: int):
             order_id
         )
 
-async def get_active_shipping_session_by_admin(admin_id: int):
+async def get_active_shipping_session_by_admin(
+    admin_id: int,
+    steps: tuple[str, ...] = ("awaiting_photo",),
+):
     pool = await get_pool()
     async with pool.acquire() as conn:
         return await conn.fetchrow(
@@ -332,11 +1455,12 @@ async def get_active_shipping_session_by_admin(admin_id: int):
             SELECT *
             FROM shipping_sessions
             WHERE admin_id = $1
-              AND step = 'awaiting_photo'
+              AND step = ANY($2::text[])
             ORDER BY created_at DESC
             LIMIT 1
             """,
-            admin_id
+            admin_id,
+            list(steps)
         )
 
 # ===========================
@@ -397,91 +1521,6 @@ async def get_active_claims_by_user(user_id: int):
             user_id
         )
 
-# ===========================
-# BOT SESSION HELPERS
-# ===========================
-
-async def set_session(
-    user_id: int,
-    role: str,
-    session_type: str,
-    data: dict | None = None,
-):
-    """
-    Create or replace a session for a user.
-    One active session per user (enforced by PRIMARY KEY).
-    """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO bot_sessions (user_id, role, session_type, data, updated_at)
-            VALUES ($1, $2, $3, $4, NOW())
-            ON CONFLICT (user_id)
-            DO UPDATE SET
-                role = EXCLUDED.role,
-                session_type = EXCLUDED.session_type,
-                data = EXCLUDED.data,
-                updated_at = NOW()
-            """,
-            user_id,
-            role,
-            session_type,
-            json.dumps(data or {}),
-        )
-
-
-async def get_session(user_id: int):
-    """
-    Fetch the active session for a user.
-    Returns None if no session exists.
-    """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        return await conn.fetchrow(
-            """
-            SELECT user_id, role, session_type, data
-            FROM bot_sessions
-            WHERE user_id = $1
-            """,
-            user_id,
-        )
-
-
-async def clear_session(user_id: int):
-    """
-    Clear the active session for a user.
-    """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        await conn.execute(
-            "DELETE FROM bot_sessions WHERE user_id = $1",
-            user_id,
-        )
-# ===========================
-# ADMIN CSV SESSIONS
-# ===========================
-
-async def start_csv_photo_session(admin_id: int):
-    await set_session(
-        user_id=admin_id,
-        role="admin",
-        session_type="awaiting_card_photos",
-        data={},
-    )
-
-
-async def get_csv_photo_session(admin_id: int):
-    sess = await get_session(admin_id)
-    if not sess:
-        return None
-    if sess["role"] != "admin":
-        return None
-    if sess["session_type"] != "awaiting_card_photos":
-        return None
-    return sess
-
-
 # ===========================
 # ADMIN CSV / CARD LISTING HELPERS
 # ===========================
@@ -489,6 +1528,8 @@ async def get_csv_photo_session(admin_id: int):
 async def clear_card_listings():
     pool = await get_pool()
     async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM claim_waitlist")
+        await conn.execute("DELETE FROM post_threads")
         await conn.execute("DELETE FROM card_listing")
 
 
@@ -496,6 +1537,7 @@ async def insert_card_listing(
     card_name: str,
     price: str,
     qty: int,
+    allocation_mode: str = "live",
 ):
     pool = await get_pool()
     async with pool.acquire() as conn:
@@ -507,13 +1549,15 @@ async def insert_card_listing(
                 card_name,
                 price,
                 initial_qty,
-                remaining_qty
+                remaining_qty,
+                allocation_mode
             )
-            VALUES (0, 0, $1, $2, $3, $3)
+            VALUES (0, 0, $1, $2, $3, $3, $4)
             """,
             card_name,
             price,
             qty,
+            allocation_mode,
         )
 
 
@@ -522,7 +1566,7 @@ async def get_next_unposted_card():
     async with pool.acquire() as conn:
         return await conn.fetchrow(
             """
-            SELECT id, card_name, price, remaining_qty
+            SELECT id, card_name, price, remaining_qty, allocation_mode
             FROM card_listing
             WHERE channel_message_id = 0
             ORDER BY id ASC
@@ -535,6 +1579,7 @@ async def mark_card_posted(
     card_id: int,
     channel_chat_id: int,
     channel_message_id: int,
+    claim_buttons: bool = False,
 ):
     pool = await get_pool()
     async with pool.acquire() as conn:
@@ -542,12 +1587,14 @@ async def mark_card_posted(
             """
             UPDATE card_listing
             SET channel_chat_id = $1,
-                channel_message_id = $2
+                channel_message_id = $2,
+                claim_buttons = $4
             WHERE id = $3
             """,
             channel_chat_id,
             channel_message_id,
             card_id,
+            claim_buttons,
         )
 
 
@@ -563,219 +1610,6 @@ async def count_unposted_cards() -> int:
         )
         return int(row["c"] or 0)
 
-# ===========================
-# CLAIMS — CARD LOOKUP
-# ===========================
-
-async def get_card_by_post(channel_chat_id: int, channel_message_id: int):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        return await conn.fetchrow(
-            """
-            SELECT id, card_name, price, remaining_qty
-            FROM card_listing
-            WHERE channel_chat_id = $1
-              AND channel_message_id = $2
-            """,
-            channel_chat_id,
-            channel_message_id,
-        )
-
-# ===========================
-# CLAIMS — COUNT HELPERS
-# ===========================
-
-async def count_active_claims_for_card(
-    channel_chat_id: int,
-    channel_message_id: int,
-) -> int:
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            SELECT COUNT(*) AS c
-            FROM claims
-            WHERE channel_chat_id = $1
-              AND channel_message_id = $2
-              AND status = 'active'
-            """,
-            channel_chat_id,
-            channel_message_id,
-        )
-        return int(row["c"] or 0)
-
-
-async def user_has_active_claim(
-    channel_chat_id: int,
-    channel_message_id: int,
-    user_id: int,
-) -> bool:
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            SELECT 1
-            FROM claims
-            WHERE channel_chat_id = $1
-              AND channel_message_id = $2
-              AND user_id = $3
-              AND status = 'active'
-            LIMIT 1
-            """,
-            channel_chat_id,
-            channel_message_id,
-            user_id,
-        )
-        return row is not None
-
-# ===========================
-# CLAIMS — CREATE / REVIVE
-# ===========================
-
-async def get_latest_cancelled_claim_id(
-    channel_chat_id: int,
-    channel_message_id: int,
-    user_id: int,
-):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            SELECT id
-            FROM claims
-            WHERE channel_chat_id = $1
-              AND channel_message_id = $2
-              AND user_id = $3
-              AND status = 'cancelled'
-            ORDER BY id DESC
-            LIMIT 1
-            """,
-            channel_chat_id,
-            channel_message_id,
-            user_id,
-        )
-        return row["id"] if row else None
-
-
-async def revive_cancelled_claim(
-    claim_id: int,
-    username: str | None,
-    claim_order: int,
-):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            UPDATE claims
-            SET status = 'active',
-                username = $1,
-                claim_order = $2,
-                claimed_at = NOW()
-            WHERE id = $3
-            """,
-            username,
-            claim_order,
-            claim_id,
-        )
-
-
-async def create_claim(
-    channel_chat_id: int,
-    channel_message_id: int,
-    user_id: int,
-    username: str | None,
-    claim_order: int,
-):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO claims (
-                channel_chat_id,
-                channel_message_id,
-                user_id,
-                username,
-                claim_order
-            )
-            VALUES ($1, $2, $3, $4, $5)
-            """,
-            channel_chat_id,
-            channel_message_id,
-            user_id,
-            username,
-            claim_order,
-        )
-
-# ===========================
-# CLAIMS — CANCEL
-# ===========================
-
-async def get_active_claims_for_user(
-    channel_chat_id: int,
-    channel_message_id: int,
-    user_id: int,
-):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        return await conn.fetch(
-            """
-            SELECT id, claimed_at
-            FROM claims
-            WHERE channel_chat_id = $1
-              AND channel_message_id = $2
-              AND user_id = $3
-              AND status = 'active'
-            """,
-            channel_chat_id,
-            channel_message_id,
-            user_id,
-        )
-
-
-async def cancel_claims_for_user(
-    channel_chat_id: int,
-    channel_message_id: int,
-    user_id: int,
-):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            UPDATE claims
-            SET status = 'cancelled'
-            WHERE channel_chat_id = $1
-              AND channel_message_id = $2
-              AND user_id = $3
-              AND status = 'active'
-            """,
-            channel_chat_id,
-            channel_message_id,
-            user_id,
-        )
-
-# ===========================
-# CLAIMS — AVAILABILITY
-# ===========================
-
-async def update_card_remaining(
-    channel_chat_id: int,
-    channel_message_id: int,
-    delta: int,
-):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            UPDATE card_listing
-            SET remaining_qty = remaining_qty + $1
-            WHERE channel_chat_id = $2
-              AND channel_message_id = $3
-            """,
-            delta,
-            channel_chat_id,
-            channel_message_id,
-        )
-
 # ===========================
 # CHECKOUT HELPERS
 # ===========================
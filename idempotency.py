@@ -0,0 +1,80 @@
+# idempotency.py
+
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Set, Tuple
+
+from aiogram import Dispatcher
+from aiogram.types import CallbackQuery, Update
+
+# Drops duplicate work before it reaches any handler (so before any DB
+# query, PDF render or Telegram send):
+#   • Telegram redelivers an update when the webhook/poll didn't ack it
+#     in time → remember the last UPDATE_DEDUPE_WINDOW update_ids
+#   • buyers double-tap buttons → one in-flight run per
+#     (user, callback data); taps while it runs are answered and dropped
+#
+# Both are per process. Redeliveries go to the same webhook URL, so
+# behind a load balancer with several instances a redelivery can land
+# elsewhere; the claim/checkout paths stay safe there through their
+# own row locks and stage checks.
+
+UPDATE_DEDUPE_WINDOW = int(os.getenv("UPDATE_DEDUPE_WINDOW", "5000"))
+
+Handler = Callable[[Any, Dict[str, Any]], Awaitable[Any]]
+
+_seen_order: Deque[int] = deque()
+_seen: Set[int] = set()
+
+_inflight: Set[Tuple[int, str]] = set()
+
+_stats = {"duplicate_updates": 0, "duplicate_taps": 0}
+
+
+def _remember_update(update_id: int) -> bool:
+    """
+    False if the update was already seen.
+    """
+    if update_id in _seen:
+        return False
+    _seen.add(update_id)
+    _seen_order.append(update_id)
+    if len(_seen_order) > UPDATE_DEDUPE_WINDOW:
+        _seen.discard(_seen_order.popleft())
+    return True
+
+
+async def dedupe_updates(handler: Handler, update: Update, data: Dict[str, Any]):
+    if not _remember_update(update.update_id):
+        _stats["duplicate_updates"] += 1
+        return None
+    return await handler(update, data)
+
+
+async def single_flight_callbacks(handler: Handler, cb: CallbackQuery, data: Dict[str, Any]):
+    key = (cb.from_user.id, cb.data or "")
+    if key in _inflight:
+        _stats["duplicate_taps"] += 1
+        try:
+            await cb.answer("⏳ Still working on it…")
+        except Exception:
+            pass
+        return None
+
+    _inflight.add(key)
+    try:
+        return await handler(cb, data)
+    finally:
+        _inflight.discard(key)
+
+
+def idempotency_stats() -> Dict[str, int]:
+    return dict(_stats, inflight=len(_inflight), window=len(_seen))
+
+
+def setup_idempotency(dp: Dispatcher):
+    """
+    Called once from main.main before routers are included.
+    """
+    dp.update.outer_middleware(dedupe_updates)
+    dp.callback_query.outer_middleware(single_flight_callbacks)
@@ -0,0 +1,135 @@
+# invoice_drafts.py
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, Any, Optional, Tuple
+
+from reportlab import rl_config
+
+from invoice_pdf import build_invoice_pdf
+
+# reportlab is pure Python (GIL-bound), so renders go to worker processes
+DRAFT_WORKERS = int(os.getenv("INVOICE_DRAFT_WORKERS", "2"))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+# Draft invoices rendered at sale close
+# Keyed by Telegram user_id
+_DRAFTS: Dict[int, Dict[str, Any]] = {}
+
+
+def claims_fingerprint(items) -> Tuple:
+    """
+    Stable identity of a buyer's claim summary rows
+    (card_name, price, qty), used to detect changed claims.
+    """
+    return tuple(
+        (it["card_name"], str(it["price"]), int(it["qty"]))
+        for it in items
+    )
+
+
+def init_render_process():
+    """
+    Runs once in each render worker. Streams are written as raw binary:
+    the ASCII85 wrapper reportlab adds by default is encoded in pure
+    Python and cost ~0.4 s per invoice (logo + QR). rl_config is
+    process-global, so this stays out of the bot's own process.
+    """
+    rl_config.useA85 = 0
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=DRAFT_WORKERS,
+            initializer=init_render_process,
+        )
+    return _executor
+
+
+async def render_invoice(**kwargs) -> bytes:
+    """
+    Renders an invoice PDF in a worker process so the event loop
+    keeps serving updates. Accepts the build_invoice_pdf kwargs.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(),
+        partial(build_invoice_pdf, **kwargs),
+    )
+
+
+def store_draft(
+    user_id: int,
+    *,
+    fingerprint: Tuple,
+    delivery_method: str,
+    username: str,
+    invoice_no: str,
+    total: float,
+    pdf: bytes,
+):
+    _DRAFTS[user_id] = {
+        "fingerprint": fingerprint,
+        "delivery_method": delivery_method,
+        "username": username,
+        "invoice_no": invoice_no,
+        "total": total,
+        "pdf": pdf,
+    }
+
+
+def take_draft(
+    user_id: int,
+    *,
+    fingerprint: Tuple,
+    delivery_method: str,
+    username: str,
+    total: float,
+) -> Dict[str, Any] | None:
+    """
+    Pops the user's draft if it still matches what checkout would
+    render, including the order's total. A mismatched draft is
+    dropped (it can never be used).
+    """
+    draft = _DRAFTS.pop(user_id, None)
+    if not draft:
+        return None
+
+    if (
+        draft["fingerprint"] != fingerprint
+        or draft["delivery_method"] != delivery_method
+        or draft["username"] != username
+        or round(draft["total"], 2) != round(total, 2)
+    ):
+        return None
+
+    return draft
+
+
+def peek_draft_invoice_no(user_id: int) -> Optional[str]:
+    """
+    Invoice number reserved by the user's draft, if any, so checkout
+    can create the order under it before the draft is matched.
+    """
+    draft = _DRAFTS.get(user_id)
+    return draft["invoice_no"] if draft else None
+
+
+def clear_drafts():
+    _DRAFTS.clear()
+
+
+def draft_count() -> int:
+    return len(_DRAFTS)
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,68 @@
+# invoice_numbers.py
+
+import asyncio
+from collections import deque
+from typing import Deque, Optional
+
+from db import INVOICE_BLOCK_SIZE, reserve_invoice_block
+
+# Invoice numbers come from the invoice_no_seq sequence, so they are
+# unique across instances and restarts. Each nextval reserves a whole
+# block (the sequence's increment) that this process hands out from
+# memory; the next block is fetched in the background before the
+# current one runs out.
+# Numbers left in a block at shutdown are simply skipped.
+#
+# Format stays INV-<digits> (buyer_panel / shipping_admin regexes).
+
+INVOICE_PREFIX = "INV-"
+REFILL_BELOW = INVOICE_BLOCK_SIZE // 5
+
+_numbers: Deque[int] = deque()
+_refill_lock = asyncio.Lock()
+_refill_task: Optional[asyncio.Task] = None
+
+
+def format_invoice_no(n: int) -> str:
+    return f"{INVOICE_PREFIX}{n:06d}"
+
+
+async def _refill():
+    async with _refill_lock:
+        if len(_numbers) >= REFILL_BELOW:
+            return
+        start, size = await reserve_invoice_block()
+        _numbers.extend(range(start, start + size))
+
+
+async def _prefetch():
+    try:
+        await _refill()
+    except Exception as e:
+        print("Invoice block prefetch failed:", e)
+
+
+def _refill_soon():
+    global _refill_task
+    if _refill_task is None or _refill_task.done():
+        _refill_task = asyncio.create_task(_prefetch())
+
+
+async def next_invoice_no() -> str:
+    """
+    No round trip unless the prefetched numbers ran out.
+    """
+    while not _numbers:
+        await _refill()
+
+    n = _numbers.popleft()
+    if len(_numbers) < REFILL_BELOW:
+        _refill_soon()
+    return format_invoice_no(n)
+
+
+async def start_invoice_allocator():
+    """
+    Called once from main.main after init_db: prefetches the first block.
+    """
+    await _refill()
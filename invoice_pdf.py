@@ -3,7 +3,74 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, Tabl
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import mm
 from reportlab.lib import colors
+from PIL import Image as PILImage
 from datetime import datetime
+from io import BytesIO
+
+
+SELLER_LINES = [
+    ("Seller:", "NightShade PokeClaims"),
+    ("Telegram:", "@NightShadePokeClaims"),
+    ("Phone:", "+65 93385994"),
+]
+
+TERMS_LINES = [
+    "- All sales are final after payment is made.",
+    "- Please verify card condition upon receiving.",
+    "- Tracking number will be provided once shipped.",
+    "- Seller is not responsible for courier delays.",
+    "- Self-collection orders must be collected within 14 days.",
+    "- Uncollected orders may be cancelled after grace period.",
+]
+
+
+def _parse_item_price(raw_price) -> float:
+    if isinstance(raw_price, str):
+        raw_price = (
+            raw_price
+            .replace("SGD", "")
+            .replace("$", "")
+            .replace(",", "")
+            .strip()
+        )
+    return float(raw_price)
+
+
+# ===== IMAGES =====
+# logo.png (500px) and paynow_qr.png (726px, 540 KB) are downscaled
+# to ~200 dpi at their printed size and re-encoded as JPEG once per
+# process. reportlab embeds JPEG data as-is, so a render only copies
+# the bytes instead of decoding and recompressing the PNGs.
+
+IMAGE_DPI = 200
+
+_image_cache = {}
+
+
+def _print_image(path, size_mm):
+    """
+    Returns JPEG bytes for `path` sized for size_mm x size_mm,
+    or None if the file is missing/unreadable.
+    """
+    key = (path, size_mm)
+    if key not in _image_cache:
+        try:
+            px = round(size_mm / 25.4 * IMAGE_DPI)
+            im = PILImage.open(path).convert("RGB")
+            im.thumbnail((px, px), PILImage.LANCZOS)
+            out = BytesIO()
+            im.save(out, "JPEG", quality=95)
+            _image_cache[key] = out.getvalue()
+        except Exception:
+            _image_cache[key] = None
+    return _image_cache[key]
+
+
+def _image(path, size_mm):
+    data = _print_image(path, size_mm)
+    if data is None:
+        raise FileNotFoundError(path)
+    return Image(BytesIO(data), width=size_mm*mm, height=size_mm*mm)
 
 
 def build_invoice_pdf(
@@ -30,7 +97,6 @@ def build_invoice_pdf(
     if items is None:
         items = []
 
-    from io import BytesIO
     buffer = BytesIO()
 
     doc = SimpleDocTemplate(buffer, pagesize=A4)
@@ -40,7 +106,7 @@ def build_invoice_pdf(
 
     # ===== LOGO =====
     try:
-        logo = Image("logo.png", width=60*mm, height=60*mm)
+        logo = _image("logo.png", 60)
         elements.append(logo)
     except:
         elements.append(Paragraph("NightShade PokeClaims", styles["Title"]))
@@ -52,10 +118,9 @@ def build_invoice_pdf(
     elements.append(Spacer(1, 10))
 
     # ===== SELLER INFO =====
-    seller_info = f"""
-    <b>Seller:</b> NightShade PokeClaims<br/>
-    <b>Telegram:</b> @NightShadePokeClaims<br/>
-    <b>Phone:</b> +65 93385994<br/>
+    seller_info = "".join(
+        f"<b>{label}</b> {value}<br/>" for label, value in SELLER_LINES
+    ) + f"""
     <b>Date:</b> {datetime.now().strftime("%d %b %Y")}<br/>
     <b>Invoice #:</b> {invoice_no}
     """
@@ -84,19 +149,8 @@ def build_invoice_pdf(
     for item in items:
         name = item.get("name")
         qty = int(item.get("qty", 1))
-        raw_price = item.get("price", 0)
-
-        if isinstance(raw_price, str):
-            raw_price = (
-                raw_price
-                .replace("SGD", "")
-                .replace("$", "")
-                .replace(",", "")
-                .strip()
-            )
-    
-        price = float(raw_price)
-    
+        price = _parse_item_price(item.get("price", 0))
+
         table_data.append([
             name,
             str(qty),
@@ -145,22 +199,16 @@ def build_invoice_pdf(
 
     # ===== PAYNOW QR CODE =====
     try:
-        qr = Image("paynow_qr.png", width=50*mm, height=50*mm)
+        qr = _image("paynow_qr.png", 50)
         elements.append(qr)
         elements.append(Spacer(1, 10))
     except:
         elements.append(Paragraph("PayNow QR Code: (image not found)", styles["Normal"]))
 
     # ===== TERMS & CONDITIONS =====
-    terms = """
-    <b>Terms & Conditions</b><br/>
-    - All sales are final after payment is made.<br/>
-    - Please verify card condition upon receiving.<br/>
-    - Tracking number will be provided once shipped.<br/>
-    - Seller is not responsible for courier delays.<br/>
-    - Self-collection orders must be collected within 14 days.<br/>
-    - Uncollected orders may be cancelled after grace period.<br/>
-    """
+    terms = "<b>Terms & Conditions</b><br/>" + "".join(
+        f"{line}<br/>" for line in TERMS_LINES
+    )
 
     elements.append(Paragraph(terms, styles["Normal"]))
     elements.append(Spacer(1, 20))
@@ -2,15 +2,37 @@ import asyncio
 
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand, BotCommandScopeAllPrivateChats, BotCommandScopeChat
-
-from config import BOT_TOKEN, ADMIN_ID
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (
+    BOT_TOKEN,
+    ADMIN_ID,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+)
 from db import init_db
+from claim_events import init_claim_projections
+from invoice_numbers import start_invoice_allocator
+from cluster import multi_instance, is_leader, start_cluster, stop_cluster
+from session_store import NS_ADMIN, init_session_store, close_session_store, preload_namespace
+from invoice_drafts import shutdown_executor
+from ocr_jobs import start_ocr_workers, stop_ocr_workers
+from idempotency import setup_idempotency
+from allocation_windows import init_allocation_windows
+from waitlist import init_waitlist
+from scheduler import start_scheduler, stop_scheduler
+from maintenance_jobs import register_maintenance_jobs
 
 import admin
 import buyer_panel
 import checkout
 import claims
 import shipping_admin
+import shipping_batch
 import text_dispatcher
 
 
@@ -47,9 +69,50 @@ async def setup_bot_commands(bot: Bot):
     await bot.set_my_commands(admin_cmds, scope=BotCommandScopeChat(chat_id=ADMIN_ID))
 
 
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """
+    Serves updates over HTTPS; any number of instances can sit behind
+    the same URL. Only the leader (re)registers the webhook.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    if is_leader():
+        await bot.set_webhook(
+            WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    print(f"🔹 Webhook server on {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
 async def main():
-    # 1️⃣ Initialize Supabase connection
+    if multi_instance() and not WEBHOOK_BASE_URL:
+        raise RuntimeError("BOT_INSTANCES > 1 needs webhook mode (set WEBHOOK_BASE_URL)")
+
+    # 1️⃣ Initialize Supabase connection, claim projections + session store
     await init_db()
+    await init_claim_projections()
+    await start_invoice_allocator()
+    await init_session_store()
+    await preload_namespace(NS_ADMIN)
+    init_allocation_windows()
+    await init_waitlist()
+    await start_cluster()
 
     # 2️⃣ Create bot
     bot = Bot(token=BOT_TOKEN)
@@ -57,9 +120,11 @@ async def main():
 
     # 3️⃣ Setup dispatcher
     dp = Dispatcher()
+    setup_idempotency(dp)  # redelivered updates + button double-taps
 
     # 4️⃣ Register routers
     dp.include_router(admin.router)           # CSV + photos
+    dp.include_router(shipping_batch.router)  # batch label photos
     dp.include_router(shipping_admin.router)  # admin panel + shipping
     dp.include_router(claims.router)          # claim/cancel in channel threads
     dp.include_router(checkout.router)        # checkout / payment proof / address flow
@@ -67,14 +132,30 @@ async def main():
     dp.include_router(text_dispatcher.router) # generic private chat text dispatcher
 
     # 5️⃣ Register Telegram menu commands
-    await setup_bot_commands(bot)
+    if is_leader():
+        await setup_bot_commands(bot)
+
+    # 6️⃣ Background OCR workers (shipping labels)
+    await start_ocr_workers(bot)
+
+    # 7️⃣ Periodic maintenance (claim expiry, projections, drift, pruning)
+    register_maintenance_jobs(bot)
+    start_scheduler()
 
     print("🔹 Bot is ready. Listening for events...")
 
-    # 6️⃣ Start polling
+    # 8️⃣ Start polling (single instance) or serve the webhook
     try:
-        await dp.start_polling(bot)
+        if WEBHOOK_BASE_URL:
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
     finally:
+        await stop_scheduler()
+        await stop_cluster()
+        await stop_ocr_workers()
+        shutdown_executor()
+        await close_session_store()
         await bot.session.close()
         print("🔹 Bot session closed.")
 
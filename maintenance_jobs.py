@@ -0,0 +1,87 @@
+# maintenance_jobs.py
+
+import os
+
+from aiogram import Bot
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from claim_events import refresh_projections, check_stock_drift, format_stock_drift
+from claims import update_card_caption
+from claims_board import schedule_board_update
+from db import expire_stale_claims, prune_photo_buffer, prune_ocr_results
+from config import ADMIN_ID
+from scheduler import every
+from waitlist import load_waitlist, notify_promoted
+
+# Periodic housekeeping, run by scheduler.py. Registered from main.main.
+
+CLAIM_HOLD_HOURS = int(os.getenv("CLAIM_HOLD_HOURS", "24"))
+EXPIRE_CLAIMS_EVERY = int(os.getenv("EXPIRE_CLAIMS_EVERY", "300"))
+
+
+async def _refresh_captions(bot: Bot, posts):
+    for p in posts:
+        schedule_board_update(
+            bot,
+            (p["channel_chat_id"], p["channel_message_id"]),
+            card_name=p["card_name"],
+            remaining=p["remaining_qty"],
+        )
+        await update_card_caption(
+            bot,
+            p["channel_chat_id"],
+            p["channel_message_id"],
+            p["card_name"],
+            p["price"],
+            p["remaining_qty"],
+            p["claim_buttons"],
+        )
+
+
+def drift_fix_keyboard():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="🛠 Fix stock drift", callback_data="admin:driftfix")
+    return kb.as_markup()
+
+
+def register_maintenance_jobs(bot: Bot):
+
+    async def expire_claims():
+        posts, promoted = await expire_stale_claims(CLAIM_HOLD_HOURS)
+        if posts:
+            await refresh_projections()
+            await _refresh_captions(bot, posts)
+            await notify_promoted(bot, promoted, refresh_posts=False)
+        return (
+            f"{sum(p['restored'] for p in posts)} claims expired on {len(posts)} posts, "
+            f"{len(promoted)} waitlist promotions"
+        )
+
+    # Report only; the admin decides whether to fix (admin:driftfix).
+    # The same drift isn't re-sent every run.
+    last_reported = set()
+
+    async def check_drift():
+        rows = await check_stock_drift()
+        seen = {(r["id"], r["remaining_qty"], r["replayed_qty"]) for r in rows}
+        if rows and seen != last_reported:
+            await bot.send_message(
+                ADMIN_ID,
+                format_stock_drift(rows),
+                parse_mode="HTML",
+                reply_markup=drift_fix_keyboard(),
+            )
+        last_reported.clear()
+        last_reported.update(seen)
+        return f"{len(rows)} posts drifted"
+
+    async def prune():
+        photos = await prune_photo_buffer(60)
+        ocr = await prune_ocr_results(7)
+        return f"{photos} buffered photos, {ocr} OCR results pruned"
+
+    every("expire_claims", EXPIRE_CLAIMS_EVERY, expire_claims)
+    every("refresh_projections", 15, refresh_projections, leader_only=False)
+    every("reload_waitlist", 60, load_waitlist, leader_only=False)
+    every("stock_drift", 600, check_drift)
+    every("prune", 3600, prune)
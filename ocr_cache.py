@@ -0,0 +1,75 @@
+# ocr_cache.py
+
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from db import get_ocr_result, save_ocr_result
+from ocr_preprocess import params_key
+
+# Hot tier in front of the ocr_results table
+OCR_CACHE_SIZE = 512
+
+# Keyed by (file_unique_id, params_key) → {"text", "tracking"}
+_CACHE: "OrderedDict[Tuple[str, str], Dict[str, Optional[str]]]" = OrderedDict()
+
+
+def _key(file_unique_id: str) -> Tuple[str, str]:
+    # Results are only reusable with the same pipeline and settings
+    return file_unique_id, params_key()
+
+
+def _remember(key, entry):
+    _CACHE[key] = entry
+    _CACHE.move_to_end(key)
+    while len(_CACHE) > OCR_CACHE_SIZE:
+        _CACHE.popitem(last=False)
+
+
+def peek_ocr_result(file_unique_id: str | None):
+    """
+    Memory-only lookup (no I/O), safe to call from sync code.
+    """
+    if not file_unique_id:
+        return None
+
+    key = _key(file_unique_id)
+    entry = _CACHE.get(key)
+    if entry is not None:
+        _CACHE.move_to_end(key)
+    return entry
+
+
+async def lookup_ocr_result(file_unique_id: str | None):
+    """
+    Memory first, then the database. None on a miss.
+    """
+    entry = peek_ocr_result(file_unique_id)
+    if entry is not None or not file_unique_id:
+        return entry
+
+    key = _key(file_unique_id)
+    try:
+        row = await get_ocr_result(*key)
+    except Exception as e:
+        print("OCR cache read failed:", e)
+        return None
+
+    if not row:
+        return None
+
+    entry = {"text": row["text"], "tracking": row["tracking"]}
+    _remember(key, entry)
+    return entry
+
+
+async def store_ocr_result(file_unique_id: str | None, text: str, tracking: str | None):
+    if not file_unique_id:
+        return
+
+    key = _key(file_unique_id)
+    _remember(key, {"text": text, "tracking": tracking})
+
+    try:
+        await save_ocr_result(*key, text, tracking)
+    except Exception as e:
+        print("OCR cache write failed:", e)
@@ -0,0 +1,215 @@
+# ocr_jobs.py
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ocr_cache import peek_ocr_result, lookup_ocr_result, store_ocr_result
+from ocr_utils import (
+    ocr_available,
+    ocr_image_bytes,
+    download_photo_bytes,
+    extract_tracking_number,
+)
+
+# =========================
+# CONFIG
+# =========================
+OCR_QUEUE_SIZE = int(os.getenv("OCR_QUEUE_SIZE", "64"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+OCR_TIMEOUT_SECONDS = float(os.getenv("OCR_TIMEOUT_SECONDS", "30"))
+OCR_MAX_ATTEMPTS = int(os.getenv("OCR_MAX_ATTEMPTS", "2"))
+
+# on_result(bot, result) — result keys:
+# file_id, chat_id, text, tracking, error, attempts, cached, context
+ResultHandler = Callable[[Any, Dict[str, Any]], Awaitable[None]]
+
+_queue: Optional[asyncio.Queue] = None
+_workers: List[asyncio.Task] = []
+_executor: Optional[ThreadPoolExecutor] = None
+_bot = None
+
+
+# =========================
+# LIFECYCLE
+# =========================
+async def start_ocr_workers(bot):
+    """
+    Starts the OCR worker tasks. Called once from main.main.
+    Tesseract runs in a thread pool (it is a subprocess call),
+    so the event loop never blocks on a label.
+    """
+    global _queue, _executor, _bot
+
+    if _queue is not None:
+        return
+
+    _bot = bot
+    _queue = asyncio.Queue(maxsize=OCR_QUEUE_SIZE)
+    _executor = ThreadPoolExecutor(
+        max_workers=OCR_WORKERS,
+        thread_name_prefix="ocr",
+    )
+
+    for n in range(OCR_WORKERS):
+        _workers.append(asyncio.create_task(_worker(n)))
+
+
+async def stop_ocr_workers():
+    global _queue, _executor
+
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+    _queue = None
+
+
+# =========================
+# SUBMIT
+# =========================
+def submit_ocr_job(
+    file_id: str,
+    *,
+    chat_id: int,
+    file_unique_id: str | None = None,
+    on_result: ResultHandler | None = None,
+    context: Dict[str, Any] | None = None,
+) -> bool:
+    """
+    Queues a photo for OCR. Never blocks.
+    Pass file_unique_id so re-sent/forwarded photos hit the result
+    cache instead of being downloaded and OCR'd again.
+    Returns False when OCR is unavailable or the queue is full,
+    so callers can fall back to manual entry straight away.
+    """
+    if _queue is None:
+        return False
+
+    job = {
+        "file_id": file_id,
+        "file_unique_id": file_unique_id,
+        "chat_id": chat_id,
+        "on_result": on_result,
+        "context": context or {},
+    }
+
+    # Hot cache hit: answer now, skip the queue entirely
+    cached = peek_ocr_result(file_unique_id)
+    if cached is not None:
+        asyncio.create_task(_deliver(job, cached["text"], None, 0, cached=True))
+        return True
+
+    if not ocr_available():
+        return False
+
+    try:
+        _queue.put_nowait(job)
+    except asyncio.QueueFull:
+        return False
+
+    return True
+
+
+# =========================
+# WORKERS
+# =========================
+async def _worker(n: int):
+    while True:
+        job = await _queue.get()
+        try:
+            await _process_job(job)
+        except Exception as e:
+            print(f"OCR worker {n} error:", e)
+        finally:
+            _queue.task_done()
+
+
+async def _run_ocr(file_id: str) -> str:
+    data = await download_photo_bytes(_bot, file_id)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor,
+        ocr_image_bytes,
+        data,
+        OCR_TIMEOUT_SECONDS,
+    )
+
+
+async def _process_job(job: Dict[str, Any]):
+    cached = await lookup_ocr_result(job["file_unique_id"])
+    if cached is not None:
+        await _deliver(job, cached["text"], None, 0, cached=True)
+        return
+
+    text = None
+    error = None
+    attempts = 0
+
+    for attempt in range(1, OCR_MAX_ATTEMPTS + 1):
+        attempts = attempt
+        try:
+            text = await asyncio.wait_for(
+                _run_ocr(job["file_id"]),
+                timeout=OCR_TIMEOUT_SECONDS + 5,  # download + tesseract
+            )
+            error = None
+            break
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except Exception as e:
+            error = str(e)
+
+        if attempt < OCR_MAX_ATTEMPTS:
+            await asyncio.sleep(attempt)  # small linear backoff
+
+    if text is not None:
+        await store_ocr_result(
+            job["file_unique_id"],
+            text,
+            extract_tracking_number(text),
+        )
+
+    await _deliver(job, text, error, attempts)
+
+
+async def _deliver(
+    job: Dict[str, Any],
+    text: str | None,
+    error: str | None,
+    attempts: int,
+    cached: bool = False,
+):
+    result = {
+        "file_id": job["file_id"],
+        "chat_id": job["chat_id"],
+        "text": text or "",
+        "tracking": extract_tracking_number(text) if text else None,
+        "error": error,
+        "attempts": attempts,
+        "cached": cached,
+        "context": job["context"],
+    }
+
+    handler = job["on_result"] or _send_result_to_chat
+    try:
+        await handler(_bot, result)
+    except Exception as e:
+        print("OCR result handler error:", e)
+
+
+async def _send_result_to_chat(bot, result: Dict[str, Any]):
+    if result["tracking"]:
+        text = f"🔎 OCR tracking detected:\n<code>{result['tracking']}</code>"
+    elif result["error"]:
+        text = f"⚠️ OCR failed after {result['attempts']} attempt(s): {result['error']}"
+    else:
+        text = "⚠️ OCR found no tracking number on this photo."
+
+    await bot.send_message(result["chat_id"], text, parse_mode="HTML")
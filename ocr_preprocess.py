@@ -0,0 +1,182 @@
+# ocr_preprocess.py
+# NumPy label preprocessing for tracking-number OCR.
+# Pipeline: grayscale → downscale to target DPI → locate the barcode
+# band → adaptive (local mean) threshold on that crop only, so
+# Tesseract reads a small, clean ROI instead of the full photo.
+
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # OCR falls back to the plain PIL threshold
+    np = None
+
+
+# Shipping labels are 4x6 in; ~300 DPI is plenty for Tesseract
+PREPROCESS_PARAMS: Dict[str, Any] = {
+    "target_dpi": 300,
+    "label_long_edge_in": 6,
+    "block": 31,          # adaptive threshold window (px, odd)
+    "offset": 10,         # pixel must be this much darker than local mean
+    "roi_smooth": 15,     # barcode energy smoothing radius (px)
+    "roi_pad": 0.8,       # vertical padding, in barcode heights
+}
+
+
+# Bump when a step changes what Tesseract is given, so cached OCR
+# results from the old pipeline are not reused
+PIPELINE_VERSION = 1
+
+
+def numpy_available() -> bool:
+    return np is not None
+
+
+def pipeline_id() -> str:
+    """
+    Which preprocessing ocr_utils.ocr_image_bytes runs in this process:
+    the NumPy ROI + adaptive threshold, or the legacy PIL fallback.
+    """
+    name = "numpy" if numpy_available() else "legacy"
+    return f"{name}-v{PIPELINE_VERSION}"
+
+
+def params_key(params: Dict[str, Any] | None = None) -> str:
+    """
+    Stable string form of the pipeline and its parameters
+    (used to key cached OCR results).
+    """
+    params = params or PREPROCESS_PARAMS
+    return f"pipeline={pipeline_id()};" + ",".join(f"{k}={params[k]}" for k in sorted(params))
+
+
+# =========================
+# STEPS
+# =========================
+def downscale(image: Image.Image, params: Dict[str, Any]) -> Image.Image:
+    max_side = int(params["target_dpi"] * params["label_long_edge_in"])
+    if max(image.size) <= max_side:
+        return image
+
+    scale = max_side / max(image.size)
+    size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    # reduce() first is a cheap integer box-downsample for huge photos
+    factor = int(1 / scale)
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image.resize(size, Image.BILINEAR)
+
+
+def _box_mean(arr, r: int):
+    """
+    Mean over a (2r+1)x(2r+1) window via an integral image.
+    Windows are clipped at the borders.
+    """
+    h, w = arr.shape
+    ii = np.zeros((h + 1, w + 1), dtype=np.float64)
+    ii[1:, 1:] = arr.cumsum(0).cumsum(1)
+
+    ys = np.arange(h)
+    xs = np.arange(w)
+    y0 = np.clip(ys - r, 0, h)
+    y1 = np.clip(ys + r + 1, 0, h)
+    x0 = np.clip(xs - r, 0, w)
+    x1 = np.clip(xs + r + 1, 0, w)
+
+    sums = (
+        ii[np.ix_(y1, x1)]
+        - ii[np.ix_(y0, x1)]
+        - ii[np.ix_(y1, x0)]
+        + ii[np.ix_(y0, x0)]
+    )
+    area = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+    return sums / area
+
+
+def adaptive_threshold(gray, block: int, offset: float):
+    """
+    Local-mean binarisation: robust to bright flash spots and
+    dim corners, unlike a fixed global cut-off.
+    """
+    mean = _box_mean(gray.astype(np.float64), block // 2)
+    return np.where(gray < mean - offset, 0, 255).astype(np.uint8)
+
+
+def find_barcode_roi(gray, params: Dict[str, Any]) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Finds the 1D barcode band (strong horizontal, weak vertical
+    gradients) and returns (top, bottom, left, right) padded to
+    include the human-readable number printed next to it.
+    None if nothing barcode-like is found.
+    """
+    g = gray.astype(np.float32)
+    gx = np.abs(np.diff(g, axis=1, prepend=g[:, :1]))
+    gy = np.abs(np.diff(g, axis=0, prepend=g[:1, :]))
+    energy = _box_mean(np.clip(gx - gy, 0, None), params["roi_smooth"])
+
+    peak = energy.max()
+    if peak <= 0:
+        return None
+
+    mask = energy > peak * 0.5
+
+    # Contiguous band of rows around the strongest row
+    row_score = mask.sum(axis=1)
+    best = int(row_score.argmax())
+    strong = row_score > row_score[best] * 0.5
+    top = best
+    while top > 0 and strong[top - 1]:
+        top -= 1
+    bottom = best
+    while bottom < len(strong) - 1 and strong[bottom + 1]:
+        bottom += 1
+
+    cols = np.flatnonzero(mask[top:bottom + 1].any(axis=0))
+    if cols.size == 0:
+        return None
+    left, right = int(cols[0]), int(cols[-1])
+
+    h, w = gray.shape
+    band_h = bottom - top + 1
+    if band_h < h * 0.02 or (right - left) < w * 0.1:
+        return None
+
+    pad_y = int(band_h * params["roi_pad"])
+    pad_x = int((right - left) * 0.05)
+    return (
+        max(0, top - pad_y),
+        min(h, bottom + pad_y + 1),
+        max(0, left - pad_x),
+        min(w, right + pad_x + 1),
+    )
+
+
+# =========================
+# PIPELINE
+# =========================
+def label_gray(image: Image.Image, params: Dict[str, Any] | None = None):
+    """
+    Grayscale, downscaled label as a uint8 array.
+    """
+    params = params or PREPROCESS_PARAMS
+    image = downscale(image.convert("L"), params)
+    return np.asarray(image, dtype=np.uint8)
+
+
+def binarize(gray, params: Dict[str, Any] | None = None) -> Image.Image:
+    params = params or PREPROCESS_PARAMS
+    return Image.fromarray(adaptive_threshold(gray, params["block"], params["offset"]))
+
+
+def crop(gray, roi: Tuple[int, int, int, int]):
+    top, bottom, left, right = roi
+    return gray[top:bottom, left:right]
+
+
+def legacy_threshold(image: Image.Image) -> Image.Image:
+    """
+    Original preprocessing: fixed 140 cut-off on the full photo.
+    """
+    return image.convert("L").point(lambda x: 0 if x < 140 else 255)
@@ -1,8 +1,18 @@
 import os
-import re
 from PIL import Image
 from io import BytesIO
 
+from tracking_candidates import resolve_tracking
+from ocr_preprocess import (
+    PREPROCESS_PARAMS,
+    numpy_available,
+    label_gray,
+    find_barcode_roi,
+    binarize,
+    crop,
+    legacy_threshold,
+)
+
 # Default OFF on Render. Turn ON only when you have Tesseract installed.
 OCR_ENABLED = os.getenv("OCR_ENABLED", "0") == "1"
 
@@ -16,39 +26,42 @@ else:
     pytesseract = None
 
 
-async def extract_text_from_photo(bot, message):
-    """
-    Downloads the photo sent by admin and runs OCR on it.
-    If OCR is disabled/unavailable, returns empty string safely.
-    """
-    if not OCR_ENABLED:
-        return ""
+def ocr_available() -> bool:
+    return OCR_ENABLED and pytesseract is not None
 
-    if pytesseract is None:
-        # pytesseract not installed in this environment
-        return ""
 
-    try:
-        # Get the highest resolution photo
-        photo = message.photo[-1]
+def ocr_image_bytes(data: bytes, timeout: float = 0) -> str:
+    """
+    CPU-bound part of OCR (decode, preprocess, Tesseract).
+    Blocking — call it from a worker thread, never on the event loop.
+    timeout > 0 kills the tesseract process after that many seconds.
+    """
+    image = Image.open(BytesIO(data))
 
-        file = await bot.get_file(photo.file_id)
-        file_bytes = await bot.download_file(file.file_path)
+    if not numpy_available():
+        return pytesseract.image_to_string(legacy_threshold(image), timeout=timeout)
 
-        image = Image.open(BytesIO(file_bytes.getvalue()))
+    gray = label_gray(image)
 
-        # Convert to grayscale for better OCR
-        image = image.convert("L")
+    # Barcode band first: tiny image, fast Tesseract pass
+    roi = find_barcode_roi(gray, PREPROCESS_PARAMS)
+    if roi is not None:
+        text = pytesseract.image_to_string(
+            binarize(crop(gray, roi)),
+            config="--psm 6",
+            timeout=timeout,
+        )
+        if extract_tracking_number(text):
+            return text
 
-        # Increase contrast
-        image = image.point(lambda x: 0 if x < 140 else 255)
+    # No barcode / nothing readable there → whole label
+    return pytesseract.image_to_string(binarize(gray), timeout=timeout)
 
-        text = pytesseract.image_to_string(image)
-        return text
 
-    except Exception as e:
-        print("OCR Error:", e)
-        return ""
+async def download_photo_bytes(bot, file_id: str) -> bytes:
+    file = await bot.get_file(file_id)
+    file_bytes = await bot.download_file(file.file_path)
+    return file_bytes.getvalue()
 
 
 def extract_tracking_number(text: str):
@@ -59,23 +72,9 @@ def extract_tracking_number(text: str):
     if not text:
         return None
 
-    # Normalize OCR common mistakes
-    clean = text.upper()
-    clean = clean.replace(" ", "")
-    clean = clean.replace("O", "0")   # letter O -> zero
-    clean = clean.replace("I", "1")   # letter I -> one
-    clean = clean.replace("S", "5")   # S -> 5 (sometimes)
-
-    pattern = re.compile(r"[A-Z]{2}\d{9}SG")
-    match = pattern.search(clean)
-
-    if not match:
-        return None
-
-    tracking = match.group(0)
-
-    # Extra safety check
-    if len(tracking) != 13:
+    # Position-aware OCR corrections (see tracking_candidates)
+    best = resolve_tracking(text)
+    if not best:
         return None
 
-    return tracking
\ No newline at end of file
+    return best["tracking"]
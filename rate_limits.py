@@ -0,0 +1,131 @@
+# rate_limits.py
+
+import os
+import time
+from typing import Dict, Hashable, Tuple
+
+# Token-bucket admission control for claim/cancel replies, checked in
+# memory before any DB access. Two buckets per request:
+#   • per user: stops one buyer spamming claim/cancel cycles
+#   • per post: caps the write rate on one hot card row
+# A throttled request gets one cheap "slow down" reply per
+# SLOWDOWN_NOTICE_SECONDS; further ones are dropped silently.
+
+USER_BURST = int(os.getenv("CLAIM_USER_BURST", "3"))
+USER_PER_SECOND = float(os.getenv("CLAIM_USER_PER_SECOND", "0.5"))
+POST_BURST = int(os.getenv("CLAIM_POST_BURST", "20"))
+POST_PER_SECOND = float(os.getenv("CLAIM_POST_PER_SECOND", "10"))
+
+SLOWDOWN_NOTICE_SECONDS = 10
+MAX_BUCKETS = 20_000  # idle (full) buckets are pruned past this
+MAX_THROTTLED_USERS = 1_000  # per-user throttle counts kept for the admin view
+
+# key → (tokens, last refill, monotonic)
+_buckets: Dict[Hashable, Tuple[float, float]] = {}
+_last_notice: Dict[int, float] = {}
+
+_stats = {
+    "admitted": 0,
+    "throttled_user": 0,
+    "throttled_post": 0,
+}
+# user_id → times throttled; past MAX_THROTTLED_USERS only the most
+# throttled half is kept (it only feeds the "most throttled" list)
+_throttled_by_user: Dict[int, int] = {}
+
+
+def _peek(key: Hashable, burst: int, rate: float, now: float) -> float:
+    tokens, at = _buckets.get(key, (burst, now))
+    return min(burst, tokens + (now - at) * rate)
+
+
+def _prune(now: float):
+    idle = [
+        key for key, (tokens, at) in _buckets.items()
+        if now - at > 60
+    ]
+    for key in idle:
+        del _buckets[key]
+    for user_id, at in list(_last_notice.items()):
+        if now - at > SLOWDOWN_NOTICE_SECONDS:
+            del _last_notice[user_id]
+
+
+def _prune_throttled():
+    keep = sorted(_throttled_by_user.items(), key=lambda kv: kv[1], reverse=True)
+    _throttled_by_user.clear()
+    _throttled_by_user.update(keep[:MAX_THROTTLED_USERS // 2])
+
+
+def admit(user_id: int, post: Tuple[int, int]) -> bool:
+    """
+    Takes one token from both the user's and the post's bucket, or
+    none if either is empty.
+    """
+    now = time.monotonic()
+    if len(_buckets) > MAX_BUCKETS:
+        _prune(now)
+
+    user_key = ("user", user_id)
+    post_key = ("post", post)
+    user_tokens = _peek(user_key, USER_BURST, USER_PER_SECOND, now)
+    post_tokens = _peek(post_key, POST_BURST, POST_PER_SECOND, now)
+
+    if user_tokens < 1 or post_tokens < 1:
+        # Both empty counts against both
+        if user_tokens < 1:
+            _stats["throttled_user"] += 1
+        if post_tokens < 1:
+            _stats["throttled_post"] += 1
+        if user_id not in _throttled_by_user and len(_throttled_by_user) >= MAX_THROTTLED_USERS:
+            _prune_throttled()
+        _throttled_by_user[user_id] = _throttled_by_user.get(user_id, 0) + 1
+        _buckets[user_key] = (user_tokens, now)
+        _buckets[post_key] = (post_tokens, now)
+        return False
+
+    _stats["admitted"] += 1
+    _buckets[user_key] = (user_tokens - 1, now)
+    _buckets[post_key] = (post_tokens - 1, now)
+    return True
+
+
+def should_notify_throttled(user_id: int) -> bool:
+    """
+    True at most once per SLOWDOWN_NOTICE_SECONDS per user.
+    """
+    now = time.monotonic()
+    last = _last_notice.get(user_id)
+    if last is not None and now - last < SLOWDOWN_NOTICE_SECONDS:
+        return False
+    _last_notice[user_id] = now
+    return True
+
+
+def throttle_stats() -> Dict[str, int]:
+    return dict(_stats, buckets=len(_buckets))
+
+
+def format_throttle_stats(top: int = 10) -> str:
+    s = throttle_stats()
+    lines = [
+        "🚦 <b>Claim Throttling</b>",
+        "",
+        f"Admitted: <code>{s['admitted']}</code>",
+        f"Throttled (per user): <code>{s['throttled_user']}</code>",
+        f"Throttled (per post): <code>{s['throttled_post']}</code>",
+        "<i>(a request with both buckets empty counts in both)</i>",
+        f"Active buckets: <code>{s['buckets']}</code>",
+        "",
+        f"Limits: user {USER_BURST} burst + {USER_PER_SECOND:g}/s · "
+        f"post {POST_BURST} burst + {POST_PER_SECOND:g}/s",
+    ]
+
+    worst = sorted(_throttled_by_user.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    if worst:
+        lines.append("")
+        lines.append("<b>Most throttled buyers</b>")
+        for user_id, n in worst:
+            lines.append(f"• <code>{user_id}</code> — {n}")
+
+    return "\n".join(lines)
@@ -0,0 +1,172 @@
+# scheduler.py
+
+import asyncio
+import html
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from cluster import is_leader
+
+# Periodic background jobs, one asyncio loop per job.
+#   • jitter: every sleep is interval ± jitter, so jobs (and instances)
+#     don't fire in lockstep
+#   • overlap protection: a run is skipped if the previous one (or a
+#     manual run_job) is still going
+#   • leader_only jobs run on the cluster leader only (see cluster.py)
+#   • per-job run-time metrics for the admin panel (job_metrics)
+
+_JOBS: Dict[str, Dict[str, Any]] = {}
+_tasks: Dict[str, asyncio.Task] = {}
+
+
+def every(
+    name: str,
+    seconds: float,
+    func: Callable[[], Awaitable[Any]],
+    *,
+    jitter: float = 0.1,
+    leader_only: bool = True,
+    run_at_start: bool = False,
+):
+    """
+    Registers func to run every `seconds` (± jitter as a fraction).
+    Register before start_scheduler.
+    """
+    _JOBS[name] = {
+        "name": name,
+        "seconds": seconds,
+        "func": func,
+        "jitter": jitter,
+        "leader_only": leader_only,
+        "run_at_start": run_at_start,
+        "lock": asyncio.Lock(),
+        # metrics
+        "runs": 0,
+        "failures": 0,
+        "overlaps": 0,
+        "last_started": None,   # unix time
+        "last_ms": None,
+        "total_ms": 0.0,
+        "max_ms": 0.0,
+        "last_result": None,
+        "last_error": None,
+    }
+
+
+def _delay(job) -> float:
+    spread = job["seconds"] * job["jitter"]
+    return max(0.0, job["seconds"] + random.uniform(-spread, spread))
+
+
+async def run_job(name: str) -> bool:
+    """
+    Runs a job now. False if it was skipped (already running, or
+    leader-only on a follower).
+    """
+    job = _JOBS[name]
+
+    if job["leader_only"] and not is_leader():
+        return False
+    if job["lock"].locked():
+        job["overlaps"] += 1
+        return False
+
+    async with job["lock"]:
+        job["last_started"] = time.time()
+        started = time.perf_counter()
+        try:
+            job["last_result"] = await job["func"]()
+            job["last_error"] = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job["failures"] += 1
+            job["last_error"] = f"{type(e).__name__}: {e}"
+            print(f"Job {name} failed:", e)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            job["runs"] += 1
+            job["last_ms"] = elapsed
+            job["total_ms"] += elapsed
+            job["max_ms"] = max(job["max_ms"], elapsed)
+    return True
+
+
+async def _job_loop(job):
+    if job["run_at_start"]:
+        await run_job(job["name"])
+    else:
+        # Random first offset spreads the initial runs out
+        await asyncio.sleep(random.uniform(0, job["seconds"]))
+        await run_job(job["name"])
+
+    while True:
+        await asyncio.sleep(_delay(job))
+        await run_job(job["name"])
+
+
+def start_scheduler():
+    """
+    Called once from main.main after start_cluster.
+    """
+    for name, job in _JOBS.items():
+        if name not in _tasks:
+            _tasks[name] = asyncio.create_task(_job_loop(job))
+
+
+async def stop_scheduler():
+    for task in _tasks.values():
+        task.cancel()
+    await asyncio.gather(*_tasks.values(), return_exceptions=True)
+    _tasks.clear()
+
+
+def job_metrics() -> List[Dict[str, Any]]:
+    out = []
+    for job in _JOBS.values():
+        runs = job["runs"]
+        out.append({
+            "name": job["name"],
+            "every_s": job["seconds"],
+            "leader_only": job["leader_only"],
+            "running": job["lock"].locked(),
+            "runs": runs,
+            "failures": job["failures"],
+            "overlaps": job["overlaps"],
+            "last_started": job["last_started"],
+            "last_ms": job["last_ms"],
+            "avg_ms": job["total_ms"] / runs if runs else None,
+            "max_ms": job["max_ms"],
+            "last_result": job["last_result"],
+            "last_error": job["last_error"],
+        })
+    return out
+
+
+def format_job_metrics() -> str:
+    lines = ["⏱ <b>Background Jobs</b>", ""]
+    if not _JOBS:
+        lines.append("No jobs registered.")
+
+    for m in job_metrics():
+        if m["last_started"] is None:
+            last = "never"
+        else:
+            last = f"{int(time.time() - m['last_started'])}s ago, {m['last_ms']:.0f} ms"
+        status = "🔄" if m["running"] else ("⚠️" if m["last_error"] else "✅")
+        lines.append(
+            f"{status} <b>{m['name']}</b> every {m['every_s']:.0f}s"
+            f"{' (leader)' if m['leader_only'] else ''}\n"
+            f"   runs {m['runs']} · failed {m['failures']} · skipped {m['overlaps']}\n"
+            f"   last {last}"
+            + (f" · avg {m['avg_ms']:.0f} / max {m['max_ms']:.0f} ms" if m["avg_ms"] is not None else "")
+        )
+        if m["last_result"] is not None:
+            lines.append(f"   result: {html.escape(str(m['last_result']))}")
+        if m["last_error"]:
+            lines.append(f"   error: {html.escape(m['last_error'])}")
+
+    if not is_leader():
+        lines.append("\n(this instance is not the leader: leader jobs run elsewhere)")
+    return "\n".join(lines)
@@ -0,0 +1,552 @@
+# session_store.py
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from db import (
+    json_dumps,
+    json_loads,
+    load_session_value,
+    load_session_namespace,
+    save_session_values,
+)
+from cluster import INSTANCE_ID, multi_instance, notify, on_notify
+from state_journal import (
+    STATE_JOURNAL_COMPACT_BYTES,
+    journal_enabled,
+    open_journal,
+    start_journal_sync,
+    close_journal,
+    journal_append,
+    journal_size,
+    compact_journal,
+)
+
+# One key/value session abstraction for all bot state:
+#   memory (LRU + TTL, write-back)  →  backend (postgres / sqlite / memory)
+# Reads are served from memory; writes are marked dirty and flushed to
+# the backend in batches every SESSION_FLUSH_INTERVAL seconds.
+# Every write is also appended to the local state journal, so a crash
+# between flushes loses nothing and a restart rebuilds memory without
+# reading the backend (see state_journal.py).
+#
+# Multi-instance (see cluster.py): the backend (postgres) is the shared
+# copy, writes are flushed right away and every flush NOTIFYs the other
+# instances to drop / reload those keys. The local journal is off.
+
+NS_CHECKOUT = "checkout"   # checkout_store
+NS_ADMIN = "admin"         # admin_sessions
+NS_BOT = "bot"             # role/session_type/data sessions (buyer + admin CSV)
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "postgres")
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.db")
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "5000"))
+SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", str(6 * 3600)))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5"))
+
+SESSION_NOTIFY_CHANNEL = "bot_sessions"
+NOTIFY_KEYS_PER_MESSAGE = 100  # stays well under the 8000-byte payload limit
+
+Key = Tuple[str, str]
+
+
+# ===========================
+# BACKENDS
+# ===========================
+# load(ns, key) -> value | None
+# load_namespace(ns) -> {key: value}
+# save_many([(ns, key, value | None), ...])   None = delete
+
+class MemoryBackend:
+    """
+    Process-local only (tests / single dev instance). Nothing survives
+    a restart.
+    """
+
+    def __init__(self):
+        self._data: Dict[Key, Any] = {}
+
+    async def load(self, ns: str, key: str):
+        return self._data.get((ns, key))
+
+    async def load_namespace(self, ns: str) -> Dict[str, Any]:
+        return {k: v for (n, k), v in self._data.items() if n == ns}
+
+    async def save_many(self, items: List[Tuple[str, str, Any]]):
+        for ns, key, value in items:
+            if value is None:
+                self._data.pop((ns, key), None)
+            else:
+                self._data[(ns, key)] = value
+
+
+class SqliteBackend:
+    """
+    Single-file local persistence (stdlib sqlite3, run in a thread).
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _load(self, ns, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE namespace = ? AND key = ?",
+                (ns, key),
+            ).fetchone()
+        return json_loads(row[0]) if row else None
+
+    def _load_namespace(self, ns):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, data FROM sessions WHERE namespace = ?",
+                (ns,),
+            ).fetchall()
+        return {k: json_loads(d) for k, d in rows}
+
+    def _save_many(self, items):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM sessions WHERE namespace = ? AND key = ?",
+                [(ns, key) for ns, key, value in items if value is None],
+            )
+            self._conn.executemany(
+                """
+                INSERT INTO sessions (namespace, key, data, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (namespace, key)
+                DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+                """,
+                [
+                    (ns, key, json_dumps(value), now)
+                    for ns, key, value in items
+                    if value is not None
+                ],
+            )
+
+    async def load(self, ns: str, key: str):
+        return await asyncio.to_thread(self._load, ns, key)
+
+    async def load_namespace(self, ns: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._load_namespace, ns)
+
+    async def save_many(self, items: List[Tuple[str, str, Any]]):
+        await asyncio.to_thread(self._save_many, items)
+
+
+class PostgresBackend:
+    """
+    sessions table on the shared Supabase pool (see db.py); JSONB
+    round-trips as Python objects via the pool's codecs.
+    """
+
+    async def load(self, ns: str, key: str):
+        return await load_session_value(ns, key)
+
+    async def load_namespace(self, ns: str) -> Dict[str, Any]:
+        rows = await load_session_namespace(ns)
+        return {r["key"]: r["data"] for r in rows}
+
+    async def save_many(self, items: List[Tuple[str, str, Any]]):
+        await save_session_values(items)
+
+
+def make_backend(name: str = SESSION_BACKEND):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SqliteBackend(SESSION_SQLITE_PATH)
+    if name == "postgres":
+        return PostgresBackend()
+    raise RuntimeError(f"Unknown SESSION_BACKEND: {name!r}")
+
+
+# ===========================
+# WRITE-BACK CACHE
+# ===========================
+
+_MISSING = object()
+
+_backend = None
+_flush_task: Optional[asyncio.Task] = None
+_drain_task: Optional[asyncio.Task] = None
+
+# (ns, key) → (expires_at, value or None)
+_cache: "OrderedDict[Key, Tuple[float, Any]]" = OrderedDict()
+
+# Preloaded namespaces live here instead: never expire, never evicted
+_pinned_ns: set = set()
+_pinned: Dict[Key, Any] = {}
+
+# Pending writes: (ns, key) → value (None = delete)
+_dirty: Dict[Key, Any] = {}
+
+# Batch currently being written (still authoritative until it lands)
+_inflight: Dict[Key, Any] = {}
+
+# ns → (encode, decode) between the object kept in memory and the
+# JSON-able value written to the backend / journal
+_codecs: Dict[str, Tuple[Callable[[Any], Any], Callable[[Any], Any]]] = {}
+
+# Memory was rebuilt from a journal snapshot: preloads skip the backend
+_restored = False
+
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        _backend = make_backend()
+    return _backend
+
+
+def register_codec(ns: str, encode: Callable[[Any], Any], decode: Callable[[Any], Any]):
+    """
+    Keep a namespace's values in memory as objects (e.g. slotted
+    CheckoutState); encode/decode run only at the storage boundary.
+    Register before init_session_store so journal replay decodes.
+    """
+    _codecs[ns] = (encode, decode)
+
+
+def _encode(ns: str, value):
+    codec = _codecs.get(ns)
+    if codec is None or value is None:
+        return value
+    return codec[0](value)
+
+
+def _decode(ns: str, value):
+    codec = _codecs.get(ns)
+    if codec is None or value is None:
+        return value
+    return codec[1](value)
+
+
+def _remember(k: Key, value):
+    if k[0] in _pinned_ns:
+        _pinned[k] = value
+        return
+
+    _cache[k] = (time.monotonic() + SESSION_CACHE_TTL_SECONDS, value)
+    _cache.move_to_end(k)
+    while len(_cache) > SESSION_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+async def init_session_store(backend=None):
+    """
+    Picks the backend, replays the state journal into memory and
+    starts the periodic flusher.
+    Called once from main.main after init_db.
+    """
+    global _backend, _flush_task, _restored
+
+    _backend = backend or make_backend()
+
+    if multi_instance():
+        on_notify(SESSION_NOTIFY_CHANNEL, _on_remote_flush)
+    elif journal_enabled():
+        started = time.perf_counter()
+        state, tail, _restored = open_journal()
+        decoded = {k: _decode(k[0], v) for k, v in state.items()}
+        for k, value in decoded.items():
+            _remember(k, value)
+        # Written after the last compaction: may never have reached the backend
+        for k in tail:
+            _dirty[k] = decoded.get(k)
+        print(
+            f"Session journal replayed: {len(state)} keys, {len(tail)} pending "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+        await start_journal_sync()
+
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def close_session_store():
+    global _flush_task
+
+    if _flush_task is not None:
+        _flush_task.cancel()
+        await asyncio.gather(_flush_task, return_exceptions=True)
+        _flush_task = None
+
+    await flush()
+    if journal_enabled() and not _dirty:
+        _compact()  # next start replays one snapshot, nothing else
+    await close_journal()
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_INTERVAL)
+        await flush()
+        if journal_size() > STATE_JOURNAL_COMPACT_BYTES and not _inflight:
+            _compact()
+
+
+def _compact():
+    """
+    Snapshot of everything in memory; only the writes the backend
+    hasn't seen yet are carried over into the fresh journal.
+    """
+    now = time.monotonic()
+    state = {k: v for k, (expires_at, v) in _cache.items() if expires_at > now}
+    state.update(_pinned)
+    state.update(_dirty)
+    try:
+        compact_journal(
+            {k: _encode(k[0], v) for k, v in state.items()},
+            {k: _encode(k[0], v) for k, v in _dirty.items()},
+        )
+    except Exception as e:
+        print("Journal compaction failed:", e)
+
+
+def _requeue(batch: Dict[Key, Any]):
+    # Keep failed writes unless a newer value was set meanwhile
+    for k, v in batch.items():
+        _dirty.setdefault(k, v)
+
+
+async def flush():
+    """
+    Writes all pending changes to the backend in one batch.
+    On failure they are kept (unless overwritten since) for next time
+    and False is returned.
+    """
+    global _dirty, _inflight
+
+    if not _dirty or _inflight:
+        return True
+
+    _inflight, _dirty = _dirty, {}
+    try:
+        await _get_backend().save_many([
+            (ns, key, _encode(ns, v)) for (ns, key), v in _inflight.items()
+        ])
+        if multi_instance():
+            await _publish(list(_inflight))
+        return True
+    except asyncio.CancelledError:
+        _requeue(_inflight)
+        raise
+    except Exception as e:
+        print("Session flush failed:", e)
+        _requeue(_inflight)
+        return False
+    finally:
+        _inflight = {}
+
+
+def _kick():
+    """
+    Multi-instance: flush now instead of on the next interval, so a
+    user's next update can land on any instance.
+    """
+    global _drain_task
+    if _drain_task is None or _drain_task.done():
+        _drain_task = asyncio.create_task(_drain())
+
+
+async def _drain():
+    while _dirty:
+        if _inflight:
+            await asyncio.sleep(0.01)
+            continue
+        if not await flush():
+            return  # backend down: the periodic loop retries
+
+
+# ===========================
+# REPLICATION (multi-instance)
+# ===========================
+
+async def _publish(keys: List[Key]):
+    for i in range(0, len(keys), NOTIFY_KEYS_PER_MESSAGE):
+        payload = json_dumps({
+            "i": INSTANCE_ID,
+            "k": keys[i:i + NOTIFY_KEYS_PER_MESSAGE],
+        })
+        try:
+            await notify(SESSION_NOTIFY_CHANNEL, payload)
+        except Exception as e:
+            print("Session notify failed:", e)
+
+
+def _on_remote_flush(payload: str):
+    """
+    Another instance wrote these keys: forget our copy (cached
+    namespaces) or re-read it (pinned namespaces, read synchronously).
+    Keys with unflushed local writes keep the local value.
+    """
+    msg = json_loads(payload)
+    if msg["i"] == INSTANCE_ID:
+        return
+
+    reload = []
+    for ns, key in msg["k"]:
+        k = (ns, key)
+        if k in _dirty or k in _inflight:
+            continue
+        if ns in _pinned_ns:
+            reload.append(k)
+        else:
+            _cache.pop(k, None)
+
+    if reload:
+        asyncio.create_task(_reload_pinned(reload))
+
+
+async def _reload_pinned(keys: List[Key]):
+    for k in keys:
+        try:
+            value = await _get_backend().load(*k)
+        except Exception as e:
+            print("Session reload failed:", e)
+            continue
+        if k not in _dirty and k not in _inflight:
+            _pinned[k] = _decode(k[0], value)
+
+
+def peek_value(ns: str, key) -> Any:
+    """
+    Memory-only read (sync). Use for namespaces loaded with
+    preload_namespace, or when a miss can be treated as "no session".
+    """
+    k = (ns, str(key))
+    if k in _dirty:
+        return _dirty[k]
+    if k in _inflight:
+        return _inflight[k]
+    if ns in _pinned_ns:
+        return _pinned.get(k)
+
+    entry = _cache.get(k)
+    if entry is None:
+        return None
+    _cache.move_to_end(k)
+    return entry[1]
+
+
+async def get_value(ns: str, key) -> Any:
+    k = (ns, str(key))
+    if k in _dirty:
+        return _dirty[k]
+    if k in _inflight:
+        return _inflight[k]
+    if ns in _pinned_ns:
+        return _pinned.get(k)
+
+    entry = _cache.get(k, _MISSING)
+    if entry is not _MISSING:
+        expires_at, value = entry
+        if expires_at > time.monotonic():
+            _cache.move_to_end(k)
+            return value
+        del _cache[k]
+
+    # Lazy rehydration (first access after restart / eviction)
+    try:
+        value = _decode(ns, await _get_backend().load(*k))
+    except Exception as e:
+        print("Session load failed:", e)
+        return None
+
+    _remember(k, value)  # misses are cached too
+    return value
+
+
+def set_value(ns: str, key, value):
+    k = (ns, str(key))
+    _remember(k, value)
+    _dirty[k] = value
+    journal_append(ns, k[1], _encode(ns, value))
+    if multi_instance():
+        _kick()
+
+
+def delete_value(ns: str, key):
+    k = (ns, str(key))
+    _remember(k, None)
+    _dirty[k] = None
+    journal_append(ns, k[1], None)
+    if multi_instance():
+        _kick()
+
+
+async def preload_namespace(ns: str):
+    """
+    Loads a whole (small) namespace into memory and pins it there,
+    so peek_value is authoritative for it, e.g. admin sessions.
+    After a journal restore the namespace is already in memory.
+    """
+    # Journal entries are at least as new as the backend
+    replayed = {k: v for k, (_, v) in _cache.items() if k[0] == ns}
+    for k in replayed:
+        del _cache[k]
+
+    loaded = {} if _restored else await _get_backend().load_namespace(ns)
+    _pinned_ns.add(ns)
+    for key, value in loaded.items():
+        _remember((ns, key), _decode(ns, value))
+    for k, value in replayed.items():
+        _remember(k, value)
+
+
+# ===========================
+# BOT SESSIONS
+# ===========================
+# One role/session_type/data session per user (replaces bot_sessions).
+
+async def set_session(
+    user_id: int,
+    role: str,
+    session_type: str,
+    data: dict | None = None,
+):
+    """
+    Create or replace a session for a user.
+    """
+    set_value(NS_BOT, user_id, {
+        "user_id": user_id,
+        "role": role,
+        "session_type": session_type,
+        "data": data or {},
+    })
+
+
+async def get_session(user_id: int):
+    """
+    Fetch the active session for a user.
+    Returns None if no session exists.
+    """
+    return await get_value(NS_BOT, user_id)
+
+
+async def clear_session(user_id: int):
+    """
+    Clear the active session for a user.
+    """
+    delete_value(NS_BOT, user_id)
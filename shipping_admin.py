@@ -1,10 +1,14 @@
 # shipping_admin.py
 from aiogram import Router, F
+from aiogram.dispatcher.event.bases import SkipHandler
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from datetime import datetime, timezone
 from typing import Optional, Dict, List
 
+from checkout_state import CheckoutStage
+from checkout_store import upsert_checkout
 from admin_sessions import (
     set_admin_session,
     get_admin_session,
@@ -13,8 +17,11 @@ from admin_sessions import (
 from claims_repo import (
     fetch_active_claim_users,
     fetch_user_claim_groups,
-    admin_cancel_claim_group,
+    admin_cancel_claim_groups,
 )
+from claims import update_card_caption
+from claims_board import schedule_board_update
+from waitlist import notify_promoted
 
 import re
 
@@ -24,13 +31,21 @@ from callbacks import (
     PaymentReviewCB,
 )
 
-from ocr_utils import extract_text_from_photo, extract_tracking_number
+from ocr_utils import extract_tracking_number
+from ocr_jobs import OCR_MAX_ATTEMPTS, OCR_TIMEOUT_SECONDS, submit_ocr_job
+from shipping_batch import start_batch_shipping, cancel_batch
+from scheduler import format_job_metrics
+from rate_limits import format_throttle_stats
+from idempotency import idempotency_stats
+from claim_events import check_stock_drift, fix_stock_drift, format_stock_drift
+from maintenance_jobs import drift_fix_keyboard
 
 from db import (
     get_pool,
     get_orders_by_status,
     create_shipping_session,
     get_active_shipping_session,
+    get_active_shipping_session_by_admin,
     update_shipping_session,
     complete_shipping_session,
     mark_order_shipped,
@@ -55,10 +70,14 @@ def admin_help_text():
 🕒 Pending Payment Approvals
 📦 Packing List (mark packed)
 🚚 Orders Ready To Ship
+📦 Batch Ship (send all label photos, confirm once)
 ✅ Orders Shipped
 ⌨️ Type Tracking (OCR Fail)
 ❌ Cancel Claims (admin wizard)
 ❌ Cancel Shipping Session
+⏱ Background Jobs (expiry, sync, cleanup status)
+🚦 Claim Throttling (rate-limit counters)
+📊 Stock Drift (compare stock with the claim log, fix on request)
 """
 
 # ======================================================
@@ -71,10 +90,14 @@ def build_admin_panel():
     kb.button(text="🕒 Pending Payment Approvals", callback_data="admin:pendingpay")
     kb.button(text="📦 Packing List", callback_data="admin:packlist")
     kb.button(text="🚚 Orders Ready To Ship", callback_data="admin:toship")
+    kb.button(text="📦 Batch Ship (Label Photos)", callback_data="admin:batchship")
     kb.button(text="✅ Orders Shipped", callback_data="admin:shipped")
     kb.button(text="⌨️ Type Tracking (OCR Fail)", callback_data="admin:manual")
     kb.button(text="❌ Cancel Claims", callback_data="admin:cancelclaims")
     kb.button(text="❌ Cancel Shipping Session", callback_data="admin:cancelship")
+    kb.button(text="⏱ Background Jobs", callback_data="admin:jobs")
+    kb.button(text="🚦 Claim Throttling", callback_data="admin:throttle")
+    kb.button(text="📊 Stock Drift", callback_data="admin:drift")
     kb.button(text="ℹ️ Admin Help", callback_data="admin:help")
 
     kb.adjust(1)
@@ -112,6 +135,9 @@ async def admin_panel_actions(cb: CallbackQuery):
     elif action == "shipped":
         await list_shipped_orders(cb.message)
 
+    elif action == "batchship":
+        await start_batch_shipping(cb.bot, ADMIN_ID)
+
     elif action == "manual":
         set_admin_session(ADMIN_ID, "awaiting_tracking_invoice", None)
         await cb.bot.send_message(
@@ -124,9 +150,46 @@ async def admin_panel_actions(cb: CallbackQuery):
         await list_cancel_claim_users(cb.message)
 
     elif action == "cancelship":
+        await cancel_batch(ADMIN_ID)
         clear_admin_session(ADMIN_ID)
         await cb.bot.send_message(ADMIN_ID, "✅ Shipping session cleared.")
 
+    elif action == "jobs":
+        await cb.bot.send_message(ADMIN_ID, format_job_metrics(), parse_mode="HTML")
+
+    elif action == "throttle":
+        dup = idempotency_stats()
+        await cb.bot.send_message(
+            ADMIN_ID,
+            format_throttle_stats()
+            + f"\n\nDuplicate updates dropped: <code>{dup['duplicate_updates']}</code>"
+            + f"\nDouble-taps dropped: <code>{dup['duplicate_taps']}</code>",
+            parse_mode="HTML",
+        )
+
+    elif action == "drift":
+        rows = await check_stock_drift()
+        await cb.bot.send_message(
+            ADMIN_ID,
+            format_stock_drift(rows),
+            parse_mode="HTML",
+            reply_markup=drift_fix_keyboard() if rows else None,
+        )
+
+    elif action == "driftfix":
+        fixed = await fix_stock_drift(ADMIN_ID)
+        for r in fixed:
+            await update_card_caption(
+                cb.bot,
+                r["channel_chat_id"],
+                r["channel_message_id"],
+                r["card_name"],
+                r["price"],
+                r["replayed_qty"],
+                r["claim_buttons"],
+            )
+        await cb.bot.send_message(ADMIN_ID, f"✅ Stock drift fixed on {len(fixed)} posts.")
+
     elif action == "help":
         await cb.bot.send_message(ADMIN_ID, admin_help_text(), parse_mode="HTML")
 
@@ -227,7 +290,7 @@ async def handle_payment_approve(cb: CallbackQuery, callback_data: PaymentReview
 
     # 🔀 SINGLE SOURCE OF TRUTH (checkout state)
     if delivery_method == "tracked":
-        await upsert_checkout(user_id, stage="awaiting_address")
+        await upsert_checkout(user_id, stage=CheckoutStage.AWAITING_ADDRESS)
 
         await cb.bot.send_message(
             user_id,
@@ -238,7 +301,7 @@ async def handle_payment_approve(cb: CallbackQuery, callback_data: PaymentReview
         )
 
     else:  # self collection
-        await upsert_checkout(user_id, stage="packing")
+        await upsert_checkout(user_id, stage=CheckoutStage.PACKING)
 
         await cb.bot.send_message(
             user_id,
@@ -386,29 +449,164 @@ async def start_shipping(cb: CallbackQuery, callback_data: ShippingActionCB):
     await cb.answer()
 
 
+# A session still "detecting" after this long lost its OCR result
+# (e.g. the instance restarted): typed input is taken instead
+DETECT_TIMEOUT_SECONDS = OCR_MAX_ATTEMPTS * (OCR_TIMEOUT_SECONDS + 5) + 60
+
+
+def _kb_manual_tracking(invoice_no: str):
+    kb = InlineKeyboardBuilder()
+    kb.button(
+        text="⌨️ Type Manually",
+        callback_data=ShippingActionCB(action="manual", invoice=invoice_no).pack()
+    )
+    return kb.as_markup()
+
+
+def _kb_confirm_tracking(invoice_no: str):
+    kb = InlineKeyboardBuilder()
+    kb.button(
+        text="✅ Confirm & Mark Shipped",
+        callback_data=ShippingActionCB(action="confirm", invoice=invoice_no).pack()
+    )
+    kb.button(
+        text="⌨️ Type Manually",
+        callback_data=ShippingActionCB(action="manual", invoice=invoice_no).pack()
+    )
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+async def _get_invoice_for_order(order_id: int) -> str | None:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT invoice_no FROM orders WHERE id = $1",
+            order_id
+        )
+
+
 @router.message(F.chat.type == "private", F.from_user.id == ADMIN_ID, F.photo)
 async def admin_shipping_photo(message: Message):
     # Find active shipping session waiting for photo
-    session = await get_active_shipping_session(message.from_user.id)
+    session = await get_active_shipping_session_by_admin(message.from_user.id)
 
     if not session:
-        return  # No active shipping flow
+        raise SkipHandler()  # No active shipping flow
 
     # Get the highest resolution photo
     photo_file_id = message.photo[-1].file_id
+    order_id = session["order_id"]
+    invoice_no = await _get_invoice_for_order(order_id)
 
     # Save photo into the shipping session
     await update_shipping_session(
-        order_id=session["order_id"],
+        order_id=order_id,
         photo_file_id=photo_file_id,
-        step="awaiting_confirmation"
+        step="detecting"
     )
 
+    # OCR runs in the background; result arrives via _on_tracking_ocr
+    queued = submit_ocr_job(
+        photo_file_id,
+        chat_id=message.chat.id,
+        file_unique_id=message.photo[-1].file_unique_id,
+        on_result=_on_tracking_ocr,
+        context={"order_id": order_id, "invoice_no": invoice_no},
+    )
+
+    if not queued:
+        await update_shipping_session(order_id=order_id, step="awaiting_tracking")
+        await message.answer(
+            "📸 Shipping photo received.\n\n"
+            "⌨️ Auto-detect unavailable — please type the tracking number.",
+            parse_mode="HTML"
+        )
+        return
+
     await message.answer(
         "📸 Shipping photo received.\n\n"
         "⏳ Processing tracking number…",
+        parse_mode="HTML",
+        reply_markup=_kb_manual_tracking(invoice_no)
+    )
+
+
+async def _on_tracking_ocr(bot, result):
+    order_id = result["context"]["order_id"]
+    invoice_no = result["context"]["invoice_no"]
+
+    # Admin may have typed the number (or cancelled) while OCR ran
+    session = await get_active_shipping_session(order_id)
+    if not session or session["step"] != "detecting":
+        return
+
+    tracking = result["tracking"]
+
+    if not tracking:
+        await update_shipping_session(order_id=order_id, step="awaiting_tracking")
+        await bot.send_message(
+            result["chat_id"],
+            f"⚠️ Couldn't read a tracking number for <code>{invoice_no}</code>.\n\n"
+            "⌨️ Please type the tracking number.",
+            parse_mode="HTML"
+        )
+        return
+
+    await update_shipping_session(
+        order_id=order_id,
+        detected_tracking=tracking,
+        step="awaiting_confirmation"
+    )
+
+    await bot.send_message(
+        result["chat_id"],
+        f"📦 Tracking detected for <code>{invoice_no}</code>:\n"
+        f"<code>{tracking}</code>",
+        parse_mode="HTML",
+        reply_markup=_kb_confirm_tracking(invoice_no)
+    )
+
+
+@router.callback_query(ShippingActionCB.filter(F.action == "confirm"))
+async def confirm_detected_tracking(cb: CallbackQuery, callback_data: ShippingActionCB):
+    session = await get_active_shipping_session_by_admin(
+        cb.from_user.id,
+        steps=("awaiting_confirmation",),
+    )
+
+    if not session or not session["detected_tracking"]:
+        await cb.answer("❌ No shipping session awaiting confirmation.", show_alert=True)
+        return
+
+    if await _get_invoice_for_order(session["order_id"]) != callback_data.invoice:
+        await cb.answer("❌ This confirmation is out of date.", show_alert=True)
+        return
+
+    await cb.answer("Marking as shipped…")
+    await _finalize_shipping(cb.bot, cb.from_user.id, session)
+
+
+@router.callback_query(ShippingActionCB.filter(F.action == "manual"))
+async def manual_tracking_entry(cb: CallbackQuery, callback_data: ShippingActionCB):
+    session = await get_active_shipping_session_by_admin(
+        cb.from_user.id,
+        steps=("detecting", "awaiting_confirmation"),
+    )
+
+    if not session:
+        await cb.answer("❌ No active shipping session.", show_alert=True)
+        return
+
+    await update_shipping_session(order_id=session["order_id"], step="awaiting_tracking")
+
+    await cb.bot.send_message(
+        cb.from_user.id,
+        f"⌨️ Type the tracking number for <code>{callback_data.invoice}</code>.",
         parse_mode="HTML"
     )
+    await cb.answer()
+
 
 # ======================================================
 # CANCEL CLAIMS WIZARD
@@ -522,7 +720,7 @@ async def process_cancel_claims_text(message: Message) -> bool:
             await list_cancel_claim_users(message)
             return True
 
-        groups = _fetch_user_claim_groups(user_id)
+        groups = await fetch_user_claim_groups(CHANNEL_ID, user_id)
         if not groups:
             await message.answer("✅ No active claims left for this buyer.")
             await list_cancel_claim_users(message)
@@ -538,22 +736,38 @@ async def process_cancel_claims_text(message: Message) -> bool:
             await message.answer("❌ Invalid selection.")
             return True
 
+        res = await admin_cancel_claim_groups(
+            channel_id=CHANNEL_ID,
+            admin_id=ADMIN_ID,
+            user_id=user_id,
+            post_mids=[int(g["post_mid"]) for g in chosen],
+        )
+
         removed_lines = []
         order_cancelled_any = False
         invoice_touched = None
 
-        for g in chosen:
-            res = await _admin_cancel_claim_group(
-                message,
-                user_id=user_id,
-                post_mid=int(g["post_mid"]),
-            )
-            if res:
-                removed_lines.append(f"• {res['card_name']} x<code>{res['qty']}</code>")
-                if res.get("order_cancelled"):
-                    order_cancelled_any = True
-                if res.get("invoice_no"):
-                    invoice_touched = res["invoice_no"]
+        if res:
+            for g in res["groups"]:
+                removed_lines.append(f"• {g['card_name']} x<code>{g['qty']}</code>")
+                schedule_board_update(
+                    message.bot,
+                    (CHANNEL_ID, g["post_mid"]),
+                    card_name=g["card_name"],
+                    remaining=g["new_remaining"],
+                )
+                await update_card_caption(
+                    message.bot,
+                    CHANNEL_ID,
+                    g["post_mid"],
+                    g["card_name"],
+                    g["price"],
+                    g["new_remaining"],
+                    g["claim_buttons"],
+                )
+            order_cancelled_any = res["order_cancelled"]
+            invoice_touched = res["invoice_no"]
+            await notify_promoted(message.bot, res["promoted"], refresh_posts=False)
 
         if not removed_lines:
             await message.answer("⚠️ Nothing removed (claims may have changed).")
@@ -614,7 +828,7 @@ async def approve_payment(cb: CallbackQuery, callback_data: PaymentReviewCB):
 
     # 🔀 Checkout fork (in-memory)
     if delivery_method == "tracked":
-        await upsert_checkout(user_id, stage="awaiting_address")
+        await upsert_checkout(user_id, stage=CheckoutStage.AWAITING_ADDRESS)
 
         await cb.bot.send_message(
             user_id,
@@ -625,7 +839,7 @@ async def approve_payment(cb: CallbackQuery, callback_data: PaymentReviewCB):
         )
 
     else:  # self collection
-        await upsert_checkout(user_id, stage="packing")
+        await upsert_checkout(user_id, stage=CheckoutStage.PACKING)
 
         await cb.bot.send_message(
             user_id,
@@ -647,65 +861,21 @@ async def approve_payment(cb: CallbackQuery, callback_data: PaymentReviewCB):
 # TRACKING HANDLERS
 # ======================================================
 
-@router.message(F.chat.type == "private", F.from_user.id == ADMIN_ID, F.photo)
-async def admin_shipping_photo(message: Message):
-    # Find active shipping session waiting for a photo
-    session = await get_active_shipping_session(message.from_user.id)
-
-    if not session:
-        return  # Admin is not in a shipping flow
-
-    # Take the highest resolution photo
-    photo_file_id = message.photo[-1].file_id
-
-    # Save photo and move session to next step
-    await update_shipping_session(
-        order_id=session["order_id"],
-        photo_file_id=photo_file_id,
-        step="awaiting_confirmation"
-    )
-
-    await message.answer(
-        "📸 Shipping photo received.\n\n"
-        "Next: tracking number confirmation.",
-        parse_mode="HTML"
-    )
-
-@router.message(F.chat.type == "private",F.from_user.id == ADMIN_ID,F.text,)
-async def admin_shipping_tracking_text(message: Message):
-    session = await get_active_shipping_session(message.from_user.id)
-
-    if not session:
-        return  # allow other handlers (like cancel-claims)
-
-    # handle shipping text here
-
-
-    tracking = extract_tracking_number((message.text or "").upper())
-    if not tracking:
-        await message.answer("❌ Invalid tracking number format. Please try again.")
-        return
-
-    # Save tracking number into session
-    await update_shipping_session(
-        order_id=session["order_id"],
-        detected_tracking=tracking
-    )
-
-    await message.answer(
-        f"📦 Tracking detected:\n<code>{tracking}</code>\n\n"
-        "Reply <b>CONFIRM</b> to mark this order as shipped.",
-        parse_mode="HTML"
-    )
-
 @router.message(F.chat.type == "private", F.from_user.id == ADMIN_ID, F.text.casefold() == "confirm")
 async def admin_confirm_shipping(message: Message):
-    session = await get_active_shipping_session(message.from_user.id)
+    session = await get_active_shipping_session_by_admin(
+        message.from_user.id,
+        steps=("awaiting_confirmation",),
+    )
 
     if not session or not session["detected_tracking"]:
         await message.answer("❌ No shipping session awaiting confirmation.")
         return
 
+    await _finalize_shipping(message.bot, message.chat.id, session)
+
+
+async def _finalize_shipping(bot, chat_id: int, session):
     # Mark order as shipped (final, atomic)
     await mark_order_shipped(
         order_id=session["order_id"],
@@ -716,7 +886,7 @@ async def admin_confirm_shipping(message: Message):
     # Close shipping session
     await complete_shipping_session(session["order_id"])
 
-    await message.answer("✅ Order marked as shipped.")
+    await bot.send_message(chat_id, "✅ Order marked as shipped.")
 
     # Notify buyer
     pool = await get_pool()
@@ -727,7 +897,7 @@ async def admin_confirm_shipping(message: Message):
         )
 
     if row:
-        await message.bot.send_photo(
+        await bot.send_photo(
             chat_id=row["user_id"],
             photo=session["photo_file_id"],
             caption=(
@@ -737,6 +907,49 @@ async def admin_confirm_shipping(message: Message):
             parse_mode="HTML"
         )
 
+
+def _detect_timed_out(session) -> bool:
+    age = datetime.now(timezone.utc) - session["updated_at"]
+    return age.total_seconds() > DETECT_TIMEOUT_SECONDS
+
+
+@router.message(F.chat.type == "private",F.from_user.id == ADMIN_ID,F.text,)
+async def admin_shipping_tracking_text(message: Message):
+    session = await get_active_shipping_session_by_admin(
+        message.from_user.id,
+        steps=("detecting", "awaiting_tracking", "awaiting_confirmation"),
+    )
+
+    # While OCR runs, text is not ours (⌨️ Type Manually takes over);
+    # a detect that never reported back counts as awaiting_tracking
+    if session and session["step"] == "detecting" and not _detect_timed_out(session):
+        session = None
+    if not session:
+        raise SkipHandler()  # allow other handlers (like cancel-claims)
+
+    tracking = extract_tracking_number((message.text or "").upper())
+    if not tracking:
+        if session["step"] == "awaiting_confirmation":
+            raise SkipHandler()  # not a correction: other admin text
+        await message.answer("❌ Invalid tracking number format. Please try again.")
+        return
+
+    # Save tracking number into session (manual entry overrides OCR)
+    await update_shipping_session(
+        order_id=session["order_id"],
+        detected_tracking=tracking,
+        step="awaiting_confirmation"
+    )
+
+    invoice_no = await _get_invoice_for_order(session["order_id"])
+
+    await message.answer(
+        f"📦 Tracking detected:\n<code>{tracking}</code>\n\n"
+        "Tap confirm (or reply <b>CONFIRM</b>) to mark this order as shipped.",
+        parse_mode="HTML",
+        reply_markup=_kb_confirm_tracking(invoice_no)
+    )
+
 @router.message(F.chat.type == "private")
 async def admin_text_router(message: Message):
     print("ADMIN_TEXT_ROUTER HIT:", repr(message.text))
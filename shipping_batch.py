@@ -0,0 +1,361 @@
+# shipping_batch.py
+import asyncio
+import re
+from typing import Any, Dict, List, Tuple
+
+from aiogram import Router, F
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.types import Message, CallbackQuery
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from admin_sessions import (
+    set_admin_session,
+    get_admin_session,
+    clear_admin_session,
+    set_admin_batch,
+    get_admin_batch,
+    clear_admin_batch,
+)
+from callbacks import BatchShipCB
+from config import ADMIN_ID
+from db import (
+    get_packed_orders_with_address,
+    get_issued_tracking_numbers,
+    mark_orders_shipped_bulk,
+    buffer_photo,
+    set_buffered_photo_result,
+    take_photo_buffer,
+    clear_photo_buffer,
+)
+from ocr_jobs import OCR_MAX_ATTEMPTS, OCR_TIMEOUT_SECONDS, submit_ocr_job
+from tracking_candidates import build_tracking_index, resolve_tracking_bulk
+
+router = Router()
+
+BATCH_QUIET_SECONDS = 4   # same debounce as the CSV photo upload
+# A label whose OCR hasn't reported this long after the album's last
+# photo was lost (job dropped, instance died); the batch goes ahead
+# without its text instead of waiting for the hourly prune
+BATCH_OCR_DEADLINE_SECONDS = OCR_MAX_ATTEMPTS * (OCR_TIMEOUT_SECONDS + 5) + 30
+MIN_MATCH_SCORE = 2.0     # postal code alone, or full recipient name
+PHOTO_KIND = "batch_ship"
+
+# Batch state is shared by all bot instances:
+#   photo_buffer (db.py)   photos received, OCR pending/done
+#   admin batch (session)  {"labels": [...], "matches": [...]} so far
+
+
+# ======================================================
+# LABEL ↔ ORDER MATCHING
+# ======================================================
+
+def _label_score(text: str, order) -> float:
+    upper = text.upper()
+    compact = re.sub(r"[^A-Z0-9]", "", upper)
+    tokens = set(re.sub(r"[^A-Z0-9]", " ", upper).split())
+
+    score = 0.0
+
+    postal = re.sub(r"\D", "", order["postal_code"] or "")
+    if len(postal) == 6 and postal in compact:
+        score += 2.0
+
+    name = re.sub(r"[^A-Z0-9]", " ", (order["name"] or "").upper())
+    name_tokens = [t for t in name.split() if len(t) >= 2]
+    if name_tokens:
+        score += 2.0 * sum(t in tokens for t in name_tokens) / len(name_tokens)
+
+    return score
+
+
+def match_labels(
+    labels: List[Dict[str, Any]],
+    orders,
+    issued: Dict[str, str] | None = None,
+) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Greedy one-to-one assignment of OCR'd labels to packed orders,
+    best score first. labels = [{file_id, text, tracking}, ...]
+    issued = {tracking: invoice_no} of numbers already used.
+    Returns (matches, unmatched).
+    """
+    issued = issued or {}
+    unmatched = []
+    candidates = []
+    seen_tracking = set()
+
+    rejected = set()
+
+    for li, label in enumerate(labels):
+        tracking = label["tracking"]
+        if not tracking:
+            rejected.add(li)
+            unmatched.append({"file_id": label["file_id"], "reason": "no tracking number"})
+            continue
+        if tracking in seen_tracking:
+            rejected.add(li)
+            unmatched.append({"file_id": label["file_id"], "reason": f"duplicate {tracking}"})
+            continue
+        if tracking in issued:
+            rejected.add(li)
+            unmatched.append({
+                "file_id": label["file_id"],
+                "reason": f"{tracking} already used on {issued[tracking]}",
+            })
+            continue
+        seen_tracking.add(tracking)
+
+        for oi, order in enumerate(orders):
+            score = _label_score(label["text"], order)
+            if score >= MIN_MATCH_SCORE:
+                candidates.append((score, li, oi))
+
+    candidates.sort(key=lambda c: c[0], reverse=True)
+
+    matches = []
+    used_labels = set()
+    used_orders = set()
+    for score, li, oi in candidates:
+        if li in used_labels or oi in used_orders:
+            continue
+        used_labels.add(li)
+        used_orders.add(oi)
+        order = orders[oi]
+        matches.append({
+            "file_id": labels[li]["file_id"],
+            "tracking": labels[li]["tracking"],
+            "order_id": order["id"],
+            "invoice_no": order["invoice_no"],
+            "username": order["username"],
+            "score": score,
+            "confidence": labels[li].get("confidence"),
+        })
+
+    for li, label in enumerate(labels):
+        if li not in used_labels and li not in rejected:
+            unmatched.append({
+                "file_id": label["file_id"],
+                "reason": f"{label['tracking']} — no matching packed order",
+            })
+
+    return matches, unmatched
+
+
+# ======================================================
+# BATCH SESSION
+# ======================================================
+
+async def start_batch_shipping(bot, admin_id: int):
+    await clear_photo_buffer(admin_id, PHOTO_KIND)
+    set_admin_batch(admin_id, {"labels": [], "matches": []})
+    set_admin_session(admin_id, "batch_ship_photos", None)
+
+    await bot.send_message(
+        admin_id,
+        "📦 <b>Batch Shipping</b>\n\n"
+        "📸 Send all label photos (albums are fine).\n"
+        "I'll read each label and match it to a packed order.",
+        parse_mode="HTML",
+    )
+
+
+async def cancel_batch(admin_id: int):
+    clear_admin_batch(admin_id)
+    await clear_photo_buffer(admin_id, PHOTO_KIND)
+
+
+def _batch_active(admin_id: int) -> bool:
+    sess = get_admin_session(admin_id)
+    return bool(sess) and sess.get("session_type") == "batch_ship_photos"
+
+
+@router.message(F.chat.type == "private", F.from_user.id == ADMIN_ID, F.photo)
+async def batch_label_photo(message: Message):
+    admin_id = message.from_user.id
+
+    if not _batch_active(admin_id) or get_admin_batch(admin_id) is None:
+        raise SkipHandler()
+
+    photo = message.photo[-1]
+    fresh = await buffer_photo(
+        admin_id,
+        PHOTO_KIND,
+        file_id=photo.file_id,
+        file_unique_id=photo.file_unique_id,
+        message_id=message.message_id,
+        pending=True,
+    )
+    if not fresh:
+        return
+
+    # OCR runs on this instance; the result goes back into the buffer
+    queued = submit_ocr_job(
+        photo.file_id,
+        chat_id=message.chat.id,
+        file_unique_id=photo.file_unique_id,
+        on_result=_on_batch_ocr,
+        context={"admin_id": admin_id, "file_unique_id": photo.file_unique_id},
+    )
+    if not queued:
+        await set_buffered_photo_result(admin_id, PHOTO_KIND, photo.file_unique_id, "", None)
+
+    asyncio.create_task(_report_after_quiet(message.bot, admin_id))
+
+
+async def _on_batch_ocr(bot, result):
+    admin_id = result["context"]["admin_id"]
+
+    await set_buffered_photo_result(
+        admin_id,
+        PHOTO_KIND,
+        result["context"]["file_unique_id"],
+        result["text"] or "",
+        result["tracking"],
+    )
+    await _maybe_report(bot, admin_id)
+
+
+async def _report_after_quiet(bot, admin_id: int):
+    # +1s so the quiet check (DB clock) passes for the last photo
+    await asyncio.sleep(BATCH_QUIET_SECONDS + 1)
+    await _maybe_report(bot, admin_id)
+
+    # Normally the last OCR result reports; this covers a lost one
+    await asyncio.sleep(BATCH_OCR_DEADLINE_SECONDS - BATCH_QUIET_SECONDS)
+    await _maybe_report(bot, admin_id)
+
+
+async def _maybe_report(bot, admin_id: int):
+    """
+    Posts the match summary once photos stopped arriving and every
+    queued OCR job has reported back (or missed the deadline, see
+    BATCH_OCR_DEADLINE_SECONDS). Exactly one instance takes the
+    buffered photos; labels accumulate across albums.
+    """
+    photos = await take_photo_buffer(
+        admin_id,
+        PHOTO_KIND,
+        BATCH_QUIET_SECONDS,
+        pending_seconds=BATCH_OCR_DEADLINE_SECONDS,
+    )
+    if not photos:
+        return
+
+    batch = get_admin_batch(admin_id)
+    if batch is None or not _batch_active(admin_id):
+        return  # cancelled meanwhile
+
+    batch["labels"].extend(
+        {"file_id": p["file_id"], "text": p["text"] or ""}
+        for p in photos
+    )
+
+    orders = await get_packed_orders_with_address()
+    issued = {r["tracking_number"]: r["invoice_no"] for r in await get_issued_tracking_numbers()}
+
+    # Re-rank every label's candidates against numbers already issued,
+    # so a misread of a used label snaps to it and gets flagged
+    results = batch["labels"]
+    resolved = resolve_tracking_bulk(
+        [r["text"] for r in results],
+        build_tracking_index(issued),
+    )
+    labels = [
+        {
+            "file_id": r["file_id"],
+            "text": r["text"],
+            "tracking": best["tracking"] if best else None,
+            "confidence": best["confidence"] if best else None,
+        }
+        for r, best in zip(results, resolved)
+    ]
+
+    matches, unmatched = match_labels(labels, orders, issued)
+    batch["matches"] = matches
+    set_admin_batch(admin_id, batch)
+
+    lines = [f"📦 <b>Batch: {len(labels)} label(s)</b>", ""]
+    for m in matches:
+        flag = "✅" if (m["confidence"] or 0) >= 0.8 else "🟡"  # low-confidence read
+        lines.append(
+            f"{flag} <code>{m['invoice_no']}</code> @{m['username'] or 'Unknown'} → "
+            f"<code>{m['tracking']}</code>"
+        )
+    for i, u in enumerate(unmatched, start=1):
+        lines.append(f"⚠️ Unmatched label {i}: {u['reason']}")
+
+    if any((m["confidence"] or 0) < 0.8 for m in matches):
+        lines.append("\n🟡 = low-confidence read, double-check before shipping.")
+    if unmatched:
+        lines.append("\nUnmatched labels can be shipped one by one from 🚚 Orders Ready To Ship.")
+
+    kb = InlineKeyboardBuilder()
+    if matches:
+        kb.button(
+            text=f"🚚 Ship {len(matches)} Matched Order(s)",
+            callback_data=BatchShipCB(action="confirm").pack(),
+        )
+    kb.button(text="❌ Cancel Batch", callback_data=BatchShipCB(action="cancel").pack())
+    kb.adjust(1)
+
+    await bot.send_message(
+        admin_id,
+        "\n".join(lines),
+        parse_mode="HTML",
+        reply_markup=kb.as_markup(),
+    )
+
+
+# ======================================================
+# CONFIRM / CANCEL
+# ======================================================
+
+@router.callback_query(BatchShipCB.filter(F.action == "cancel"))
+async def batch_cancel(cb: CallbackQuery):
+    await cancel_batch(cb.from_user.id)
+    clear_admin_session(cb.from_user.id)
+    await cb.answer("Batch cancelled")
+    await cb.bot.send_message(cb.from_user.id, "✅ Batch shipping cancelled.")
+
+
+@router.callback_query(BatchShipCB.filter(F.action == "confirm"))
+async def batch_confirm(cb: CallbackQuery):
+    if cb.from_user.id != ADMIN_ID:
+        await cb.answer("Unauthorized", show_alert=True)
+        return
+
+    batch = get_admin_batch(cb.from_user.id)
+    if not batch or not batch["matches"]:
+        await cb.answer("❌ No batch awaiting confirmation.", show_alert=True)
+        return
+
+    await cb.answer("Marking orders as shipped…")
+
+    shipped = await mark_orders_shipped_bulk([
+        (m["order_id"], m["tracking"], m["file_id"])
+        for m in batch["matches"]
+    ])
+
+    await cancel_batch(cb.from_user.id)
+    clear_admin_session(cb.from_user.id)
+
+    skipped = len(batch["matches"]) - len(shipped)
+    text = f"✅ {len(shipped)} order(s) marked as shipped."
+    if skipped:
+        text += f"\n⚠️ {skipped} skipped (no longer packed)."
+    await cb.bot.send_message(cb.from_user.id, text)
+
+    # Notify buyers
+    for row in shipped:
+        try:
+            await cb.bot.send_photo(
+                chat_id=row["user_id"],
+                photo=row["shipping_proof_file_id"],
+                caption=(
+                    "📦 <b>Your order has been shipped!</b>\n"
+                    f"Tracking: <code>{row['tracking_number']}</code>"
+                ),
+                parse_mode="HTML",
+            )
+        except Exception as e:
+            print("Shipped notify failed:", row["invoice_no"], e)
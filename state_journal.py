@@ -0,0 +1,184 @@
+# state_journal.py
+
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from db import json_dumps, json_loads
+
+# Local append-only journal of session store mutations.
+#
+#   <dir>/snapshot.jsonl  full state at the last compaction
+#   <dir>/journal.jsonl   every set/delete since then, one JSON line each
+#
+# Appends are buffered and fsync'd in batches every
+# STATE_JOURNAL_FSYNC_INTERVAL, so a crash loses at most that window.
+# Startup replays snapshot + journal into memory without touching the DB.
+
+STATE_JOURNAL_DIR = os.getenv("STATE_JOURNAL_DIR", "state")  # "" disables
+STATE_JOURNAL_FSYNC_INTERVAL = float(os.getenv("STATE_JOURNAL_FSYNC_INTERVAL", "0.05"))
+STATE_JOURNAL_COMPACT_BYTES = int(os.getenv("STATE_JOURNAL_COMPACT_BYTES", str(4 * 1024 * 1024)))
+
+Record = Tuple[str, str, Any]   # (namespace, key, value | None)
+
+_file = None
+_unsynced = False
+_fsync_task: Optional[asyncio.Task] = None
+
+
+def journal_enabled() -> bool:
+    return bool(STATE_JOURNAL_DIR)
+
+
+def _path(name: str) -> str:
+    return os.path.join(STATE_JOURNAL_DIR, name)
+
+
+def _read_lines(path: str) -> List[Record]:
+    records = []
+    if not os.path.exists(path):
+        return records
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                ns, key, value = json_loads(line)
+            except ValueError:
+                break  # torn tail write from a crash; nothing valid after it
+            records.append((ns, key, value))
+    return records
+
+
+def _fsync_dir():
+    fd = os.open(STATE_JOURNAL_DIR, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# ===========================
+# STARTUP
+# ===========================
+
+def open_journal() -> Tuple[Dict[Tuple[str, str], Any], Dict[Tuple[str, str], Any], bool]:
+    """
+    Replays snapshot + journal and opens the journal for appends.
+    Returns (state, tail, has_snapshot): state is every live
+    (ns, key) → value, tail is the subset written after the last
+    compaction (possibly never flushed to the backend).
+    """
+    global _file
+
+    os.makedirs(STATE_JOURNAL_DIR, exist_ok=True)
+
+    has_snapshot = os.path.exists(_path("snapshot.jsonl"))
+    state: Dict[Tuple[str, str], Any] = {}
+    for ns, key, value in _read_lines(_path("snapshot.jsonl")):
+        state[(ns, key)] = value
+
+    tail: Dict[Tuple[str, str], Any] = {}
+    for ns, key, value in _read_lines(_path("journal.jsonl")):
+        tail[(ns, key)] = value
+
+    for k, value in tail.items():
+        if value is None:
+            state.pop(k, None)
+        else:
+            state[k] = value
+
+    _file = open(_path("journal.jsonl"), "a", encoding="utf-8")
+    return state, tail, has_snapshot
+
+
+async def start_journal_sync():
+    global _fsync_task
+    if _fsync_task is None:
+        _fsync_task = asyncio.create_task(_fsync_loop())
+
+
+async def close_journal():
+    global _fsync_task, _file
+
+    if _fsync_task is not None:
+        _fsync_task.cancel()
+        await asyncio.gather(_fsync_task, return_exceptions=True)
+        _fsync_task = None
+
+    if _file is not None:
+        _sync()
+        _file.close()
+        _file = None
+
+
+# ===========================
+# APPEND / FSYNC
+# ===========================
+
+def journal_append(ns: str, key: str, value: Any):
+    """
+    Buffered append; durable after the next batched fsync.
+    """
+    global _unsynced
+
+    if _file is None:
+        return
+
+    _file.write(json_dumps([ns, key, value]) + "\n")
+    _unsynced = True
+
+
+def _sync():
+    global _unsynced
+    _unsynced = False
+    _file.flush()
+    os.fsync(_file.fileno())
+
+
+async def _fsync_loop():
+    while True:
+        await asyncio.sleep(STATE_JOURNAL_FSYNC_INTERVAL)
+        if _unsynced and _file is not None:
+            try:
+                await asyncio.to_thread(_sync)
+            except Exception as e:
+                print("Journal fsync failed:", e)
+
+
+# ===========================
+# COMPACTION
+# ===========================
+
+def journal_size() -> int:
+    if _file is None:
+        return 0
+    return _file.tell()
+
+
+def compact_journal(state: Dict[Tuple[str, str], Any], pending: Dict[Tuple[str, str], Any]):
+    """
+    Rewrites the snapshot from `state` and starts an empty journal
+    holding only `pending` (writes not yet flushed to the backend).
+    Crash-safe: the snapshot is replaced by atomic rename, and an old
+    journal replayed on top of a new snapshot is harmless.
+    """
+    global _file
+
+    if _file is None:
+        return
+
+    tmp = _path("snapshot.jsonl.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for (ns, key), value in state.items():
+            if value is not None:
+                f.write(json_dumps([ns, key, value]) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _path("snapshot.jsonl"))
+
+    _file.close()
+    _file = open(_path("journal.jsonl"), "w", encoding="utf-8")
+    for (ns, key), value in pending.items():
+        journal_append(ns, key, value)
+    _sync()
+    _fsync_dir()
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The bot is a flat set of top-level modules; make them importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py requires these at import time; handler modules import it
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("CHANNEL_ID", "-1001")
@@ -0,0 +1,51 @@
+from claims_repo import split_allocation
+
+
+def req(user_id, qty):
+    return {"user_id": user_id, "username": f"u{user_id}", "qty": qty}
+
+
+def granted(split):
+    return [(w["user_id"], w["qty"]) for w in split["winners"]]
+
+
+def test_arrival_order_until_stock_runs_out():
+    split = split_allocation([req(1, 2), req(2, 2), req(3, 1)], left=3, holders=set())
+    assert granted(split) == [(1, 2), (2, 1)]
+    assert [r["user_id"] for r in split["waitlisted"]] == [3]
+    assert [r["user_id"] for r in split["losers"]] == [3]
+
+
+def test_partial_grant_is_not_waitlisted():
+    split = split_allocation([req(1, 5)], left=2, holders=set())
+    assert granted(split) == [(1, 2)]
+    assert split["waitlisted"] == []
+
+
+def test_claim_all_takes_what_is_left():
+    split = split_allocation([req(1, 1), req(2, None)], left=4, holders=set())
+    assert granted(split) == [(1, 1), (2, 3)]
+
+
+def test_claim_all_after_sell_out_waits_for_one():
+    split = split_allocation([req(1, 2), req(2, None)], left=2, holders=set())
+    assert split["waitlisted"] == [req(2, 1)]
+
+
+def test_holders_and_zero_qty_are_plain_losers():
+    split = split_allocation([req(1, 1), req(2, 0), req(3, 1)], left=5, holders={1})
+    assert granted(split) == [(3, 1)]
+    assert split["waitlisted"] == []
+    assert [r["user_id"] for r in split["losers"]] == [1, 2]
+
+
+def test_waitlist_keeps_request_order():
+    order = [req(u, 1) for u in (5, 3, 9, 1)]
+    split = split_allocation(order, left=1, holders=set())
+    assert granted(split) == [(5, 1)]
+    assert [r["user_id"] for r in split["waitlisted"]] == [3, 9, 1]
+
+
+def test_never_grants_more_than_stock():
+    split = split_allocation([req(u, 3) for u in range(10)], left=7, holders=set())
+    assert sum(q for _, q in granted(split)) == 7
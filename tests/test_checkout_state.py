@@ -0,0 +1,56 @@
+from checkout_state import CheckoutStage, CheckoutState, ShippingAddress
+
+ADDRESS = ShippingAddress("Tan Wei", "1 Orchard Rd", "#05-01", "238823", "91234567")
+
+
+def test_round_trip_full_state():
+    state = CheckoutState(
+        stage=CheckoutStage.CONFIRM_ADDRESS,
+        cards_total=42.5,
+        delivery_fee=3.9,
+        invoice_no="INV-000123",
+        delivery_method="mail",
+        temp_address=ADDRESS,
+    )
+    back = CheckoutState.from_dict(state.to_dict())
+
+    assert back.stage is CheckoutStage.CONFIRM_ADDRESS
+    assert back.cards_total == 42.5
+    assert back.delivery_fee == 3.9
+    assert back.invoice_no == "INV-000123"
+    assert back.delivery_method == "mail"
+    assert back.temp_address == ADDRESS
+    assert isinstance(back.temp_address, ShippingAddress)
+
+
+def test_storage_form_is_plain_dict():
+    data = CheckoutState(
+        stage=CheckoutStage.AWAITING_PAYMENT,
+        cards_total=10.0,
+        delivery_fee=2.0,
+        temp_address=ADDRESS,
+    ).to_dict()
+
+    assert data == {
+        "stage": "awaiting_payment",
+        "cards_total": 10.0,
+        "delivery_fee": 2.0,
+        "total": 12.0,
+        "temp_address": ADDRESS._asdict(),
+    }
+
+
+def test_default_state_round_trips():
+    back = CheckoutState.from_dict(CheckoutState().to_dict())
+    assert back.stage is CheckoutStage.IDLE
+    assert back.total == 0.0
+    assert back.invoice_no is None
+    assert back.delivery_method is None
+    assert back.temp_address is None
+
+
+def test_from_dict_tolerates_old_and_bad_data():
+    back = CheckoutState.from_dict({"stage": "no_such_stage", "cards_total": "7.5"})
+    assert back.stage is CheckoutStage.IDLE
+    assert back.cards_total == 7.5
+    assert CheckoutState.from_dict({}).stage is CheckoutStage.IDLE
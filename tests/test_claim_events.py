@@ -0,0 +1,64 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import claim_events as ce
+
+OLD = (-100, 1)
+NEW = (-100, 2)
+
+
+@pytest.fixture(autouse=True)
+def fresh_projections():
+    for d in (ce._initial, ce._claims, ce._bags, ce._gaps):
+        d.clear()
+    yield
+    for d in (ce._initial, ce._claims, ce._bags, ce._gaps):
+        d.clear()
+
+
+def ev(event_type, post, user_id, qty=1):
+    return {
+        "event_type": event_type,
+        "channel_chat_id": post[0],
+        "channel_message_id": post[1],
+        "user_id": user_id,
+        "username": f"u{user_id}",
+        "qty": qty,
+        "created_at": datetime.now(timezone.utc),
+    }
+
+
+def test_claims_and_release_update_remaining_and_bags():
+    ce._initial[NEW] = 5
+    ce._apply(ev(ce.EV_CLAIMED, NEW, 7, 2))
+    ce._apply(ev(ce.EV_CLAIMED, NEW, 8, 1))
+    ce._apply(ev(ce.EV_CLAIMED, NEW, 7, 1))
+    assert ce.projected_remaining(NEW) == 1
+    assert [c["user_id"] for c in ce.projected_claim_order(NEW)] == [7, 8]
+
+    ce._apply(ev(ce.EV_EXPIRED, NEW, 7, 3))
+    assert ce.projected_remaining(NEW) == 4
+    assert 7 not in ce._bags
+
+
+def test_events_for_unlisted_posts_are_ignored():
+    ce._initial[NEW] = 3
+    ce._apply(ev(ce.EV_CLAIMED, OLD, 7))
+    assert OLD not in ce._claims
+    assert 7 not in ce._bags
+
+
+def test_cleared_listings_drop_the_old_sale():
+    ce._initial[OLD] = 2
+    ce._initial[NEW] = 2
+    ce._apply(ev(ce.EV_CLAIMED, OLD, 7))
+    ce._apply(ev(ce.EV_CLAIMED, NEW, 7))
+    ce._apply(ev(ce.EV_CLAIMED, OLD, 8))
+
+    del ce._initial[OLD]  # clear_card_listings + new upload
+    ce._drop_unlisted()
+
+    assert OLD not in ce._claims
+    assert list(ce._bags) == [7]
+    assert list(ce._bags[7]) == [NEW]
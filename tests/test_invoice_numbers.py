@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+import invoice_numbers
+
+BLOCK = invoice_numbers.INVOICE_BLOCK_SIZE
+
+
+@pytest.fixture(autouse=True)
+def fake_sequence(monkeypatch):
+    # invoice_no_seq: INCREMENT BY the block size, first value 1
+    calls = []
+
+    async def reserve():
+        calls.append(1)
+        return 1 + BLOCK * (len(calls) - 1), BLOCK
+
+    monkeypatch.setattr(invoice_numbers, "reserve_invoice_block", reserve)
+    monkeypatch.setattr(invoice_numbers, "_refill_lock", asyncio.Lock())
+    monkeypatch.setattr(invoice_numbers, "_refill_task", None)
+    invoice_numbers._numbers.clear()
+    return calls
+
+
+def take(n):
+    async def run():
+        out = [await invoice_numbers.next_invoice_no() for _ in range(n)]
+        if invoice_numbers._refill_task:
+            await invoice_numbers._refill_task
+        return out
+    return asyncio.run(run())
+
+
+def test_format():
+    assert invoice_numbers.format_invoice_no(7) == "INV-000007"
+    assert invoice_numbers.format_invoice_no(1234567) == "INV-1234567"
+
+
+def test_numbers_are_sequential_within_a_block(fake_sequence):
+    assert take(3) == ["INV-000001", "INV-000002", "INV-000003"]
+    assert len(fake_sequence) == 1
+
+
+def test_next_block_is_prefetched_before_running_out(fake_sequence):
+    numbers = take(BLOCK - invoice_numbers.REFILL_BELOW + 1)
+    assert len(fake_sequence) == 2
+    # the prefetched block queues up behind what's left of the first
+    assert len(invoice_numbers._numbers) == invoice_numbers.REFILL_BELOW - 1 + BLOCK
+    assert numbers[-1] == invoice_numbers.format_invoice_no(len(numbers))
+
+
+def test_numbers_never_repeat_across_blocks(fake_sequence):
+    numbers = take(BLOCK * 3)
+    assert numbers == [invoice_numbers.format_invoice_no(n) for n in range(1, BLOCK * 3 + 1)]
+    assert len(fake_sequence) == 4  # the fourth is the prefetch for what's next
+
+
+def test_refill_skips_when_enough_numbers_left(fake_sequence):
+    asyncio.run(invoice_numbers.start_invoice_allocator())
+    asyncio.run(invoice_numbers.start_invoice_allocator())
+    assert len(fake_sequence) == 1
+    assert len(invoice_numbers._numbers) == BLOCK
+
+
+def test_block_size_comes_from_the_sequence(monkeypatch):
+    # Sequence created with a larger increment than the constant
+    starts = iter([1, 1 + BLOCK * 2])
+
+    async def reserve():
+        return next(starts), BLOCK * 2
+
+    monkeypatch.setattr(invoice_numbers, "reserve_invoice_block", reserve)
+    numbers = take(BLOCK * 2 + 1)
+    assert numbers == [invoice_numbers.format_invoice_no(n) for n in range(1, BLOCK * 2 + 2)]
@@ -0,0 +1,23 @@
+import ocr_preprocess
+
+
+def test_key_names_the_pipeline(monkeypatch):
+    monkeypatch.setattr(ocr_preprocess, "np", object())  # stands in for numpy
+    numpy_key = ocr_preprocess.params_key()
+    monkeypatch.setattr(ocr_preprocess, "np", None)
+    legacy_key = ocr_preprocess.params_key()
+
+    assert numpy_key != legacy_key
+    assert legacy_key.startswith("pipeline=legacy-v")
+
+
+def test_key_changes_with_pipeline_version(monkeypatch):
+    before = ocr_preprocess.params_key()
+    monkeypatch.setattr(ocr_preprocess, "PIPELINE_VERSION", ocr_preprocess.PIPELINE_VERSION + 1)
+    assert ocr_preprocess.params_key() != before
+
+
+def test_key_is_order_independent():
+    params = dict(ocr_preprocess.PREPROCESS_PARAMS)
+    reordered = dict(reversed(list(params.items())))
+    assert ocr_preprocess.params_key(params) == ocr_preprocess.params_key(reordered)
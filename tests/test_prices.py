@@ -0,0 +1,27 @@
+import pytest
+
+from checkout import format_claim_summary, parse_price_to_float
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("$12", 12.0),
+    ("SGD 12.50", 12.5),
+    ("12.50", 12.5),
+    ("$1,200", 1200.0),
+    ("SGD 1,200.50", 1200.5),
+    ("$12,345,678", 12345678.0),
+    (15, 15.0),
+    ("TBA", 0.0),
+    (None, 0.0),
+])
+def test_parse_price_to_float(raw, expected):
+    assert parse_price_to_float(raw) == expected
+
+
+def test_claim_summary_total_uses_full_comma_price():
+    items = [
+        {"card_name": "Charizard", "price": "$1,200", "qty": 1},
+        {"card_name": "Pikachu", "price": "SGD 5", "qty": 2},
+    ]
+    _, total = format_claim_summary(items)
+    assert total == 1210.0
@@ -0,0 +1,85 @@
+import pytest
+
+import rate_limits
+
+
+@pytest.fixture(autouse=True)
+def fresh_buckets(monkeypatch):
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(rate_limits.time, "monotonic", lambda: clock["now"])
+    monkeypatch.setattr(rate_limits, "USER_BURST", 3)
+    monkeypatch.setattr(rate_limits, "USER_PER_SECOND", 0.5)
+    monkeypatch.setattr(rate_limits, "POST_BURST", 5)
+    monkeypatch.setattr(rate_limits, "POST_PER_SECOND", 1.0)
+    rate_limits._buckets.clear()
+    rate_limits._last_notice.clear()
+    rate_limits._throttled_by_user.clear()
+    for k in rate_limits._stats:
+        rate_limits._stats[k] = 0
+    return clock
+
+
+POST = (-100, 42)
+
+
+def test_user_burst_then_throttled():
+    assert [rate_limits.admit(1, POST) for _ in range(4)] == [True, True, True, False]
+    s = rate_limits.throttle_stats()
+    assert s["admitted"] == 3
+    assert s["throttled_user"] == 1
+    assert s["throttled_post"] == 0
+
+
+def test_user_bucket_refills(fresh_buckets):
+    for _ in range(3):
+        rate_limits.admit(1, POST)
+    assert not rate_limits.admit(1, POST)
+
+    fresh_buckets["now"] += 2  # 0.5 tokens/s → one token
+    assert rate_limits.admit(1, POST)
+    assert not rate_limits.admit(1, POST)
+
+
+def test_post_bucket_shared_across_users():
+    results = [rate_limits.admit(user_id, POST) for user_id in range(6)]
+    assert results == [True] * 5 + [False]
+    assert rate_limits.throttle_stats()["throttled_post"] == 1
+    # another post is unaffected
+    assert rate_limits.admit(99, (-100, 43))
+
+
+def test_refused_request_takes_no_tokens():
+    for _ in range(3):
+        rate_limits.admit(1, POST)
+    rate_limits.admit(1, POST)  # refused by the user bucket
+    # the post bucket still has 2 of its 5 tokens
+    assert rate_limits.admit(2, POST)
+    assert rate_limits.admit(3, POST)
+    assert not rate_limits.admit(4, POST)
+
+
+def test_both_buckets_empty_counts_both():
+    for user_id in range(5):
+        rate_limits.admit(user_id, POST)
+    for _ in range(2):
+        rate_limits.admit(0, POST)  # post empty, user 0 still has tokens
+    rate_limits._buckets[("user", 0)] = (0.0, rate_limits.time.monotonic())  # now both empty
+    assert not rate_limits.admit(0, POST)
+    s = rate_limits.throttle_stats()
+    assert s["throttled_user"] == 1
+    assert s["throttled_post"] == 3
+
+
+def test_throttled_users_are_bounded(monkeypatch):
+    monkeypatch.setattr(rate_limits, "MAX_THROTTLED_USERS", 10)
+    monkeypatch.setattr(rate_limits, "USER_BURST", 0)
+    for user_id in range(50):
+        rate_limits.admit(user_id, POST)
+    assert len(rate_limits._throttled_by_user) <= 10
+
+
+def test_slow_down_notice_once_per_window(fresh_buckets):
+    assert rate_limits.should_notify_throttled(1)
+    assert not rate_limits.should_notify_throttled(1)
+    fresh_buckets["now"] += rate_limits.SLOWDOWN_NOTICE_SECONDS
+    assert rate_limits.should_notify_throttled(1)
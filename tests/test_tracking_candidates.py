@@ -0,0 +1,68 @@
+from tracking_candidates import (
+    build_tracking_index,
+    candidates_from_text,
+    is_valid_s10,
+    resolve_tracking,
+    s10_check_digit,
+)
+
+VALID = "RR123456785SG"  # 8+12+12+8+15+30+63+56 = 204, 11 - 204 % 11 = 5
+
+
+def test_check_digit():
+    assert s10_check_digit("12345678") == 5
+    assert s10_check_digit("47312482") == 9  # UPU S10 worked example
+
+
+def test_check_digit_wraps_ten_and_eleven():
+    assert s10_check_digit("02000000") == 0  # 12 % 11 = 1 → 10 → 0
+    assert s10_check_digit("00000000") == 5  # 0 % 11 = 0 → 11 → 5
+
+
+def test_is_valid_s10():
+    assert is_valid_s10(VALID)
+    assert not is_valid_s10("RR123456784SG")
+    assert not is_valid_s10("RR1234S6785SG")
+
+
+def test_clean_read_needs_no_corrections():
+    assert candidates_from_text(f"Tracking: {VALID}") == {VALID: 0}
+
+
+def test_noise_and_confusions_are_corrected_by_position():
+    # S → 5 in the serial, 6 → G in the suffix; separators dropped
+    assert candidates_from_text("RR 1234S678-5 S6") == {VALID: 2}
+
+
+def test_digit_in_prefix_reads_as_letter():
+    found = candidates_from_text("8R123456785SG")
+    assert found == {"BR123456785SG": 1}
+
+
+def test_unreadable_serial_is_rejected():
+    assert candidates_from_text("RR1234X6785SG") == {}
+
+
+def test_resolve_prefers_checksum_valid():
+    best = resolve_tracking(VALID)
+    assert best["tracking"] == VALID
+    assert best["source"] == "checksum"
+    assert best["corrections"] == 0
+
+
+def test_resolve_snaps_invalid_read_onto_known_number():
+    index = build_tracking_index([VALID])
+    best = resolve_tracking("RR123456795SG", index)  # check digit would be 9
+    assert best["tracking"] == VALID
+    assert best["source"] == "index_near"
+    assert best["corrections"] == 1
+
+
+def test_resolve_exact_index_hit():
+    best = resolve_tracking(VALID, build_tracking_index({VALID: {"order_id": 7}}))
+    assert best["source"] == "index"
+    assert best["confidence"] == 0.99
+
+
+def test_resolve_nothing():
+    assert resolve_tracking("no tracking here") is None
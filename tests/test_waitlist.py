@@ -0,0 +1,109 @@
+import pytest
+
+import waitlist
+from db import json_dumps, plan_promotions
+
+POST_A = (-100, 1)
+POST_B = (-100, 2)
+
+
+def waiter(post, user_id, qty, remaining, base_order=0):
+    return {
+        "channel_chat_id": post[0],
+        "channel_message_id": post[1],
+        "user_id": user_id,
+        "username": f"u{user_id}",
+        "qty": qty,
+        "card_name": f"card {post[1]}",
+        "price": "$5",
+        "claim_buttons": False,
+        "remaining_qty": remaining,
+        "base_order": base_order,
+    }
+
+
+def summary(grants):
+    return [(g["channel_message_id"], g["user_id"], g["qty"], g["remaining"]) for g in grants]
+
+
+# ===========================
+# PROMOTION ORDER (db.plan_promotions)
+# ===========================
+
+def test_promotes_in_join_order_while_stock_lasts():
+    grants = plan_promotions([
+        waiter(POST_A, 7, 1, remaining=2),
+        waiter(POST_A, 3, 1, remaining=2),
+        waiter(POST_A, 5, 1, remaining=2),
+    ])
+    assert summary(grants) == [(1, 7, 1, 0), (1, 3, 1, 0)]
+
+
+def test_partial_grant_for_larger_asks():
+    grants = plan_promotions([
+        waiter(POST_A, 1, 3, remaining=2),
+        waiter(POST_A, 2, 1, remaining=2),
+    ])
+    assert summary(grants) == [(1, 1, 2, 0)]
+
+
+def test_claim_order_continues_after_active_claims():
+    grants = plan_promotions([
+        waiter(POST_A, 1, 2, remaining=3, base_order=4),
+        waiter(POST_A, 2, 1, remaining=3, base_order=4),
+    ])
+    assert [g["start_order"] for g in grants] == [4, 6]
+
+
+def test_posts_have_separate_stock():
+    grants = plan_promotions([
+        waiter(POST_A, 1, 1, remaining=1),
+        waiter(POST_A, 2, 1, remaining=1),
+        waiter(POST_B, 2, 1, remaining=3),
+        waiter(POST_B, 3, 1, remaining=3),
+    ])
+    assert summary(grants) == [(1, 1, 1, 0), (2, 2, 1, 1), (2, 3, 1, 1)]
+
+
+def test_never_grants_more_than_stock():
+    waiters = [waiter(POST_A, u, 2, remaining=5) for u in range(10)]
+    assert sum(g["qty"] for g in plan_promotions(waiters)) == 5
+
+
+def test_nothing_to_promote():
+    assert plan_promotions([]) == []
+
+
+# ===========================
+# IN-MEMORY MIRROR
+# ===========================
+
+@pytest.fixture(autouse=True)
+def empty_mirror():
+    waitlist._waiting.clear()
+    yield
+    waitlist._waiting.clear()
+
+
+def test_positions_follow_join_order():
+    waitlist._apply("join", POST_A, [10, 11, 12])
+    waitlist._apply("join", POST_A, [10])  # rejoining keeps the place
+    assert [waitlist.waitlist_position(POST_A, u) for u in (10, 11, 12)] == [1, 2, 3]
+
+    waitlist._apply("leave", POST_A, [10])
+    assert waitlist.waitlist_position(POST_A, 10) is None
+    assert waitlist.waitlist_position(POST_A, 12) == 2
+
+
+def test_empty_list_is_dropped():
+    waitlist._apply("join", POST_A, [10])
+    waitlist._apply("leave", POST_A, [10])
+    waitlist._apply("leave", POST_B, [10])  # unknown post is a no-op
+    assert waitlist._waiting == {}
+    assert waitlist.waitlist_position(POST_A, 10) is None
+
+
+def test_remote_change_payload():
+    payload = json_dumps({"op": "join", "post": list(POST_B), "users": [5, 6]})
+    waitlist._on_remote_change(payload)
+    assert waitlist.waitlist_position(POST_B, 6) == 2
@@ -0,0 +1,210 @@
+# tracking_candidates.py
+# Confusion-aware SingPost tracking number search over OCR text.
+#
+# Format (UPU S10): 2 letters + 8-digit serial + check digit + "SG".
+# OCR confusions are only corrected where the position demands it
+# (letters in the prefix/suffix, digits in the middle), and candidates
+# are ranked by check digit and, when given, an index of known numbers.
+
+import re
+from itertools import product
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+TRACKING_LEN = 13
+SUFFIX = "SG"
+
+# OCR char → plausible intended char(s), per position class
+TO_LETTER = {
+    "0": "ODQ",
+    "1": "IL",
+    "2": "Z",
+    "4": "A",
+    "5": "S",
+    "6": "G",
+    "7": "T",
+    "8": "B",
+}
+TO_DIGIT = {
+    "O": "0",
+    "D": "0",
+    "Q": "0",
+    "U": "0",
+    "I": "1",
+    "L": "1",
+    "J": "1",
+    "Z": "2",
+    "A": "4",
+    "S": "5",
+    "G": "6",
+    "T": "7",
+    "B": "8",
+}
+SUFFIX_READS = ({"S", "5", "$"}, {"G", "6", "C"})
+
+S10_WEIGHTS = (8, 6, 4, 2, 3, 5, 9, 7)
+
+_NOISE = re.compile(r"[\s\-.·_|]+")
+
+
+# =========================
+# CHECK DIGIT
+# =========================
+def s10_check_digit(serial: str) -> int:
+    total = sum(int(d) * w for d, w in zip(serial, S10_WEIGHTS))
+    check = 11 - total % 11
+    if check == 10:
+        return 0
+    if check == 11:
+        return 5
+    return check
+
+
+def is_valid_s10(tracking: str) -> bool:
+    serial, check = tracking[2:10], tracking[10]
+    return serial.isdigit() and check.isdigit() and s10_check_digit(serial) == int(check)
+
+
+# =========================
+# CANDIDATES
+# =========================
+def _options(ch: str, pos: int) -> List[Tuple[str, int]]:
+    """
+    (char, corrections) options for one position; [] if impossible.
+    """
+    if pos < 2:
+        if ch.isalpha():
+            return [(ch, 0)]
+        return [(c, 1) for c in TO_LETTER.get(ch, "")]
+
+    if pos < 11:
+        if ch.isdigit():
+            return [(ch, 0)]
+        d = TO_DIGIT.get(ch)
+        return [(d, 1)] if d else []
+
+    want = SUFFIX[pos - 11]
+    if ch == want:
+        return [(want, 0)]
+    if ch in SUFFIX_READS[pos - 11]:
+        return [(want, 1)]
+    return []
+
+
+def candidates_from_text(text: str) -> Dict[str, int]:
+    """
+    Every plausible tracking number in OCR text, mapped to the
+    number of character corrections it needed (lowest kept).
+    """
+    clean = _NOISE.sub("", (text or "").upper())
+    found: Dict[str, int] = {}
+
+    for start in range(len(clean) - TRACKING_LEN + 1):
+        window = clean[start:start + TRACKING_LEN]
+
+        # Cheap rejects before enumerating
+        if window[11] not in SUFFIX_READS[0] or window[12] not in SUFFIX_READS[1]:
+            continue
+
+        per_pos = [_options(ch, i) for i, ch in enumerate(window)]
+        if not all(per_pos):
+            continue
+
+        for combo in product(*per_pos):
+            cand = "".join(c for c, _ in combo)
+            cost = sum(k for _, k in combo)
+            if cost < found.get(cand, TRACKING_LEN + 1):
+                found[cand] = cost
+
+    return found
+
+
+# =========================
+# KNOWN-NUMBER INDEX
+# =========================
+def build_tracking_index(numbers: Iterable[str] | Dict[str, Any]) -> Dict[str, Dict]:
+    """
+    In-memory index of issued/expected numbers. Besides exact lookup
+    it keys every number with one position masked, so a candidate one
+    character away is found in O(13) dict lookups.
+    Accepts an iterable of numbers or a {number: meta} dict.
+    """
+    if not isinstance(numbers, dict):
+        numbers = {n: None for n in numbers}
+
+    exact = {}
+    masked: Dict[str, List[str]] = {}
+
+    for num, meta in numbers.items():
+        if not num:
+            continue
+        num = num.strip().upper()
+        exact[num] = meta
+        for i in range(len(num)):
+            masked.setdefault(num[:i] + "*" + num[i + 1:], []).append(num)
+
+    return {"exact": exact, "masked": masked}
+
+
+def _near(index: Dict[str, Dict], cand: str) -> Optional[str]:
+    """
+    The single known number exactly one character from cand, if any.
+    """
+    hits = set()
+    for i in range(len(cand)):
+        hits.update(index["masked"].get(cand[:i] + "*" + cand[i + 1:], ()))
+    hits.discard(cand)
+    return hits.pop() if len(hits) == 1 else None
+
+
+# =========================
+# RANKING
+# =========================
+def _score(cand: str, cost: int, index) -> Dict[str, Any]:
+    valid = is_valid_s10(cand)
+    confidence = max(0.3, 0.9 - 0.1 * cost) + (0.05 if valid else -0.3)
+    source = "checksum" if valid else "pattern"
+
+    if index:
+        if cand in index["exact"]:
+            return {
+                "tracking": cand,
+                "confidence": round(0.99 - 0.02 * cost, 2),
+                "source": "index",
+                "corrections": cost,
+            }
+        # A checksum-valid candidate is a real (different) number;
+        # only snap invalid reads onto a neighbouring known number
+        near = None if valid else _near(index, cand)
+        if near:
+            return {
+                "tracking": near,
+                "confidence": round(0.8 - 0.05 * cost, 2),
+                "source": "index_near",
+                "corrections": cost + 1,
+            }
+
+    return {
+        "tracking": cand,
+        "confidence": round(max(0.0, confidence), 2),
+        "source": source,
+        "corrections": cost,
+    }
+
+
+def resolve_tracking(text: str, index=None) -> Optional[Dict[str, Any]]:
+    """
+    Best tracking number in OCR text:
+    {"tracking", "confidence" (0–1), "source", "corrections"} or None.
+    """
+    best = None
+    for cand, cost in candidates_from_text(text).items():
+        scored = _score(cand, cost, index)
+        if best is None or (scored["confidence"], -scored["corrections"]) > (
+            best["confidence"], -best["corrections"]
+        ):
+            best = scored
+    return best
+
+
+def resolve_tracking_bulk(texts: Iterable[str], index=None) -> List[Optional[Dict[str, Any]]]:
+    return [resolve_tracking(t, index) for t in texts]
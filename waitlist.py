@@ -0,0 +1,152 @@
+# waitlist.py
+
+import html
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+
+from cluster import multi_instance, notify, on_notify
+from db import json_dumps, json_loads, load_waitlists
+
+# Per-post waitlists for sold-out cards. A `claim` on a card with no
+# stock joins its waitlist (claim_waitlist table, see db.py); cancels,
+# admin cancels and stale-claim expiry hand freed units to the next
+# waiters in the same transaction (db.promote_waitlist), and the
+# promoted buyers get a DM here.
+#
+# The mirror below answers repeat claims from buyers who are already
+# waiting without touching the DB. It's loaded at startup, kept
+# current locally and over NOTIFY, and reloaded by the scheduler in
+# case a notification was missed.
+
+WAITLIST_CHANNEL = "bot_waitlist"
+
+Post = Tuple[int, int]  # (channel_chat_id, channel_message_id)
+
+# post → waiting user ids, in join order
+_waiting: Dict[Post, List[int]] = {}
+
+
+def waitlist_position(post: Post, user_id: int) -> Optional[int]:
+    users = _waiting.get(post)
+    if not users or user_id not in users:
+        return None
+    return users.index(user_id) + 1
+
+
+def _apply(op: str, post: Post, user_ids):
+    users = _waiting.setdefault(post, [])
+    for user_id in user_ids:
+        if op == "join":
+            if user_id not in users:
+                users.append(user_id)
+        elif user_id in users:
+            users.remove(user_id)
+    if not users:
+        del _waiting[post]
+
+
+async def _note(op: str, post: Post, user_ids: List[int]):
+    _apply(op, post, user_ids)
+    if multi_instance():
+        await notify(WAITLIST_CHANNEL, json_dumps({
+            "op": op,
+            "post": list(post),
+            "users": user_ids,
+        }))
+
+
+async def note_joined(post: Post, user_id: int):
+    await _note("join", post, [user_id])
+
+
+async def note_left(post: Post, user_id: int):
+    await _note("leave", post, [user_id])
+
+
+async def load_waitlist():
+    """
+    Rebuilds the mirror from claim_waitlist (startup + scheduler).
+    """
+    rows = await load_waitlists()
+    fresh: Dict[Post, List[int]] = {}
+    for r in rows:
+        fresh.setdefault((r["channel_chat_id"], r["channel_message_id"]), []).append(r["user_id"])
+    _waiting.clear()
+    _waiting.update(fresh)
+
+
+# ===========================
+# PROMOTIONS
+# ===========================
+
+def _promoted_text(g) -> str:
+    return (
+        "🎉 <b>You're off the waitlist!</b>\n\n"
+        f"Card: <b>{html.escape(g['card_name'])}</b>\n"
+        f"Price: {html.escape(str(g['price']))}\n"
+        f"Quantity: {g['qty']}\n\n"
+        "The claim is already yours — it shows up at checkout."
+    )
+
+
+async def notify_promoted(bot: Bot, promoted, refresh_posts: bool = True):
+    """
+    promoted = grants returned by db.promote_waitlist (already
+    committed). DMs each buyer, then refreshes caption + board once
+    per post, unless the caller already does (refresh_posts=False).
+    """
+    if not promoted:
+        return
+
+    # Local imports: claims imports this module
+    from claims import update_card_caption
+    from claims_board import schedule_board_update
+
+    posts = {}
+    for g in promoted:
+        post = (g["channel_chat_id"], g["channel_message_id"])
+        posts[post] = g  # last grant carries the post's final remaining
+        await _note("leave", post, [g["user_id"]])
+        try:
+            await bot.send_message(g["user_id"], _promoted_text(g), parse_mode="HTML")
+        except Exception as e:
+            print("Waitlist DM failed:", g["user_id"], e)
+
+    if not refresh_posts:
+        return
+
+    for post, g in posts.items():
+        schedule_board_update(
+            bot,
+            post,
+            card_name=g["card_name"],
+            remaining=g["remaining"],
+        )
+        await update_card_caption(
+            bot,
+            post[0],
+            post[1],
+            g["card_name"],
+            g["price"],
+            g["remaining"],
+            g["claim_buttons"],
+        )
+
+
+# ===========================
+# CROSS-INSTANCE
+# ===========================
+
+def _on_remote_change(payload: str):
+    msg = json_loads(payload)
+    _apply(msg["op"], tuple(msg["post"]), msg["users"])
+
+
+async def init_waitlist():
+    """
+    Called once from main.main before start_cluster.
+    """
+    if multi_instance():
+        on_notify(WAITLIST_CHANNEL, _on_remote_change)
+    await load_waitlist()